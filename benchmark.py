@@ -0,0 +1,344 @@
+#! /usr/bin/env python3
+#File:		benchmark.py
+#Desc:		Times every stage of marinegpxgrapher against synthetic tracks so we can see where the time goes and catch regressions between versions.  The tracks are made up but deterministic (same seed, same file) so numbers from different runs can be compared.  Results are written as JSON.
+
+#    marinegpxgrapher A GPX file graphing program for sailors
+#    Copyright (C) 2018  Gary Andrew Bezet
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import io
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+import contextlib
+from datetime import datetime
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+import marinegpxgrapher as mgg
+import marinegpxreplay
+
+
+#somewhere on Lake Pontchartrain
+startlat = 30.3
+startlon = -90.05
+
+#points written per chunk when generating files
+chunksize = 100000
+
+"""
+    Write a synthetic track of npts points to path, split over segments trkseg blocks
+    the boat wanders with a random walk heading at 2-8 knots logging every 1-3 seconds, seed makes it repeatable
+"""
+def maketrack(path, npts, segments=1, seed=0):
+    rng = np.random.default_rng(seed)
+
+    with open(path, 'w') as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        f.write('<gpx creator="marinegpxgrapher benchmark" version="1.1" xmlns="http://www.topografix.com/GPX/1/1">\n')
+        f.write('  <metadata>\n    <time>2018-07-29T18:53:53Z</time>\n  </metadata>\n')
+        f.write('  <trk>\n    <name>Synthetic %d point track</name>\n' % npts)
+
+        lat = startlat
+        lon = startlon
+        heading = 0.
+        stamp = np.datetime64('2018-07-28T22:00:00', 's')
+
+        segbounds = np.linspace(0, npts, segments + 1).astype(np.int64)
+        for segstart, segend in zip(segbounds[:-1], segbounds[1:]):
+            f.write('    <trkseg>\n')
+
+            for start in range(segstart, segend, chunksize):
+                n = min(chunksize, segend - start)
+
+                headings = heading + np.cumsum(rng.normal(0, 3, n))
+                speeds = rng.uniform(2, 8, n)
+                steps = rng.integers(1, 4, n)
+
+                #knots * hours = nautical miles, one nautical mile is a minute of latitude
+                dist = speeds * steps / 3600. / 60.
+                lats = lat + np.cumsum(dist * np.cos(np.radians(headings)))
+                lons = lon + np.cumsum(dist * np.sin(np.radians(headings)) / np.cos(np.radians(lats)))
+                stamps = stamp + np.cumsum(steps).astype('timedelta64[s]')
+
+                timestrs = np.datetime_as_string(stamps, unit='s')
+                f.write(''.join('      <trkpt lat="%.9f" lon="%.9f">\n        <time>%sZ</time>\n      </trkpt>\n' % row for row in zip(lats, lons, timestrs)))
+
+                heading = headings[-1]
+                lat = lats[-1]
+                lon = lons[-1]
+                stamp = stamps[-1]
+
+            f.write('    </trkseg>\n')
+
+        f.write('  </trk>\n</gpx>\n')
+
+
+"""
+    Write a mark file with nmarks waypoints scattered over a few miles around the start
+"""
+def makemarks(path, nmarks, seed=0):
+    rng = np.random.default_rng(seed)
+    lats = startlat + rng.uniform(-0.2, 0.2, nmarks)
+    lons = startlon + rng.uniform(-0.2, 0.2, nmarks)
+
+    with open(path, 'w') as f:
+        f.write('<?xml version="1.0"?>\n')
+        f.write('<gpx version="1.1" creator="marinegpxgrapher benchmark" xmlns="http://www.topografix.com/GPX/1/1">\n')
+        for idx in range(nmarks):
+            f.write('  <wpt lat="%.9f" lon="%.9f">\n    <name>Mark %d</name>\n  </wpt>\n' % (lats[idx], lons[idx], idx))
+        f.write('</gpx>\n')
+
+
+"""
+    Distance in nautical miles from each point to the next on the WGS84 ellipsoid by Vincenty's inverse formula
+    iterated to convergence, slow but right to a fraction of a millimetre so it's what the geodesy modes are checked against
+"""
+def vincenty(lat, lon):
+    a = mgg.wgs84a
+    f = mgg.wgs84f
+    b = a * (1. - f)
+
+    reduced = np.arctan((1. - f) * np.tan(np.radians(lat)))
+    sinu1, cosu1 = np.sin(reduced[:-1]), np.cos(reduced[:-1])
+    sinu2, cosu2 = np.sin(reduced[1:]), np.cos(reduced[1:])
+    dlon = np.radians(np.diff(lon))
+
+    lam = dlon
+    for i in range(100):
+        sinlam, coslam = np.sin(lam), np.cos(lam)
+        sinsig = np.hypot(cosu2 * sinlam, cosu1 * sinu2 - sinu1 * cosu2 * coslam)
+        cossig = sinu1 * sinu2 + cosu1 * cosu2 * coslam
+        sig = np.arctan2(sinsig, cossig)
+
+        #points on top of each other have no direction, they come out as zero at the end anyway
+        safe = np.where(sinsig == 0., 1., sinsig)
+        sinalpha = cosu1 * cosu2 * sinlam / safe
+        cos2alpha = 1. - np.square(sinalpha)
+        cos2sigm = np.where(cos2alpha == 0., 0., cossig - 2. * sinu1 * sinu2 / np.where(cos2alpha == 0., 1., cos2alpha))
+        c = f / 16. * cos2alpha * (4. + f * (4. - 3. * cos2alpha))
+
+        prev = lam
+        lam = dlon + (1. - c) * f * sinalpha * (sig + c * sinsig * (cos2sigm + c * cossig * (-1. + 2. * np.square(cos2sigm))))
+        if np.max(np.abs(lam - prev)) < 1e-12:
+            break
+
+    u2 = cos2alpha * (a * a - b * b) / (b * b)
+    biga = 1. + u2 / 16384. * (4096. + u2 * (-768. + u2 * (320. - 175. * u2)))
+    bigb = u2 / 1024. * (256. + u2 * (-128. + u2 * (74. - 47. * u2)))
+    dsig = bigb * sinsig * (cos2sigm + bigb / 4. * (cossig * (-1. + 2. * np.square(cos2sigm)) - bigb / 6. * cos2sigm * (-3. + 4. * np.square(sinsig)) * (-3. + 4. * np.square(cos2sigm))))
+
+    return np.where(sinsig == 0., 0., b * biga * (sig - dsig)) / mgg.metrespernm
+
+
+"""
+    Time every geodesy mode in float64 and float32 and measure how far its distances are from the ellipsoid
+    total is the error in the distance sailed, step the worst single step in metres, span how far the track gets from the start
+"""
+def benchgeodesy(data, record, args):
+    lat = data['data']['lat']
+    lon = data['data']['lon']
+
+    #in pieces, every step of the iteration keeps a dozen arrays about
+    reference = np.concatenate([vincenty(lat[start:start + chunksize + 1], lon[start:start + chunksize + 1]) for start in range(0, lat.shape[0] - 1, chunksize)])
+    span = np.max(np.hypot(*mgg.transversemercator(lat, lon, lat[0], lon[0], np.float64)))
+
+    for mode in sorted(mgg.geodesies):
+        for dtype in ("float64", "float32"):
+
+            def steps():
+                latnm, lonnm = mgg.projectlatlon(lat, lon, lat[0], lon[0])
+                return mgg.calcdist({'data':{'lat':lat, 'lon':lon, 'latnm':latnm, 'lonnm':lonnm}})
+
+            with mgg.Options(mgg.config, geodesy=mode, dtype=dtype):
+                seconds, dist = timeit(steps, args.repeat)
+
+            total = (np.sum(dist, dtype=np.float64) / np.sum(reference) - 1.) * 100.
+            worst = np.max(np.abs(dist - reference)) * mgg.metrespernm
+
+            record("geodesy[%s,%s]" % (mode, dtype), seconds, total_error_percent=float(total), worst_step_metres=float(worst), span_nm=float(span))
+            print("%32s total distance %+.4f%%, worst step %.3f m, %.1f NM from the start" % ("", total, worst, span))
+
+
+"""
+    Run func repeat times with its printing swallowed, returns the best time in seconds and the last result
+"""
+def timeit(func, repeat):
+    best = None
+    result = None
+
+    for i in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+
+        if best == None or elapsed < best:
+            best = elapsed
+
+    return best, result
+
+
+"""
+    Time each stage of the pipeline on one track file, returns a list of result records
+"""
+def benchtrack(path, npts, segments, markpaths, args):
+    results = []
+
+    def record(stage, seconds, **extra):
+        entry = {'stage':stage, 'points':npts, 'segments':segments, 'seconds':seconds}
+        entry.update(extra)
+        results.append(entry)
+        print("%-32s %10d pts %10.1f ms" % (stage, npts, seconds * 1000.))
+
+    data = {'filename':os.path.basename(path), 'markfiles':None, 'cachekey':None}
+
+    seconds, gpxpts = timeit(lambda: mgg.parsegpx(path, data), args.repeat)
+    record("parsegpx", seconds)
+
+    seconds, timeresult = timeit(lambda: (mgg.checkdtformat(gpxpts['time'][0]), mgg.convdatetime(gpxpts['time']))[1], args.repeat)
+    record("checkdtformat/convdatetime", seconds)
+
+    data['ptcount'] = gpxpts['count']
+    data['starttime'] = timeresult[0]
+    data['data'] = {'lat':gpxpts['lat'], 'lon':gpxpts['lon'], 'time':timeresult[1]}
+
+    seconds, result = timeit(lambda: mgg.havconvlatlon(data), args.repeat)
+    record("havconvlatlon", seconds)
+
+    benchgeodesy(data, record, args)
+
+    seconds, result = timeit(lambda: mgg.calcspeed(data), args.repeat)
+    record("calcspeed", seconds)
+
+    for method in args.rollavgmethods:
+        seconds, result = timeit(lambda: mgg.calcspeed_rollavg(data, args.rollavgpts, method), args.repeat)
+        record("calcspeed_rollavg[%s]" % method, seconds, rollavg_points=args.rollavgpts)
+
+        seconds, result = timeit(lambda: mgg.calcspeed_rollavg(data, args.rollavgpts, method, args.rollavgsecs), args.repeat)
+        record("calcspeed_rollavg[%s,%gs]" % (method, args.rollavgsecs), seconds, rollavg_seconds=args.rollavgsecs)
+
+    seconds, result = timeit(lambda: mgg.calcangle(data), args.repeat)
+    record("calcangle", seconds)
+
+    for nmarks, markpath in markpaths:
+        data['markfiles'] = [markpath]
+        seconds, result = timeit(lambda: mgg.loadmarkfiles(data), args.repeat)
+        record("loadmarkfiles[marks=%d]" % nmarks, seconds, marks=nmarks)
+
+        seconds, result = timeit(lambda: mgg.markroundings(data, mgg.config['markradius']), args.repeat)
+        record("markroundings[marks=%d]" % nmarks, seconds, marks=nmarks)
+
+    def render():
+        mgg.renderfigures(data, lambda name, fig: fig.savefig(io.BytesIO(), format='png'))
+
+    #leave the biggest mark set loaded so the graphs draw marks too
+    if npts <= args.maxrenderpoints:
+        for graph in ('hist', 'time', 'angle', 'speed'):
+            with mgg.Options(mgg.config, **{flag:flag == 'show' + graph for flag in ('showhist', 'showtime', 'showangle', 'showspeed')}):
+                seconds, result = timeit(render, args.repeat)
+            record("render[%s]" % graph, seconds)
+
+        #all of them at once share one map
+        with mgg.Options(mgg.config, showhist=True, showtime=True, showangle=True, showspeed=True):
+            seconds, result = timeit(render, args.repeat)
+        record("render[all]", seconds)
+
+        #a replay frame should cost the same however long the track is
+        state = marinegpxreplay.makereplay(data)
+        frames = np.linspace(0, state['frames']['count'] - 1, 100).astype(np.int64)
+        marinegpxreplay.replaydraw(state, 0)
+
+        seconds, result = timeit(lambda: [marinegpxreplay.replaydraw(state, k) for k in frames], args.repeat)
+        record("replaydraw (per frame)", seconds / frames.shape[0])
+        plt.close(state['fig'])
+
+    else:
+        print("Skipping rendering for %d points (over --max-render-points)" % npts)
+
+    return results
+
+
+"""
+    Short description of the code being measured so results from different versions can be told apart
+"""
+def versioninfo():
+    info = {'python':platform.python_version(), 'numpy':np.__version__, 'matplotlib':matplotlib.__version__,
+            'platform':platform.platform(), 'date':datetime.now().isoformat()}
+
+    try:
+        info['commit'] = subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        info['commit'] = None
+
+    return info
+
+
+"""
+    Parses the command line arguments
+"""
+def parsecmdline():
+    parser = argparse.ArgumentParser(prog="Marine GPX Grapher benchmark",
+                                     description="Times each stage of marinegpxgrapher on synthetic tracks and writes the results as JSON.")
+
+    parser.add_argument("-n", "--sizes", help = "Track sizes in points (default 1000 10000 100000, goes up to 10000000 if you have the patience)", nargs="+", type=int, default=[1000, 10000, 100000])
+    parser.add_argument("--segments", help = "Number of trkseg blocks per track (default 1)", type=int, default=1)
+    parser.add_argument("--marks", help = "Waypoint counts for mark files (default 10 1000 10000)", nargs="+", type=int, default=[10, 1000, 10000])
+    parser.add_argument("-r", "--repeat", help = "Run each stage this many times and keep the best (default 3)", type=int, default=3)
+    parser.add_argument("-ra", "--rollavgpts", help = "Points for the rolling average (default 20)", type=int, default=20)
+    parser.add_argument("-rs", "--rollavgsecs", help = "Seconds for the time window rolling average (default 60)", type=float, default=60.)
+    parser.add_argument("-rm", "--rollavgmethods", help = "Rolling average filters to time (default all)", nargs="+", choices=["mean","ewma","median"], default=["mean","ewma","median"])
+    parser.add_argument("--max-render-points", help = "Skip rendering for tracks bigger than this (default 1000000)", type=int, default=1000000, dest="maxrenderpoints")
+    parser.add_argument("--workdir", help = "Where to write the synthetic GPX files (default a temporary directory)", type=str)
+    parser.add_argument("--seed", help = "Random seed for the synthetic tracks (default 0)", type=int, default=0)
+    parser.add_argument("-o", "--output", help = "JSON results file (default bench_output.json)", type=str, default="bench_output.json")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parsecmdline()
+
+    results = []
+    with mgg.Options(usecache=False, filterwaypoints=True, markfiles=None, maxpoints=None), tempfile.TemporaryDirectory() as tmpdir:
+        workdir = args.workdir if args.workdir else tmpdir
+        os.makedirs(workdir, exist_ok=True)
+
+        markpaths = []
+        for nmarks in args.marks:
+            markpath = os.path.join(workdir, "marks-%d.gpx" % nmarks)
+            makemarks(markpath, nmarks, args.seed)
+            markpaths.append((nmarks, markpath))
+
+        for npts in args.sizes:
+            path = os.path.join(workdir, "track-%d-%d.gpx" % (npts, args.segments))
+            print("Generating %d point track" % npts)
+            maketrack(path, npts, args.segments, args.seed)
+
+            results += benchtrack(path, npts, args.segments, markpaths, args)
+
+    with open(args.output, 'w') as f:
+        json.dump({'version':versioninfo(), 'repeat':args.repeat, 'seed':args.seed, 'results':results}, f, indent=2)
+
+    print("Results written to %s" % args.output)
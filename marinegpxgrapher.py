@@ -21,42 +21,130 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-#configuration data (probably command line)
-config = {  "hours":False,
+#default configuration, the command line (or an Options object) changes it
+defaultconfig = {  "hours":False,
             "minutes":False,
             "filename":None,
             "timecmap":"plasma",
             "speedcmap":"gist_ncar",
             "figsize":(6,6),
             "showall":True,
-            "showspeed":False,
-            "showtime":False,
-            "showhist":False,
-            "showangle":False,
+            "showspeed":True,
+            "showtime":True,
+            "showhist":True,
+            "showangle":True,
             "markfiles":None,
-            "rollavg_points":20
+            "filterwaypoints":True,
+            "rollavg_points":20,
+            "rollavg_method":"mean",
+            "rollavg_seconds":None,
+            "datetimeformat":None,
+            "usecache":True,
+            "cachedir":None,
+            "cachesize":256,
+            "batchdir":None,
+            "outdir":None,
+            "workers":None,
+            "batchformats":["png"],
+            "maxpoints":None,
+            "follow":False,
+            "followinterval":5.,
+            "quiet":False,
+            "timings":False,
+            "timingsjson":None,
+            "profile":None,
+            "statsonly":False,
+            "fleet":None,
+            "fleetstep":10.,
+            "fleetmark":None,
+            "export":None,
+            "chunked":False,
+            "chunkpoints":1 << 18,
+            "dtype":"float64",
+            "geodesy":"equirectangular",
+            "markradius":0.1,
+            "roundingturn":60.,
+            "roundings":False,
+            "markdb":None,
+            "marknames":None,
+            "markregion":None,
+            "rangefrom":None,
+            "rangeto":None,
+            "leg":None,
+            "legs":False,
+            "legwindow":300.,
+            "legturn":60.,
+            "legmindist":0.05,
+            "maneuvers":False,
+            "wind":None,
+            "maneuverlag":30.,
+            "maneuversmooth":10.,
+            "maneuverturn":60.,
+            "maneuversettle":15.,
+            "maneuverminspeed":1.5,
+            "clean":True,
+            "cleanmaxspeed":30.,
+            "cleanmaxaccel":3.,
+            "cleanpasses":3,
+            "fillgaps":None,
+            "polar":None,
+            "polarstore":None,
+            "polarreference":"heading",
+            "polarsectors":36,
+            "polarhours":None,
+            "polarspeedstep":0.25,
+            "polarmaxspeed":30.,
+            "polarminspeed":0.5,
+            "polarminpoints":10,
+            "heatmap":None,
+            "heatmapcell":0.01,
+            "heatmapvalue":"time",
+            "heatmappixels":2000,
+            "heatmapgap":60.,
+            "serve":None,
+            "servehost":"0.0.0.0",
+            "serveport":8080,
+            "servecache":64,
+            "servetracks":8,
+            "replay":False,
+            "replayout":None,
+            "replayspeed":60.,
+            "replayfps":25,
+            "replaytrail":300.
         }
 
 
-#catch error if matplotlib or numpy arent installed
+#catch error if numpy isnt installed, rarely used modules (and matplotlib) are imported where they are needed to keep startup quick
 
 import math
 from datetime import datetime
-import xml.dom.minidom as xml
+import xml.etree.ElementTree as ElementTree
 import os
 import argparse
-from xml.parsers.expat import error as xmlerror
+import hashlib
+import calendar
+import json
+import glob
+import io
+import time
+import contextlib
+import re
+import sys
+import atexit
+import tracemalloc
+import warnings
+import contextvars
+import collections.abc
+
 try:
-    from matplotlib.ticker import FuncFormatter
-    import matplotlib.pyplot as plt
-    from matplotlib import cm as colormaps
-    
+    import resource
 except ImportError:
-    print("")
-    print("")
-    print("You don't have matplotlib installed, you need to install it.  Go to the address below.  Error 6")
-    print("https://matplotlib.org/users/installing.html")
-    exit(6)
+    resource = None
+
+from xml.parsers.expat import error as xmlerror
+
+#matplotlib is slow to import so it is only loaded when something gets drawn, see loadpyplot()
+plt = None
 
 try:
     import numpy as np
@@ -68,19 +156,201 @@ except ImportError:
     exit(7)
 
 
+"""
+    A full set of options, the defaults with whatever is given changed, Options(rollavg_points=30)
+    functions read the Options in force through config, "with options:" puts these in force until the block ends (Track does it for you)
+"""
+class Options(dict):
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, defaultconfig)
+        self.update(*args, **kwargs)
+
+        unknown = set(self) - set(defaultconfig)
+        if unknown:
+            raise TypeError("Unknown options %s" % ", ".join(sorted(unknown)))
+
+        self.tokens = []
+
+    def __enter__(self):
+        self.tokens.append(activeoptions.set(self))
+        return self
+
+    def __exit__(self, *exc):
+        activeoptions.reset(self.tokens.pop())
+        return False
+
+
+"""
+    What config is, reads and writes go to the Options in force
+    a context variable keeps it right per thread, so tracks with different options can be worked on side by side
+"""
+class CurrentOptions(collections.abc.MutableMapping):
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        return activeoptions.get()[key]
+
+    def __setitem__(self, key, value):
+        activeoptions.get()[key] = value
+
+    def __delitem__(self, key):
+        del activeoptions.get()[key]
+
+    def __iter__(self):
+        return iter(activeoptions.get())
+
+    def __len__(self):
+        return len(activeoptions.get())
+
+
+#the options in force when nobody said otherwise, the command line changes these
+activeoptions = contextvars.ContextVar('options', default=Options())
+config = CurrentOptions()
+
+
+"""
+    Print for the program's own messages, says nothing if the options in force are quiet (a Track always is)
+    unlike redirecting stdout this is right per thread
+"""
+def say(*args, **kwargs):
+    if not config['quiet']:
+        print(*args, **kwargs)
+
+
 #earths radius in nautical miles we will use this later
 earthrad = 3436.801
 
+#WGS84 ellipsoid in metres for the transverse mercator geodesy
+wgs84a = 6378137.
+wgs84f = 1 / 298.257223563
+metrespernm = 1852.
+
+#bump this when the cached track format changes so old entries are ignored
+cacheversion = 1
+
+"""
+    Import pyplot the first time a figure is needed, backend (like Agg) has to be picked before pyplot loads
+"""
+def loadpyplot(backend=None):
+    global plt
+
+    if plt != None:
+        if backend:
+            plt.switch_backend(backend)
+        return plt
+
+    try:
+        import matplotlib
+        if backend:
+            matplotlib.use(backend)
+        import matplotlib.pyplot as pyplot
+
+    except ImportError:
+        raise TrackError(6, "You don't have matplotlib installed, you need to install it, see https://matplotlib.org/users/installing.html")
+
+    plt = pyplot
+    return plt
+
+
+#colormap names once colormapnames() has found them
+colormapcache = None
+
+"""
+    Something that changes when matplotlib is installed again or upgraded, found without importing it
+    the package metadata would say the version but reading it costs more than the import it saves, so it's where it is and when it was written
+    returns None if matplotlib can't be found
+"""
+def matplotlibstamp():
+    import importlib.util
+
+    spec = importlib.util.find_spec('matplotlib')
+    if spec == None or spec.origin == None:
+        return None
+
+    try:
+        return hashlib.sha1(("%s:%d" % (spec.origin, os.stat(spec.origin).st_mtime_ns)).encode()).hexdigest()[:16]
+
+    except OSError:
+        return None
+
+
+"""
+    Names of all the colormaps, remembered per matplotlib install in the cache dir so listing or checking them doesn't import matplotlib
+"""
+def colormapnames():
+    global colormapcache
+
+    if colormapcache != None:
+        return colormapcache
+
+    version = matplotlibstamp()
+
+    filename = os.path.join(cachedir(), "colormaps-%s.json" % version)
+    if version != None:
+        try:
+            with open(filename) as f:
+                colormapcache = json.load(f)
+                return colormapcache
+
+        except (IOError, ValueError):
+            pass
+
+    try:
+        import matplotlib
+
+    except ImportError:
+        raise TrackError(6, "You don't have matplotlib installed, you need to install it, see https://matplotlib.org/users/installing.html")
+
+    if hasattr(matplotlib, 'colormaps'):
+        names = sorted(matplotlib.colormaps)
+
+    else:
+        from matplotlib import cm as colormaps
+        names = [name for name in dir(colormaps) if name[0] != '_']
+
+    try:
+        os.makedirs(cachedir(), exist_ok=True)
+        with open(filename, 'w') as f:
+            json.dump(names, f)
+
+    except IOError:
+        pass
+
+    colormapcache = names
+    return names
+
+
+#per stage timings collected when --timings is on, see stage()
+stagetimings = []
+stagestack = []
+
+"""
+    Raised when a track or mark file can't be used, code is the exit code the command line quits with
+"""
+class TrackError(Exception):
+
+    def __init__(self, code, message, filename=None):
+        Exception.__init__(self, message)
+        self.code = code
+        self.message = message
+        self.filename = filename
+
+    def report(self):
+        say("")
+        say("")
+        say("***Fatal Error:  %s***" % self.message)
+        if self.filename:
+            say("File: %s" % self.filename)
+
 """
 Calculate the angle
+    compass heading (0-360 clockwise from north) from each point to the next, arctan2 copes with due north/south steps
 """
 def calcangle(data):
     
-    angles = np.zeros(data['data']['lonnm'].shape[0], dtype=np.float)
-    angles[:-1] = 90 - np.degrees(np.arctan( (data['data']['latnm'][1:]-data['data']['latnm'][:-1]) / (data['data']['lonnm'][1:] - data['data']['lonnm'][:-1]) ))
-    
-    westmask = (data['data']['lonnm'][1:] - data['data']['lonnm'][:-1]) < 0
-    angles[:-1][westmask] = angles[:-1][westmask] + 180
+    angles = np.zeros(data['data']['lonnm'].shape[0], dtype=float)
+    angles[:-1] = np.degrees(np.arctan2(data['data']['lonnm'][1:] - data['data']['lonnm'][:-1], data['data']['latnm'][1:] - data['data']['latnm'][:-1])) % 360.
     
     angles[-1] = angles[-2]
     data['data']['angle'] = angles
@@ -89,435 +359,3492 @@ def calcangle(data):
     
 
 
-"""
-    Calculate speed in nautical miles
-"""
-def calcspeed(data):
+"""
+    Calculate speed in nautical miles
+"""
+def calcspeed(data):
+
+    #The insert statement gives us a starting speed of zero and make sure the speed array has the same dimensions as the other arrays
+    data['data']['speed'] = np.insert(calcdist(data) / calctimedelta(data), 0, [0.0])
+
+
+"""
+    Why did I put my comments here?
+    Calculate thr olling averge of speed
+    method is mean, ewma or median.  With seconds set the window is that many seconds ending at each point
+    (for loggers with irregular intervals), otherwise it is the pts points before each point like it always was
+"""
+def calcspeed_rollavg(data, pts, method="mean", seconds=None):
+    speed = data['data']['speed']
+
+    if method == "ewma":
+        if seconds:
+            alpha = 1 - np.exp(-np.diff(data['data']['time']) / float(seconds))
+        else:
+            alpha = np.full(speed.shape[0] - 1, 2. / (pts + 1))
+
+        data['data']['speedavg'] = ewma(speed, alpha)
+
+    elif seconds:
+        data['data']['speedavg'] = rollwindow_seconds(speed, data['data']['time'], seconds, method)
+
+    else:
+        data['data']['speedavg'] = rollwindow_points(speed, pts, method)
+
+
+"""
+    Fill in the rolling average for points from old onward after the track has grown, only looks back as far as the window needs
+"""
+def extendrollavg(data, old, pts, method="mean", seconds=None):
+    speed = data['data']['speed']
+    time = data['data']['time']
+    speedavg = data['data']['speedavg']
+    n = speed.shape[0]
+
+    if method == "ewma":
+        if old == 0:
+            lo = 0
+            start = None
+        else:
+            lo = old - 1
+            start = speedavg[lo]
+
+        if seconds:
+            alpha = 1 - np.exp(-np.diff(time[lo:n]) / float(seconds))
+        else:
+            alpha = np.full(n - lo - 1, 2. / (pts + 1))
+
+        speedavg[lo:n] = ewma(speed[lo:n], alpha, start=start)
+
+    elif seconds:
+        lo = np.searchsorted(time, time[old] - seconds, side='right')
+        speedavg[old:n] = rollwindow_seconds(speed[lo:n], time[lo:n], seconds, method)[old - lo:]
+
+    elif old <= pts:
+        #the start of the track is still being averaged together so just redo it
+        speedavg[:n] = rollwindow_points(speed, pts, method)
+
+    else:
+        lo = old - pts
+        speedavg[old:n] = rollwindow_points(speed[lo:n], pts, method)[pts:]
+
+
+"""
+    Trailing window of pts points before each point, the first points just get the average of the start
+"""
+def rollwindow_points(values, pts, method="mean"):
+    n = values.shape[0]
+    out = np.zeros(n, dtype=float)
+
+    #set the first points to their average for simplicity
+    head = values[:max(pts - 1, 1)]
+    out[:pts] = np.median(head) if method == "median" else np.mean(head)
+
+    if n <= pts:
+        return out
+
+    if method == "median":
+        windows = np.lib.stride_tricks.sliding_window_view(values[:-1], pts)
+        out[pts:] = chunkedmedian(windows)
+
+    else:
+        out[pts:] = windowmeans(values, np.arange(n - pts), np.arange(pts, n))
+
+    return out
+
+
+"""
+    Window of the given number of seconds ending at (and including) each point
+"""
+def rollwindow_seconds(values, times, seconds, method="mean"):
+    n = values.shape[0]
+    hi = np.arange(1, n + 1)
+    lo = np.searchsorted(times, times - seconds, side='right')
+    lengths = hi - lo
+
+    if method == "median":
+        #pad the front so every point has a full width window then blank out what is outside its time window
+        width = int(np.max(lengths))
+        padded = np.concatenate((np.full(width - 1, np.nan), values.astype(float)))
+        windows = np.lib.stride_tricks.sliding_window_view(padded, width)
+        return chunkedmedian(windows, lengths)
+
+    return windowmeans(values, lo, hi)
+
+
+"""
+    Mean of values[lo[i]:hi[i]] for every window, from running sums so it costs the same however wide the windows are
+    an inf or nan would stay in a running sum for good, so they are counted instead and only spoil the windows they are in
+    (coming out the way np.mean gives them)
+"""
+def windowmeans(values, lo, hi):
+    finite = np.isfinite(values)
+    total = np.concatenate(([0.], np.cumsum(np.where(finite, values, 0.))))
+    out = (total[hi] - total[lo]) / (hi - lo)
+
+    if not finite.all():
+
+        def count(mask):
+            running = np.concatenate(([0], np.cumsum(mask)))
+            return running[hi] - running[lo]
+
+        nans = count(np.isnan(values))
+        posinf = count(values == np.inf)
+        neginf = count(values == -np.inf)
+
+        out[posinf > 0] = np.inf
+        out[neginf > 0] = -np.inf
+        out[(nans > 0) | ((posinf > 0) & (neginf > 0))] = np.nan
+
+    return out
+
+
+"""
+    Median of each row of a (strided) window view, a chunk of rows at a time so we never copy all the windows at once
+    lengths optionally limits each row to its last lengths[i] values
+"""
+def chunkedmedian(windows, lengths=None, maxcells=1 << 22):
+    n, width = windows.shape
+    out = np.empty(n, dtype=float)
+    step = max(1, maxcells // width)
+
+    for start in range(0, n, step):
+        chunk = np.array(windows[start:start + step], dtype=float)
+
+        if lengths is None:
+            out[start:start + step] = np.median(chunk, axis=1)
+
+        else:
+            chunk[np.arange(width)[None, :] < (width - lengths[start:start + step])[:, None]] = np.nan
+            out[start:start + step] = np.nanmedian(chunk, axis=1)
+
+    return out
+
+
+"""
+    Exponentially weighted moving average with a smoothing factor per step (alpha has one less value than values)
+    y[i] = y[i-1] + alpha[i-1] * (x[i] - y[i-1]) worked out with cumulative sums over blocks short enough that the decay doesnt underflow
+    start replaces the first value, for carrying on from an earlier run
+    non-finite values (a duplicate time stamp with --no-clean) are gaps the average holds over, one inf would otherwise last to the end
+"""
+def ewma(values, alpha, maxdecay=30., start=None):
+    out = np.empty(values.shape[0], dtype=float)
+    out[0] = values[0] if start == None else start
+
+    if values.shape[0] == 1:
+        return out
+
+    if not np.isfinite(out[0]):
+        #nothing to hold yet, start again from the first finite value
+        good = np.flatnonzero(np.isfinite(values[1:]))
+        if good.shape[0] == 0:
+            out[1:] = out[0]
+            return out
+
+        first = good[0] + 1
+        out[1:first] = out[0]
+        out[first:] = ewma(values[first:], alpha[first:], maxdecay)
+        return out
+
+    finite = np.isfinite(values)
+    if not finite.all():
+        alpha = np.where(finite[1:], alpha, 0.)
+        values = np.where(finite, values, 0.)
+
+    alpha = np.clip(np.nan_to_num(alpha, nan=0.), 0., 1. - 1e-12)
+    decay = np.cumsum(-np.log1p(-alpha))
+    blockids = np.floor(decay / maxdecay)
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(blockids)) + 1, [decay.shape[0]]))
+
+    prev = out[0]
+    prevdecay = 0.
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        localdecay = decay[start:end] - prevdecay
+        weighted = np.cumsum(alpha[start:end] * values[start + 1:end + 1] * np.exp(localdecay))
+        out[start + 1:end + 1] = np.exp(-localdecay) * (prev + weighted)
+
+        prev = out[end]
+        prevdecay = decay[end - 1]
+
+    return out
+
+
+"""
+    Calculate and return timedelta in hours as float of two points.  Enter points in the order in which they were recorded
+"""
+def calctimedelta(data):
+
+    return (data['data']['time'][1:] - data['data']['time'][:-1]) / 3600
+
+
+
+"""
+    Calculate distance between each point and the next in nautical miles, with config['geodesy']
+"""
+def calcdist(data):
+        
+    return geodesies[config['geodesy']][1](data['data'], np.dtype(config['dtype']))
+    
+
+
+"""
+    Time a stage of the work (use it as a with block), records wall time, peak traced memory, peak RSS and point count
+    does nothing unless config['timings'] is set, the record it yields can have 'points' filled in later
+"""
+@contextlib.contextmanager
+def stage(name, points=None):
+    if not config['timings']:
+        yield {}
+        return
+
+    record = {'stage':name, 'depth':len(stagestack), 'points':points, 'ms':0., 'peakmb':None, 'rssmb':None}
+    stagetimings.append(record)
+
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        #hand the peak so far to the enclosing stage before resetting it for this one
+        if len(stagestack) > 0:
+            stagestack[-1]['_peak'] = max(stagestack[-1].get('_peak', 0), tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+
+    stagestack.append(record)
+    starttime = time.perf_counter()
+
+    try:
+        yield record
+
+    finally:
+        record['ms'] = (time.perf_counter() - starttime) * 1000.
+        stagestack.pop()
+
+        if tracing:
+            peak = max(record.pop('_peak', 0), tracemalloc.get_traced_memory()[1])
+            record['peakmb'] = peak / 1048576.
+            if len(stagestack) > 0:
+                stagestack[-1]['_peak'] = max(stagestack[-1].get('_peak', 0), peak)
+
+        if resource != None:
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            #linux says KB, macs say bytes
+            record['rssmb'] = maxrss / 1048576. if sys.platform == 'darwin' else maxrss / 1024.
+
+
+"""
+    Print the stage timings as a table or write them to config['timingsjson']
+"""
+def reporttimings():
+    if len(stagetimings) == 0:
+        return
+
+    if config['timingsjson']:
+        with open(config['timingsjson'], 'w') as f:
+            json.dump(stagetimings, f, indent=2)
+
+        say("Timings written to %s" % config['timingsjson'])
+        return
+
+    say("")
+    say("%-36s %12s %10s %10s %10s" % ("Stage", "Points", "ms", "Peak MB", "RSS MB"))
+    for record in stagetimings:
+        say("%-36s %12s %10.1f %10s %10s" % ("  " * record['depth'] + record['stage'],
+                                              record['points'] if record['points'] != None else "",
+                                              record['ms'],
+                                              "%.1f" % record['peakmb'] if record['peakmb'] != None else "",
+                                              "%.1f" % record['rssmb'] if record['rssmb'] != None else ""))
+
+
+"""
+    Save the whole run profile for pstats
+"""
+def dumpprofile(profiler):
+    profiler.disable()
+    profiler.dump_stats(config['profile'])
+    say("Profile written to %s (view it with python -m pstats %s)" % (config['profile'], config['profile']))
+
+
+"""
+    Offsets in nautical miles from lat0/lon0 on a sphere, north is the change in latitude and east the change in longitude scaled
+    by the point's own latitude, quick and good enough round a race course but it bends the further out from the origin you go
+    the origin is taken off in float64 so a float32 dtype only rounds the offsets, not the whole latitude
+"""
+def equirectangular(lat, lon, lat0, lon0, dtype):
+    latnm = np.asarray(np.radians(lat) * earthrad - np.radians(lat0) * earthrad, dtype=dtype)
+    lonnm = (np.asarray(np.radians(lon) - np.radians(lon0), dtype=dtype) * np.cos(np.radians(np.asarray(lat, dtype=dtype)))) * earthrad
+
+    return latnm, lonnm
+
+
+"""
+    Transverse mercator on the WGS84 ellipsoid with the central meridian through the origin, offsets in nautical miles
+    Kruger's series to n^4 summed with Clenshaw's recurrence on complex numbers, distances on it are true to 1 part in 10000
+    out to about 50 NM east or west of the origin (1 in 1000 at 150 NM), the series needs float64 so only the result is rounded to dtype
+"""
+def transversemercator(lat, lon, lat0, lon0, dtype):
+    n = wgs84f / (2. - wgs84f)
+    scale = wgs84a / (1. + n) * (1. + n**2 / 4. + n**4 / 64.) / metrespernm
+    alpha = (n / 2. - 2. * n**2 / 3. + 5. * n**3 / 16. + 41. * n**4 / 180.,
+             13. * n**2 / 48. - 3. * n**3 / 5. + 557. * n**4 / 1440.,
+             61. * n**3 / 240. - 103. * n**4 / 140.,
+             49561. * n**4 / 161280.)
+    ecc = 2. * math.sqrt(n) / (1. + n)
+
+    def project(lat, dlon):
+        sinlat = np.sin(np.radians(lat))
+        t = np.sinh(np.arctanh(sinlat) - ecc * np.arctanh(ecc * sinlat))
+        zeta = np.arctan2(t, np.cos(dlon)) + 1j * np.arctanh(np.sin(dlon) / np.sqrt(1. + t * t))
+
+        #zeta + sum of alpha[j] sin(2 j zeta)
+        twice = 2. * np.cos(2. * zeta)
+        b1 = b2 = 0.
+        for a in reversed(alpha):
+            b1, b2 = a + twice * b1 - b2, b1
+        zeta = (zeta + b1 * np.sin(2. * zeta)) * scale
+
+        return zeta.real, zeta.imag
+
+    north, east = project(np.asarray(lat, dtype=np.float64), np.radians(np.asarray(lon - lon0, dtype=np.float64)))
+    north0 = project(np.float64(lat0), 0.)[0]
+
+    return np.asarray(north - north0, dtype=dtype), np.asarray(east, dtype=dtype)
+
+
+"""
+    Distance from each point to the next as straight lines between the projected offsets
+"""
+def planesteps(channels, dtype):
+    return np.sqrt(np.square(channels['latnm'][:-1] - channels['latnm'][1:]) + np.square(channels['lonnm'][:-1] - channels['lonnm'][1:]))
+
+
+"""
+    Great circle distance from each point to the next on the same sphere equirectangular uses, straight from lat/lon
+    only the differences between points get rounded to dtype so float32 still gets short steps right
+"""
+def haversinesteps(channels, dtype):
+    dlat = np.radians(np.asarray(np.diff(channels['lat']), dtype=dtype))
+    dlon = np.radians(np.asarray(np.diff(channels['lon']), dtype=dtype))
+    coslat = np.cos(np.radians(np.asarray(channels['lat'], dtype=dtype)))
+
+    a = np.square(np.sin(dlat / 2.)) + coslat[:-1] * coslat[1:] * np.square(np.sin(dlon / 2.))
+
+    return 2. * earthrad * np.arcsin(np.sqrt(np.minimum(a, 1.)))
+
+
+"""
+    Ways of getting positions and distances from lat/lon, config['geodesy'] picks one, name -> (projection, distance)
+    projection(lat, lon, lat0, lon0, dtype) gives the (latnm, lonnm) offsets the graphs, marks and headings use,
+    distance(channels, dtype) the NM from each point to the next that speeds and distances sailed come from
+"""
+geodesies = {'equirectangular':(equirectangular, planesteps),
+             'haversine':(equirectangular, haversinesteps),
+             'tm':(transversemercator, planesteps)}
+
+
+"""
+    Settings the positions and distances were worked out with, None for the original equirectangular float64
+"""
+def geodesyparams():
+    if config['geodesy'] == 'equirectangular' and config['dtype'] == 'float64':
+        return None
+
+    return {'mode':config['geodesy'], 'dtype':config['dtype']}
+
+
+"""
+    Offset in nautical miles of lat/lon from the origin lat0/lon0 with config['geodesy'], returns (latnm, lonnm)
+"""
+def projectlatlon(lat, lon, lat0, lon0):
+    return geodesies[config['geodesy']][0](lat, lon, lat0, lon0, np.dtype(config['dtype']))
+
+
+"""
+    Convert lat and long to offsets from the first point with config['geodesy'] (the name is from when it was haversine)
+"""
+def havconvlatlon(data,frame='data'):
+    
+    
+    data[frame]['latnm'], data[frame]['lonnm'] = projectlatlon(data[frame]['lat'], data[frame]['lon'], data[frame]['lat'][0], data[frame]['lon'][0])
+    
+    
+    #data['data']['lonnm'] = data['data']['lonnm'] - data['data']['lonnm'][0]
+
+    
+"""
+    Bounding box of the track as (minlat, maxlat, minlon, maxlon), the chunked loader has already added it up
+"""
+def trackbounds(data):
+    if 'stats' in data:
+        return data['stats']['minlat'], data['stats']['maxlat'], data['stats']['minlon'], data['stats']['maxlon']
+
+    return np.min(data['data']['lat']), np.max(data['data']['lat']), np.min(data['data']['lon']), np.max(data['data']['lon'])
+
+
+"""
+    Read the waypoints from a mark GPX file, returns a list of (name, lat, lon) and how many were missing data
+"""
+def parsemarkfile(filename):
+    marks = []
+    dropped = 0
+
+    try:
+        for event, elem in ElementTree.iterparse(filename):
+            if localtag(elem.tag) != "wpt":
+                continue
+
+            names = [child.text for child in elem if localtag(child.tag) == "name"]
+            if elem.get('lat') == None or elem.get('lon') == None or len(names) != 1 or names[0] == None:
+                dropped += 1
+            else:
+                marks.append((names[0], float(elem.get('lat')), float(elem.get('lon'))))
+
+            elem.clear()
+
+    except (xmlerror, ElementTree.ParseError):
+        raise TrackError(8, "mark GPX file is not properly formated XML, sorry I cant help you with this", filename)
+
+    except IOError:
+        raise TrackError(9, "Could not open mark file", filename)
+
+    if dropped > 0:
+        say("***Warning, %d waypoints missing data in %s, dropping them***" % (dropped, filename))
+
+    return marks, dropped
+
+
+"""
+    Where the mark database lives, next to the track cache unless --mark-db says otherwise
+"""
+def markdbfile():
+    if config['markdb']:
+        return config['markdb']
+
+    return os.path.join(cachedir(), "marks.sqlite")
+
+
+"""
+    Open (and set up if needed) the mark database, marks are indexed with an R*Tree when sqlite has it
+    returns {'db':connection, 'rtree':whether the R*Tree is there}
+"""
+def openmarkdb():
+    import sqlite3
+
+    if os.path.dirname(markdbfile()):
+        os.makedirs(os.path.dirname(markdbfile()), exist_ok=True)
+
+    db = sqlite3.connect(markdbfile())
+    db.execute("CREATE TABLE IF NOT EXISTS sources (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, sha1 TEXT, count INTEGER, dropped INTEGER)")
+    db.execute("CREATE TABLE IF NOT EXISTS marks (id INTEGER PRIMARY KEY, source TEXT, name TEXT, lat REAL, lon REAL)")
+    db.execute("CREATE INDEX IF NOT EXISTS marksbysource ON marks (source)")
+    db.execute("CREATE INDEX IF NOT EXISTS marksbyname ON marks (name)")
+
+    try:
+        db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS markbox USING rtree(id, minlat, maxlat, minlon, maxlon)")
+        rtree = True
+
+    except sqlite3.OperationalError:
+        #no rtree module compiled in, a plain index still beats reparsing
+        db.execute("CREATE INDEX IF NOT EXISTS marksbylatlon ON marks (lat, lon)")
+        rtree = False
+
+    return {'db':db, 'rtree':rtree}
+
+
+"""
+    Bring the mark database up to date with the mark files, only files that changed since last time get parsed
+"""
+def refreshmarkdb(markdb, filenames):
+    db = markdb['db']
+
+    for filename in filenames:
+        path = os.path.abspath(filename)
+
+        try:
+            stat = os.stat(path)
+        except OSError:
+            raise TrackError(9, "Could not open mark file", filename)
+
+        row = db.execute("SELECT size, mtime, sha1 FROM sources WHERE path = ?", (path,)).fetchone()
+        if row != None and row[0] == stat.st_size:
+            if row[1] == stat.st_mtime:
+                continue
+
+            #touched but maybe not changed
+            sha1 = filehash(path)
+            if row[2] == sha1:
+                db.execute("UPDATE sources SET mtime = ? WHERE path = ?", (stat.st_mtime, path))
+                db.commit()
+                continue
+
+        say("Indexing mark data from \"%s\"" % os.path.basename(filename))
+        marks, dropped = parsemarkfile(filename)
+
+        with db:
+            if markdb['rtree']:
+                db.execute("DELETE FROM markbox WHERE id IN (SELECT id FROM marks WHERE source = ?)", (path,))
+            db.execute("DELETE FROM marks WHERE source = ?", (path,))
+            db.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?, ?)", (path, stat.st_size, stat.st_mtime, filehash(path), len(marks), dropped))
+
+            db.executemany("INSERT INTO marks (source, name, lat, lon) VALUES (?, ?, ?, ?)", [(path,) + mark for mark in marks])
+            if markdb['rtree']:
+                db.execute("INSERT INTO markbox SELECT id, lat, lat, lon, lon FROM marks WHERE source = ?", (path,))
+
+
+"""
+    Marks from the given files inside bounds (minlat, maxlat, minlon, maxlon) or anywhere if bounds is None
+    names is an optional list of glob patterns, returns a list of (name, lat, lon) with duplicates removed
+"""
+def querymarks(markdb, filenames, bounds=None, names=None):
+    sources = [os.path.abspath(filename) for filename in filenames]
+    where = ["m.source IN (%s)" % ",".join("?" * len(sources))]
+    params = list(sources)
+
+    if bounds != None:
+        #the rtree keeps float32 boxes rounded outwards so it only narrows things down, the exact test is on marks
+        if markdb['rtree']:
+            where.append("m.id IN (SELECT id FROM markbox WHERE maxlat >= ? AND minlat <= ? AND maxlon >= ? AND minlon <= ?)")
+            params += [bounds[0], bounds[1], bounds[2], bounds[3]]
+
+        where.append("m.lat > ? AND m.lat < ? AND m.lon > ? AND m.lon < ?")
+        params += [bounds[0], bounds[1], bounds[2], bounds[3]]
+
+    if names:
+        where.append("(%s)" % " OR ".join(["m.name GLOB ?"] * len(names)))
+        params += names
+
+    return markdb['db'].execute("SELECT DISTINCT m.name, m.lat, m.lon FROM marks m WHERE %s ORDER BY m.name" % " AND ".join(where), params).fetchall()
+
+
+"""
+    Same as querymarks but straight from the files, for when the database is off or can't be used
+"""
+def filtermarks(filenames, bounds=None, names=None):
+    import fnmatch
+
+    marks = set()
+    for filename in filenames:
+        marks.update(parsemarkfile(filename)[0])
+
+    if bounds != None:
+        marks = [mark for mark in marks if mark[1] > bounds[0] and mark[1] < bounds[1] and mark[2] > bounds[2] and mark[2] < bounds[3]]
+
+    if names:
+        marks = [mark for mark in marks if any(fnmatch.fnmatchcase(mark[0], pattern) for pattern in names)]
+
+    return sorted(marks)
+
+
+"""
+Load waypoints, area (minlat, maxlat, minlon, maxlon) picks the marks instead of the track bounds
+"""
+def loadmarkfiles(data, area=None):
+
+    #the track area only needs working out once, --mark-region picks an area of its own
+    if config['markregion']:
+        bounds = config['markregion']
+    elif config['filterwaypoints']:
+        bounds = area if area != None else trackbounds(data)
+    else:
+        bounds = None
+
+    marks = None
+    if config['usecache']:
+        import sqlite3
+
+        try:
+            markdb = openmarkdb()
+
+            with stage("refresh mark db"):
+                refreshmarkdb(markdb, data['markfiles'])
+
+            with stage("query marks"):
+                marks = querymarks(markdb, data['markfiles'], bounds, config['marknames'])
+                total = markdb['db'].execute("SELECT SUM(count) FROM sources WHERE path IN (%s)" % ",".join("?" * len(data['markfiles'])), [os.path.abspath(filename) for filename in data['markfiles']]).fetchone()[0]
+
+            markdb['db'].close()
+
+        except sqlite3.Error as e:
+            say("***Warning, mark database %s not usable (%s), reading the mark files***" % (markdbfile(), e))
+
+    if marks == None:
+        with stage("parse marks"):
+            marks = filtermarks(data['markfiles'], bounds, config['marknames'])
+            total = None
+
+    data['waypoints'] = {}
+    data['waypoints']['names'] = [mark[0] for mark in marks]
+    data['waypoints']['lat'] = np.zeros(len(marks)+1,dtype=float)
+    data['waypoints']['lon'] = np.zeros(len(marks)+1,dtype=float)
+    
+    #this is for passing it into our previous functions
+    data['waypoints']['lat'][0] = data['data']['lat'][0]
+    data['waypoints']['lon'][0] = data['data']['lon'][0]
+
+    if len(marks) > 0:
+        data['waypoints']['lat'][1:] = [mark[1] for mark in marks]
+        data['waypoints']['lon'][1:] = [mark[2] for mark in marks]
+    
+    with stage("project waypoints", len(marks)):
+        havconvlatlon(data, frame='waypoints')
+    
+    data['waypoints']['lat'] = data['waypoints']['lat'][1:]
+    data['waypoints']['lon'] = data['waypoints']['lon'][1:]
+    data['waypoints']['latnm'] = data['waypoints']['latnm'][1:]
+    data['waypoints']['lonnm'] = data['waypoints']['lonnm'][1:]
+    
+    if total != None:
+        say("Loaded %d/%d total waypoints!" % (len(marks), total))
+    else:
+        say("Loaded %d total waypoints!" % len(marks))
+      
+    
+              
+        
+"""
+    Bucket marks into a grid of cellsize NM squares so finding the marks near a point only looks at the cells around it
+"""
+def markgrid(latnm, lonnm, cellsize):
+    cells = gridcell(latnm, lonnm, cellsize)
+    order = np.argsort(cells, kind='stable')
+
+    return {'cellsize':cellsize, 'cells':cells[order], 'order':order, 'latnm':latnm, 'lonnm':lonnm}
+
+
+"""
+    Grid cell number of each position, row and column packed into one int64
+"""
+def gridcell(latnm, lonnm, cellsize, drow=0, dcol=0):
+    rows = np.floor(latnm / cellsize).astype(np.int64) + drow
+    cols = np.floor(lonnm / cellsize).astype(np.int64) + dcol
+    return rows * (1 << 32) + cols
+
+
+"""
+    Every (point, mark) pair within radius NM of each other, radius can't be bigger than the grid cells
+    returns point indexes, mark indexes and distances
+"""
+def nearmarks(grid, latnm, lonnm, radius):
+    ptidx = []
+    markidx = []
+
+    #anything within a cell width has to be in one of the 9 cells around the point
+    for drow in (-1, 0, 1):
+        for dcol in (-1, 0, 1):
+            cells = gridcell(latnm, lonnm, grid['cellsize'], drow, dcol)
+            lo = np.searchsorted(grid['cells'], cells, side='left')
+            counts = np.searchsorted(grid['cells'], cells, side='right') - lo
+
+            hits = np.flatnonzero(counts)
+            if hits.shape[0] == 0:
+                continue
+
+            #expand each point to one row per mark in its cell
+            counts = counts[hits]
+            firsts = np.repeat(np.cumsum(counts) - counts, counts)
+            ptidx.append(np.repeat(hits, counts))
+            markidx.append(grid['order'][np.repeat(lo[hits], counts) + np.arange(firsts.shape[0]) - firsts])
+
+    if len(ptidx) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    ptidx = np.concatenate(ptidx)
+    markidx = np.concatenate(markidx)
+    dist = np.hypot(latnm[ptidx] - grid['latnm'][markidx], lonnm[ptidx] - grid['lonnm'][markidx])
+
+    close = dist <= radius
+    return ptidx[close], markidx[close], dist[close]
+
+
+"""
+    Find every time the boat came within radius NM of a mark, when it was closest and whether it went round it
+    a pass that turns the boat more than config['roundingturn'] degrees counts as a rounding, the side is where the mark was
+    the track is checked a chunk at a time so memory mapped tracks stay out of memory, fills data['roundings'] sorted by time
+"""
+def markroundings(data, radius, chunksize=1 << 18):
+    waypoints = data['waypoints']
+    latnm = data['data']['latnm']
+    lonnm = data['data']['lonnm']
+    n = data['ptcount']
+
+    data['roundings'] = {'names':[], 'index':np.zeros(0, dtype=np.int64), 'time':np.zeros(0), 'distance':np.zeros(0), 'turn':np.zeros(0), 'rounded':np.zeros(0, dtype=bool)}
+    if len(waypoints['names']) == 0:
+        return
+
+    grid = markgrid(waypoints['latnm'], waypoints['lonnm'], radius)
+
+    pairs = []
+    for start in range(0, n, chunksize):
+        ptidx, markidx, dist = nearmarks(grid, np.asarray(latnm[start:start + chunksize], dtype=float), np.asarray(lonnm[start:start + chunksize], dtype=float), radius)
+        pairs.append((ptidx + start, markidx, dist))
+
+    ptidx, markidx, dist = (np.concatenate(column) for column in zip(*pairs))
+    if ptidx.shape[0] == 0:
+        return
+
+    #a pass is a run of consecutive points near the same mark
+    order = np.lexsort((ptidx, markidx))
+    ptidx, markidx, dist = ptidx[order], markidx[order], dist[order]
+    newpass = np.ones(ptidx.shape[0], dtype=bool)
+    newpass[1:] = (markidx[1:] != markidx[:-1]) | (ptidx[1:] != ptidx[:-1] + 1)
+    passid = np.cumsum(newpass) - 1
+    starts = np.flatnonzero(newpass)
+    ends = np.append(starts[1:], ptidx.shape[0]) - 1
+
+    #closest point of each pass, the first of each pass once sorted by distance
+    bydist = np.lexsort((dist, passid))
+    closest = bydist[np.searchsorted(passid[bydist], np.arange(starts.shape[0]))]
+
+    #course coming in (from just before the pass to the closest point) and going out (closest point to just after)
+    entry = np.maximum(ptidx[starts] - 1, 0)
+    exit = np.minimum(ptidx[ends] + 1, n - 1)
+    mid = ptidx[closest]
+    coursein = np.degrees(np.arctan2(lonnm[mid] - lonnm[entry], latnm[mid] - latnm[entry]))
+    courseout = np.degrees(np.arctan2(lonnm[exit] - lonnm[mid], latnm[exit] - latnm[mid]))
+    turn = (courseout - coursein + 180.) % 360. - 180.
+
+    #no course to compare at the very start or end of the track
+    turn[(mid == entry) | (mid == exit)] = 0.
+
+    bytime = np.argsort(mid, kind='stable')
+    data['roundings'] = {'names':[waypoints['names'][idx] for idx in markidx[closest][bytime]], 'index':mid[bytime],
+                         'time':np.asarray(data['data']['time'][mid[bytime]], dtype=float), 'distance':dist[closest][bytime],
+                         'turn':turn[bytime], 'rounded':np.abs(turn[bytime]) >= config['roundingturn']}
+
+
+"""
+    Print the table of mark passes and roundings
+"""
+def printroundings(data):
+    roundings = data['roundings']
+
+    say("")
+    say("Marks passed within %.2f NM (%d roundings):" % (config['markradius'], np.count_nonzero(roundings['rounded'])))
+
+    if len(roundings['names']) == 0:
+        say("\tnone")
+        return
+
+    say("\t%-10s %-24s %10s %8s  %s" % ("Time", "Mark", "Closest NM", "Turn", "Rounded"))
+    for idx in range(len(roundings['names'])):
+        secs = int(round(roundings['time'][idx]))
+        side = ("mark to %s" % ("starboard" if roundings['turn'][idx] > 0 else "port")) if roundings['rounded'][idx] else ""
+        say("\t%3d:%02d:%02d  %-24s %10.3f %8.0f  %s" % (secs // 3600, secs // 60 % 60, secs % 60, roundings['names'][idx], roundings['distance'][idx], roundings['turn'][idx], side))
+
+
+"""
+    Index range of the points from start to end seconds (either can be None), found with searchsorted on the (sorted) times
+"""
+def timerange(data, start=None, end=None):
+    time = data['data']['time']
+    lo = 0 if start == None else int(np.searchsorted(time, start, side='left'))
+    hi = data['ptcount'] if end == None else int(np.searchsorted(time, end, side='right'))
+
+    return slice(lo, hi)
+
+
+"""
+    A data dict for just the points in sl, the channels are views of the full track so nothing gets copied
+"""
+def sliceview(data, sl, label=None):
+    view = dict(data)
+    view['data'] = {name:values[sl] for name, values in data['data'].items()}
+    view['ptcount'] = view['data']['time'].shape[0]
+
+    #running stats belong to the whole track
+    view.pop('stats', None)
+
+    #event tables only keep the events in range
+    for table in ('roundings', 'maneuvers'):
+        if table in data:
+            events = data[table]
+            keep = np.flatnonzero((events['index'] >= sl.start) & (events['index'] < sl.stop))
+            view[table] = {key:(values[keep] if isinstance(values, np.ndarray) else [values[idx] for idx in keep] if isinstance(values, list) else values) for key, values in events.items()}
+            view[table]['index'] = view[table]['index'] - sl.start
+
+    if label:
+        view['name'] = "%s (%s)" % (data['name'] if data['name'] != None else data['filename'], label)
+
+    return view
+
+
+"""
+    Split the track into legs, at the mark roundings if there are any otherwise wherever the course made good turns
+    the course made good is the direction moved over config['legwindow'] seconds, so tacks and gybes along a leg average out
+    fills data['legs'] with the first and last point of each leg (legs share the turning point)
+"""
+def findlegs(data):
+    n = data['ptcount']
+    rounded = data['roundings']['rounded'] if 'roundings' in data else np.zeros(0, dtype=bool)
+
+    if np.any(rounded):
+        cuts = data['roundings']['index'][rounded]
+        source = "mark roundings"
+
+    else:
+        time = data['data']['time']
+        latnm = data['data']['latnm']
+        lonnm = data['data']['lonnm']
+        window = config['legwindow']
+
+        before = np.searchsorted(time, time - window, side='left')
+        after = np.searchsorted(time, time + window, side='right') - 1
+
+        dlatin = latnm - latnm[before]
+        dlonin = lonnm - lonnm[before]
+        dlatout = latnm[after] - latnm
+        dlonout = lonnm[after] - lonnm
+        turn = np.abs((np.degrees(np.arctan2(dlonout, dlatout) - np.arctan2(dlonin, dlatin)) + 180.) % 360. - 180.)
+
+        #sitting still doesn't have a course
+        moving = (np.hypot(dlatin, dlonin) > config['legmindist']) & (np.hypot(dlatout, dlonout) > config['legmindist'])
+        turning = (turn > config['legturn']) & moving
+
+        #one cut per turn, where the course changed the most
+        edges = np.diff(np.concatenate(([0], turning.astype(np.int8), [0])))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+        cuts = [start + np.argmax(turn[start:end]) for start, end in zip(starts, ends)]
+
+        #anything shorter than the window is just manoeuvring (circling at the finish and such)
+        kept = []
+        for cut in cuts:
+            if time[cut] - (time[kept[-1]] if len(kept) > 0 else time[0]) >= window:
+                kept.append(cut)
+        cuts = np.array(kept, dtype=np.int64)
+        source = "course changes"
+
+    bounds = np.unique(np.concatenate(([0], cuts, [n - 1])))
+    data['legs'] = {'start':bounds[:-1], 'end':bounds[1:], 'source':source}
+
+
+"""
+    Print the legs with their times, distance and average speed
+"""
+def printlegs(data):
+    legs = data['legs']
+    time = data['data']['time']
+
+    #distance sailed to each point so every leg is a subtraction
+    sailed = np.concatenate(([0.], np.cumsum(calcdist(data))))
+
+    say("")
+    say("%d legs found from %s:" % (legs['start'].shape[0], legs['source']))
+    say("\t%-4s %10s %10s %10s %8s %8s" % ("Leg", "Start min", "End min", "Minutes", "NM", "Knots"))
+    for idx, (start, end) in enumerate(zip(legs['start'], legs['end'])):
+        minutes = (time[end] - time[start]) / 60.
+        dist = sailed[end] - sailed[start]
+        say("\t%-4d %10.1f %10.1f %10.1f %8.2f %8.2f" % (idx + 1, time[start] / 60., time[end] / 60., minutes, dist, dist / (minutes / 60.) if minutes > 0 else 0.))
+
+
+"""
+    Cut data down to the leg and/or time range asked for on the command line, returns a view of the selected points
+"""
+def selectrange(data):
+    sl = slice(0, data['ptcount'])
+    labels = []
+
+    if config['leg'] or config['legs']:
+        with stage("findlegs", data['ptcount']):
+            findlegs(data)
+
+        if config['legs']:
+            printlegs(data)
+
+        if config['leg']:
+            count = data['legs']['start'].shape[0]
+            if config['leg'] < 1 or config['leg'] > count:
+                raise TrackError(13, "There is no leg %d, the track only has %d legs (use --legs to list them)" % (config['leg'], count), data['filename'])
+
+            sl = slice(int(data['legs']['start'][config['leg'] - 1]), int(data['legs']['end'][config['leg'] - 1]) + 1)
+            labels.append("leg %d" % config['leg'])
+
+    if config['rangefrom'] != None or config['rangeto'] != None:
+        timesl = timerange(data, None if config['rangefrom'] == None else config['rangefrom'] * 60., None if config['rangeto'] == None else config['rangeto'] * 60.)
+        sl = slice(max(sl.start, timesl.start), min(sl.stop, timesl.stop))
+        labels.append("%s-%s min" % ("start" if config['rangefrom'] == None else "%g" % config['rangefrom'], "end" if config['rangeto'] == None else "%g" % config['rangeto']))
+
+    if sl.stop - sl.start < 2:
+        raise TrackError(13, "Less than two points in the selected range, nothing to show", data['filename'])
+
+    if sl.start == 0 and sl.stop == data['ptcount']:
+        return data
+
+    say("Selected %d of %d points (%s)" % (sl.stop - sl.start, data['ptcount'], ", ".join(labels)))
+    return sliceview(data, sl, ", ".join(labels))
+
+
+"""
+    Heading smoothed over a window of seconds centred on each point, as a circular mean of the step headings weighted by step length
+    the weighted sum of the steps is just the distance moved so it comes straight from latnm/lonnm, and jitter while stopped barely counts
+"""
+def smoothheading(data, seconds):
+    time = data['data']['time']
+    latnm = data['data']['latnm']
+    lonnm = data['data']['lonnm']
+    n = data['ptcount']
+
+    lo = np.searchsorted(time, time - seconds / 2., side='left')
+    hi = np.searchsorted(time, time + seconds / 2., side='right') - 1
+    hi = np.maximum(hi, np.minimum(lo + 1, n - 1))
+
+    return np.degrees(np.arctan2(lonnm[hi] - lonnm[lo], latnm[hi] - latnm[lo])) % 360.
+
+
+"""
+    Signed difference b - a between two headings, -180 to 180
+"""
+def headingdiff(a, b):
+    return (b - a + 180.) % 360. - 180.
+
+
+"""
+    Find tacks and gybes, linear in the number of points and only loops over events never points
+    a maneuver is where the smoothed heading config['maneuverlag'] seconds after differs from the one that long before by more than
+    config['maneuverturn'] degrees, it is a tack if the bow crossed the wind and a gybe if the stern did (the wind comes from --wind
+    or is worked out from the maneuvers themselves), fills data['maneuvers'] with a table sorted by time
+"""
+def findmaneuvers(data):
+    time = data['data']['time']
+    n = data['ptcount']
+    lag = config['maneuverlag']
+
+    data['maneuvers'] = {'index':np.zeros(0, dtype=np.int64), 'time':np.zeros(0), 'kind':[], 'turn':np.zeros(0), 'duration':np.zeros(0),
+                         'speedbefore':np.zeros(0), 'minspeed':np.zeros(0), 'loss':np.zeros(0), 'wind':config['wind']}
+    if n < 3:
+        return
+
+    heading = smoothheading(data, config['maneuversmooth'])
+    sailed = np.concatenate(([0.], np.cumsum(calcdist(data))))
+
+    before = np.searchsorted(time, time - lag, side='left')
+    after = np.searchsorted(time, time + lag, side='right') - 1
+    turn = headingdiff(heading[before], heading[after])
+
+    #knots over the lag before each point, no maneuvers while drifting about
+    elapsed = time - time[before]
+    speedin = np.divide((sailed - sailed[before]) * 3600., elapsed, out=np.zeros(n), where=elapsed > 0)
+    turning = (np.abs(turn) > config['maneuverturn']) & (speedin > config['maneuverminspeed'])
+
+    edges = np.diff(np.concatenate(([0], turning.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    if starts.shape[0] == 0:
+        return
+
+    #the turn can dip under the threshold part way through, runs closer than the lag are the same maneuver
+    starts = starts[np.concatenate(([True], time[starts[1:]] - time[ends[:-1] - 1] >= lag))]
+
+    #the middle of each maneuver is where the turn across the window peaks
+    candidates = np.flatnonzero(turning)
+    runid = np.searchsorted(starts, candidates, side='right') - 1
+    order = np.lexsort((-np.abs(turn[candidates]), runid))
+    centres = candidates[order[np.searchsorted(runid[order], np.arange(starts.shape[0]))]]
+
+    hbefore = heading[before[centres]]
+    hafter = heading[after[centres]]
+
+    #sample heading and distance every second around each maneuver, an (events x seconds) grid
+    offsets = np.arange(-2 * lag, lag + 1.)
+    mid = int(2 * lag)
+    grid = time[centres][:, None] + offsets[None, :]
+    radians = np.radians(heading)
+    hgrid = np.degrees(np.arctan2(np.interp(grid, time, np.sin(radians)), np.interp(grid, time, np.cos(radians))))
+    sgrid = np.interp(grid, time, sailed)
+
+    #it starts at the last second still on the old heading and ends at the first on the new one
+    settled = config['maneuversettle']
+    onold = np.abs(headingdiff(hbefore[:, None], hgrid[:, :mid + 1])) <= settled
+    onnew = np.abs(headingdiff(hafter[:, None], hgrid[:, mid:])) <= settled
+    entry = np.where(onold.any(axis=1), mid - np.argmax(onold[:, ::-1], axis=1), mid - int(lag))
+    exit = np.where(onnew.any(axis=1), mid + np.argmax(onnew, axis=1), offsets.shape[0] - 1)
+
+    #speed over the lag before it started against the slowest second during it
+    rows = np.arange(centres.shape[0])
+    speedbefore = (sgrid[rows, entry] - sgrid[rows, np.maximum(entry - int(lag), 0)]) * 3600. / np.minimum(entry, lag)
+    secondspeed = np.diff(sgrid, axis=1) * 3600.
+    columns = np.arange(offsets.shape[0] - 1)[None, :]
+    inside = (columns >= entry[:, None]) & (columns < np.maximum(exit, entry + 1)[:, None])
+    minspeed = np.min(np.where(inside, secondspeed, np.inf), axis=1)
+    loss = speedbefore - minspeed
+
+    wind = config['wind']
+    if wind == None and centres.shape[0] > 1:
+        wind = estimatewind(hbefore, hafter, loss)
+
+    if wind == None:
+        kinds = np.full(centres.shape[0], "turn")
+    else:
+        kinds = classifymaneuvers(hbefore, hafter, wind)
+
+    data['maneuvers'] = {'index':centres, 'time':np.asarray(time[centres], dtype=float), 'kind':list(kinds), 'turn':headingdiff(hbefore, hafter),
+                         'duration':offsets[exit] - offsets[entry], 'speedbefore':speedbefore, 'minspeed':minspeed, 'loss':loss, 'wind':wind}
+
+
+"""
+    tack where the bow went through the wind, gybe where the stern did, anything else (bearing away round a mark) is a turn
+"""
+def classifymaneuvers(hbefore, hafter, wind):
+    relbefore = headingdiff(wind, hbefore)
+    relafter = headingdiff(wind, hafter)
+    crossed = np.sign(relbefore) != np.sign(relafter)
+
+    tack = crossed & (np.abs(relbefore) < 90.) & (np.abs(relafter) < 90.)
+    gybe = crossed & (np.abs(relbefore) > 90.) & (np.abs(relafter) > 90.)
+
+    return np.where(tack, "tack", np.where(gybe, "gybe", "turn"))
+
+
+"""
+    Guess where the wind comes from when it isn't given
+    the headings either side of a tack or gybe mirror each other about the wind, so the doubled angle mean of the
+    bisectors gives the wind axis, the end of it with the slower maneuvers is taken as upwind since tacks cost more than gybes
+"""
+def estimatewind(hbefore, hafter, loss):
+    bisector = np.radians(hbefore + headingdiff(hbefore, hafter) / 2.)
+    axis = np.degrees(np.arctan2(np.sum(np.sin(2 * bisector)), np.sum(np.cos(2 * bisector))) / 2.) % 360.
+
+    scores = []
+    for wind in (axis, (axis + 180.) % 360.):
+        kinds = classifymaneuvers(hbefore, hafter, wind)
+        tacks = loss[kinds == "tack"]
+        gybes = loss[kinds == "gybe"]
+
+        if tacks.shape[0] > 0 and gybes.shape[0] > 0:
+            scores.append(np.mean(tacks) - np.mean(gybes))
+        else:
+            #only one sort, racing is mostly upwind so bet on tacks
+            scores.append(tacks.shape[0] - gybes.shape[0])
+
+    return axis if scores[0] >= scores[1] else (axis + 180.) % 360.
+
+
+"""
+    Print the table of tacks and gybes
+"""
+def printmaneuvers(data):
+    maneuvers = data['maneuvers']
+    kinds = np.array(maneuvers['kind'])
+
+    say("")
+    if maneuvers['wind'] == None:
+        say("Maneuvers (%d):" % len(kinds))
+    else:
+        say("Maneuvers, wind from %.0f degrees%s (%d tacks, %d gybes):" % (maneuvers['wind'], "" if config['wind'] != None else " (estimated, set it with --wind)",
+                                                                              np.count_nonzero(kinds == "tack"), np.count_nonzero(kinds == "gybe")))
+
+    if len(kinds) == 0:
+        say("\tnone")
+        return
+
+    say("\t%-10s %-5s %6s %9s %8s %8s %8s" % ("Time", "Kind", "Turn", "Seconds", "Knots", "Min kts", "Loss"))
+    for idx in range(len(kinds)):
+        secs = int(round(maneuvers['time'][idx]))
+        say("\t%3d:%02d:%02d  %-5s %6.0f %9.0f %8.2f %8.2f %8.2f" % (secs // 3600, secs // 60 % 60, secs % 60, kinds[idx], maneuvers['turn'][idx],
+                                                                     maneuvers['duration'][idx], maneuvers['speedbefore'][idx], maneuvers['minspeed'][idx], maneuvers['loss'][idx]))
+
+
+"""
+    Draw the tacks and gybes on the current track graph
+"""
+def drawmaneuvers(data):
+    if 'maneuvers' not in data:
+        return
+
+    maneuvers = data['maneuvers']
+    kinds = np.array(maneuvers['kind'])
+    for kind, marker, color in (("tack", "^", "red"), ("gybe", "v", "blue")):
+        idx = maneuvers['index'][kinds == kind]
+        if idx.shape[0] == 0:
+            continue
+
+        plt.scatter(data['data']['lonnm'][idx], data['data']['latnm'][idx], marker=marker, facecolors='none', edgecolors=color, s=60, zorder=3, label="%ss" % kind)
+        for point, loss in zip(idx, maneuvers['loss'][kinds == kind]):
+            plt.annotate("%s %.1f" % (kind[0].upper(), loss), (data['data']['lonnm'][point], data['data']['latnm'][point]), fontsize='x-small', color=color)
+
+    plt.legend(loc='best', fontsize='small')
+
+
+"""
+    Grow a numpy buffer to hold at least size elements, doubling so appends are amortized O(1)
+"""
+def growbuffer(buf, size):
+    newbuf = np.empty(max(size, buf.shape[0] * 2), dtype=buf.dtype)
+    newbuf[:buf.shape[0]] = buf
+    return newbuf
+
+
+"""
+    Strip the namespace from an ElementTree tag
+"""
+def localtag(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+"""
+    Fresh parser state for gpxevents, the point buffers grow as points arrive
+"""
+def newgpxstate(initsize=4096):
+    return {'lat':np.empty(initsize), 'lon':np.empty(initsize), 'time':[], 'count':0, 'notime':0,
+            'trkcount':0, 'segcount':0, 'metadatacount':0, 'stack':[]}
+
+
+"""
+    Handle a run of ElementTree (event, element) pairs, appending track points to state and metadata to data
+    state carries over between calls so a file can be fed a piece at a time
+"""
+def gpxevents(events, state, data):
+    stack = state['stack']
+
+    for event, elem in events:
+        tag = localtag(elem.tag)
+
+        if event == "start":
+            stack.append(elem)
+
+            if tag == "trk":
+                state['trkcount'] += 1
+
+            elif tag == "trkseg":
+                state['segcount'] += 1
+
+            elif tag == "metadata":
+                state['metadatacount'] += 1
+
+            continue
+
+        stack.pop()
+        parentelem = stack[-1] if len(stack) > 0 else None
+        parent = localtag(parentelem.tag) if parentelem is not None else None
+
+        if tag == "trkpt":
+            count = state['count']
+            if count == state['lat'].shape[0]:
+                state['lat'] = growbuffer(state['lat'], count + 1)
+                state['lon'] = growbuffer(state['lon'], count + 1)
+
+            #only the first time stamp in the point matters
+            stamp = None
+            for child in elem:
+                if localtag(child.tag) == "time":
+                    stamp = child.text
+                    break
+
+            #a point with no time can't go on the time line, so it is left out rather than shifting every time after it
+            if stamp != None:
+                state['lat'][count] = float(elem.get("lat"))
+                state['lon'][count] = float(elem.get("lon"))
+                state['time'].append(stamp)
+                state['count'] += 1
+
+            else:
+                state['notime'] += 1
+                if state['notime'] == 1:
+                    say("***Warning, track point %d (lat %s lon %s) has no time stamp, leaving out points without one***" % (count + state['notime'], elem.get("lat"), elem.get("lon")))
+
+            #free the point so the tree never grows with the track
+            elem.clear()
+            if parentelem is not None:
+                parentelem.remove(elem)
+
+        elif tag == "name" and parent == "trk" and state['trkcount'] == 1 and data['name'] == None:
+            data['name'] = elem.text
+
+        elif tag == "time" and parent == "metadata" and state['metadatacount'] == 1:
+            data['time'] = elem.text
+
+        elif tag == "bounds" and parent == "metadata" and state['metadatacount'] == 1:
+            data['maxlat'] = float(elem.get('maxlat'))
+            data['maxlon'] = float(elem.get('maxlon'))
+            data['minlat'] = float(elem.get('minlat'))
+            data['minlon'] = float(elem.get('minlon'))
+
+
+"""
+    Stream through a GPX file in one pass without building a DOM
+    fills the track name/time/bounds into data and returns the point buffers
+"""
+def parsegpx(path, data, initsize=4096):
+
+    data['name'] = None
+    state = newgpxstate(initsize)
+
+    gpxevents(ElementTree.iterparse(path, events=("start", "end")), state, data)
+
+    #the original code only trusted metadata if there was exactly one block
+    if state['metadatacount'] != 1:
+        for key in ('time','maxlat','maxlon','minlat','minlon'):
+            data.pop(key, None)
+
+    if 'time' not in data:
+        for key in ('maxlat','maxlon','minlat','minlon'):
+            data.pop(key, None)
+
+    count = state['count']
+    return {'lat':state['lat'][:count], 'lon':state['lon'][:count], 'time':state['time'], 'count':count, 'segcount':state['segcount'], 'hasmetadata':state['metadatacount'] == 1}
+
+
+"""
+    Work out where the track cache lives
+"""
+def cachedir():
+    if config['cachedir']:
+        return config['cachedir']
+
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "marinegpxgrapher")
+
+
+"""
+    sha1 of a files contents read a block at a time
+"""
+def filehash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+"""
+    Save arrays to the cache atomically so a crash (or another process) never sees half a file
+"""
+def cachewrite(filename, arrays):
+    tmpname = "%s.%d.tmp" % (filename, os.getpid())
+    with open(tmpname, 'wb') as f:
+        if filename.endswith('.npz'):
+            np.savez(f, **arrays)
+        else:
+            np.save(f, arrays)
+
+    os.replace(tmpname, filename)
+
+
+"""
+    Try and load the parsed track from the cache, on a hit fills data exactly like readtrack does
+    the entry is keyed by the files path and only trusted if size and mtime (or failing that the content hash) still match
+"""
+def cacheload(path, data):
+    import zipfile
+
+    data['cachekey'] = hashlib.sha1(("%d:%s" % (cacheversion, os.path.abspath(path))).encode('utf-8')).hexdigest()
+    filename = os.path.join(cachedir(), data['cachekey'] + ".npz")
+
+    try:
+        stat = os.stat(path)
+        with np.load(filename) as cached:
+            meta = json.loads(str(cached['meta']))
+            arrays = {key:cached[key] for key in ('lat','lon','time')}
+
+    except (IOError, ValueError, KeyError, zipfile.BadZipFile):
+        return False
+
+    if meta['size'] != stat.st_size:
+        return False
+
+    if meta['mtime'] != stat.st_mtime:
+        #touched but maybe not changed
+        if meta['sha1'] != filehash(path):
+            return False
+
+        meta['mtime'] = stat.st_mtime
+        cachewrite(filename, dict(arrays, meta=np.array(json.dumps(meta))))
+
+    for key in ('name','time','maxlat','maxlon','minlat','minlon','segcount','hasmetadata','ptcount','starttime'):
+        if key in meta:
+            data[key] = meta[key]
+
+    data['data'] = arrays
+    cachetouch(filename)
+
+    say("Using cached track data")
+    return True
+
+
+"""
+    Store the parsed track in the cache
+"""
+def cachestore(path, data):
+    stat = os.stat(path)
+    meta = {'size':stat.st_size, 'mtime':stat.st_mtime, 'sha1':filehash(path)}
+
+    for key in ('name','time','maxlat','maxlon','minlat','minlon','segcount','hasmetadata','ptcount','starttime'):
+        if key in data:
+            meta[key] = data[key]
+
+    try:
+        os.makedirs(cachedir(), exist_ok=True)
+        cachewrite(os.path.join(cachedir(), data['cachekey'] + ".npz"), {'meta':np.array(json.dumps(meta)), 'lat':data['data']['lat'], 'lon':data['data']['lon'], 'time':data['data']['time']})
+
+    except IOError as e:
+        say("***Warning, could not write track cache (%s)***" % e)
+        return
+
+    #new base entry means stale derived channels from an older version of the file must go
+    for filename in glob.glob(os.path.join(glob.escape(cachedir()), data['cachekey'] + ".*.npy")):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+    cacheevict()
+
+
+"""
+    File name for a derived channel, keyed by the settings that produced it
+"""
+def channelfile(data, name, params):
+    #everything derived depends on how the points were cleaned and projected
+    params = dict(params, clean=cleanparams(), geodesy=geodesyparams())
+    paramkey = hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cachedir(), "%s.%s.%s.npy" % (data['cachekey'], name, paramkey))
+
+
+"""
+    Load derived channels from the cache (memory mapped copy on write) or compute them and cache the result
+"""
+def cachedchannels(data, names, params, compute):
+
+    if data['cachekey'] == None:
+        compute()
+        return
+
+    filenames = [channelfile(data, name, params) for name in names]
+
+    try:
+        loaded = [np.load(filename, mmap_mode='c') for filename in filenames]
+
+    except (IOError, ValueError):
+        compute()
+
+        try:
+            for name, filename in zip(names, filenames):
+                cachewrite(filename, data['data'][name])
+
+        except IOError as e:
+            say("***Warning, could not write track cache (%s)***" % e)
+
+        cacheevict()
+        return
+
+    for name, filename, array in zip(names, filenames, loaded):
+        data['data'][name] = array
+        cachetouch(filename)
+
+
+"""
+    Mark a cache file as just used
+"""
+def cachetouch(filename):
+    try:
+        os.utime(filename)
+    except OSError:
+        pass
+
+
+"""
+    Drop the least recently used tracks (with all their channels) until the cache fits in config['cachesize'] MB
+"""
+def cacheevict():
+    entries = {}
+
+    for filename in glob.glob(os.path.join(glob.escape(cachedir()), "*.np[yz]")):
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            continue
+
+        key = os.path.basename(filename).split('.')[0]
+        entry = entries.setdefault(key, {'files':[], 'size':0, 'used':0})
+        entry['files'].append(filename)
+        entry['size'] += stat.st_size
+        entry['used'] = max(entry['used'], stat.st_mtime)
+
+    total = sum(entry['size'] for entry in entries.values())
+    limit = config['cachesize'] * 1024 * 1024
+
+    for key in sorted(entries, key=lambda key: entries[key]['used']):
+        if total <= limit:
+            break
+
+        for filename in entries[key]['files']:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+        total -= entries[key]['size']
+
+
+"""
+    Delete everything in the cache
+"""
+def clearcache():
+    removed = 0
+    for filename in glob.glob(os.path.join(glob.escape(cachedir()), "*.np[yz]")) + glob.glob(os.path.join(glob.escape(cachedir()), "*.tmp")):
+        try:
+            os.remove(filename)
+            removed += 1
+        except OSError:
+            pass
+
+    say("Removed %d files from cache %s" % (removed, cachedir()))
+
+
+"""
+    Parse the GPX file into data, fills the metadata and data['data'] lat/lon/time
+"""
+def readtrack(path, data):
+
+    try:
+        with stage("parsegpx") as record:
+            gpxpts = parsegpx(path, data)
+            record['points'] = gpxpts['count']
+
+    except (xmlerror, ElementTree.ParseError):
+        raise TrackError(2, "GPX file is not properly formated XML, sorry I cant help you with this", path)
+
+    except IOError:
+        raise TrackError(5, "Could not open file", path)
+
+    data['segcount'] = gpxpts['segcount']
+    data['hasmetadata'] = gpxpts['hasmetadata']
+    data['ptcount'] = gpxpts['count']
+
+    if gpxpts['count'] == 0:
+        raise TrackError(100, "File contains no tracking points, program can not continue!", path)
+
+    with stage("convdatetime", data['ptcount']):
+        #setup time converter
+        checkdtformat(gpxpts['time'][0])
+
+        #convert all the time stamps in one go
+        data['starttime'], times = convdatetime(gpxpts['time'])
+
+    data['data'] = { 'lat': gpxpts['lat'], 'lon':gpxpts['lon'], 'time':times }
+
+
+"""
+    Settings the cleaning stage was run with, derived channels are cached against these
+"""
+def cleanparams():
+    if not config['clean']:
+        return None
+
+    return {'maxspeed':config['cleanmaxspeed'], 'maxaccel':config['cleanmaxaccel'], 'fillgaps':config['fillgaps']}
+
+
+"""
+    Points that jumped off the track, returns a mask
+    either both steps next to a point are faster than config['cleanmaxspeed'] knots or it speeds up into the point and back down
+    out of it faster than config['cleanmaxaccel'] knots a second, the end points only have the one step to go on
+"""
+def findspikes(lat, lon, time):
+    n = time.shape[0]
+    spikes = np.zeros(n, dtype=bool)
+    if n < 3:
+        return spikes
+
+    maxspeed = config['cleanmaxspeed']
+    maxaccel = config['cleanmaxaccel']
+
+    latnm, lonnm = projectlatlon(lat, lon, lat[0], lon[0])
+    dt = np.diff(time)
+    speed = calcdist({'data':{'lat':lat, 'lon':lon, 'latnm':latnm, 'lonnm':lonnm}}) / dt * 3600.
+
+    spikes[1:-1] = (speed[:-1] > maxspeed) & (speed[1:] > maxspeed)
+    spikes[0] = (speed[0] > maxspeed) & (speed[1] <= maxspeed)
+    spikes[-1] = (speed[-1] > maxspeed) & (speed[-2] <= maxspeed)
+
+    #rise is the change in speed coming into each point, fall the change going out
+    rise = np.zeros(n)
+    fall = np.zeros(n)
+    rise[2:] = (speed[1:] - speed[:-1]) / dt[1:]
+    fall[:-2] = (speed[:-1] - speed[1:]) / dt[:-1]
+    spikes |= (rise > maxaccel) & (fall > maxaccel)
+
+    return spikes
+
+
+"""
+    Fill gaps of up to maxgap seconds with points on a straight line at the usual logging interval, returns lat, lon, time and the number added
+"""
+def fillgaps(lat, lon, time, maxgap):
+    n = time.shape[0]
+    dt = np.diff(time)
+    step = np.median(dt) if n > 1 else 0.
+    if step <= 0:
+        return lat, lon, time, 0
+
+    #anything over one and a half intervals gets points
+    extra = np.append(np.where(dt <= maxgap, np.maximum(np.floor(dt / step - 0.5), 0), 0).astype(np.int64), 0)
+    if np.sum(extra) == 0:
+        return lat, lon, time, 0
+
+    counts = extra + 1
+    seg = np.repeat(np.arange(n), counts)
+    frac = (np.arange(seg.shape[0]) - np.repeat(np.cumsum(counts) - counts, counts)) / counts[seg]
+    nxt = np.minimum(seg + 1, n - 1)
+
+    return (lat[seg] + (lat[nxt] - lat[seg]) * frac, lon[seg] + (lon[nxt] - lon[seg]) * frac,
+            time[seg] + (time[nxt] - time[seg]) * frac, int(np.sum(extra)))
+
+
+"""
+    Clean the raw points before anything is worked out from them, all done with masks over the whole track
+    points that go back in time are dropped, points sharing a time stamp are merged (positions averaged), spikes are dropped
+    (a few passes since taking one out can show another) and gaps up to config['fillgaps'] seconds are filled if asked
+    returns the cleaned lat, lon, time and a count of what was done
+"""
+def cleanpoints(lat, lon, time):
+    report = {'backwards':0, 'duplicates':0, 'spikes':0, 'filled':0}
+
+    backwards = np.zeros(time.shape[0], dtype=bool)
+    backwards[1:] = time[1:] < np.maximum.accumulate(time)[:-1]
+    if np.any(backwards):
+        report['backwards'] = int(np.count_nonzero(backwards))
+        lat, lon, time = lat[~backwards], lon[~backwards], time[~backwards]
+
+    first = np.ones(time.shape[0], dtype=bool)
+    first[1:] = time[1:] != time[:-1]
+    if not np.all(first):
+        report['duplicates'] = int(time.shape[0] - np.count_nonzero(first))
+        group = np.cumsum(first) - 1
+        counts = np.bincount(group)
+        lat = np.bincount(group, lat) / counts
+        lon = np.bincount(group, lon) / counts
+        time = time[first]
+
+    for i in range(config['cleanpasses']):
+        spikes = findspikes(lat, lon, time)
+        if not np.any(spikes):
+            break
+
+        report['spikes'] += int(np.count_nonzero(spikes))
+        lat, lon, time = lat[~spikes], lon[~spikes], time[~spikes]
+
+    if config['fillgaps']:
+        lat, lon, time, report['filled'] = fillgaps(lat, lon, time, config['fillgaps'])
+
+    return lat, lon, time, report
+
+
+"""
+    Run the cleaning stage on a loaded track, keeps time counting from the first point if that one went
+"""
+def cleantrack(data):
+    lat, lon, time, data['cleaning'] = cleanpoints(data['data']['lat'], data['data']['lon'], data['data']['time'])
+
+    if time.shape[0] < 2:
+        raise TrackError(100, "Less than two points left after cleaning, program can not continue! (try --no-clean)", data['filename'])
+
+    if time[0] != 0:
+        data['starttime'] += time[0]
+        time = time - time[0]
+
+    data['data'] = {'lat':lat, 'lon':lon, 'time':time}
+    data['ptcount'] = time.shape[0]
+
+
+"""
+    Say what the cleaning stage did, if anything
+"""
+def printcleaning(data):
+    report = data['cleaning']
+    if sum(report.values()) == 0:
+        return
+
+    say("Cleaned track: merged %d duplicate time stamps, dropped %d out of order and %d spikes, filled in %d points" % (report['duplicates'], report['backwards'], report['spikes'], report['filled']))
+
+
+"""
+    Get lat/lon/time and the metadata into data, from the cache if we can otherwise by parsing the file
+"""
+def loadbase(path, data):
+
+    if config['usecache']:
+        with stage("cacheload"):
+            cacheload(path, data)
+
+    if 'data' not in data:
+        readtrack(path, data)
+
+        if config['usecache']:
+            with stage("cachestore", data['ptcount']):
+                cachestore(path, data)
+
+
+"""
+    Print what we know about the track once the points are in
+"""
+def printtrackinfo(data):
+
+    #parse metadata
+    #add some error checking here to since I dont know if this metadata is availble in all tracking file
+
+    if data['name'] != None:
+        say("Track title: ", data['name'])
+
+    else:
+        say("Track has no name")
+
+
+    if 'time' in data:
+        say("Track recorded at %s with" % ( data['time'] ))
+
+        if 'maxlat' in data:
+            say("\tMaximum/Minimum Latitude:\t%s\t/\t%s" % ( data['maxlat'], data['minlat'] ))
+            say("\tMaximum/Minimum Longitude:\t%s\t/\t%s" % ( data['maxlon'], data['minlon'] )) 
+
+    elif not data['hasmetadata']:
+        say("Metadata not found continuing")
+    
+    say("Track has %i segments" % data['segcount'])
+
+    say("Found %i points of tracking data" % (data['ptcount']))
+
+    totaltime = data['data']['time'][len(data['data']['time'])-1]
+
+    if totaltime > 9000:
+        say("Track elapsed time is: %f hours" % (totaltime / 3600.))
+
+    else:
+        say("Track elapsed time is: %f minutes" % (totaltime / 60.))
+
+
+"""
+    Channels worked out from the positions and times
+"""
+derivedchannels = ('latnm', 'lonnm', 'speed', 'speedavg', 'angle')
+
+
+"""
+    Work out a derived channel (and whatever it needs first) unless it's already there, from the cache when it can
+    returns the channel
+"""
+def derivechannel(data, name):
+    channels = data['data']
+    if name in channels:
+        return channels[name]
+
+    if name in ('latnm', 'lonnm'):
+        #convert latlong to nautical mile offset
+        with stage("havconvlatlon", data['ptcount']):
+            cachedchannels(data, ('latnm','lonnm'), {}, lambda: havconvlatlon(data))
+
+    elif name == 'speed':
+        derivechannel(data, 'latnm')
+        with stage("calcspeed", data['ptcount']):
+            cachedchannels(data, ('speed',), {}, lambda: calcspeed(data))
+
+    elif name == 'speedavg':
+        derivechannel(data, 'speed')
+        rollavgparams = {'points':config['rollavg_points'], 'method':config['rollavg_method'], 'seconds':config['rollavg_seconds']}
+        with stage("calcspeed_rollavg", data['ptcount']):
+            cachedchannels(data, ('speedavg',), rollavgparams, lambda: calcspeed_rollavg(data,config['rollavg_points'],config['rollavg_method'],config['rollavg_seconds']))
+
+    elif name == 'angle':
+        derivechannel(data, 'latnm')
+        with stage("calcangle", data['ptcount']):
+            cachedchannels(data, ('angle',), {'method':'arctan2'}, lambda: calcangle(data))
+
+    else:
+        raise KeyError(name)
+
+    return channels[name]
+
+
+"""
+    Load garmin data, provide filename 
+    returns object with metadata and datapoints
+"""
+def loaddata(path):
+
+    startloadtime = datetime.now()
+
+    say("Loading data from \"%s\"" % os.path.basename(path))
+
+    data = {'filename':os.path.basename(path), 'markfiles':config['markfiles'], 'cachekey':None}
+
+    loadbase(path, data)
+
+    if config['clean']:
+        with stage("cleantrack", data['ptcount']):
+            cleantrack(data)
+
+    printtrackinfo(data)
+    if config['clean']:
+        printcleaning(data)
+
+    for name in derivedchannels:
+        derivechannel(data, name)
+
+    #load marks from markfiles
+    if data['markfiles']:
+        with stage("loadmarkfiles"):
+            loadmarkfiles(data)
+
+        with stage("markroundings", data['ptcount']):
+            markroundings(data, config['markradius'])
+
+    if config['maneuvers']:
+        with stage("findmaneuvers", data['ptcount']):
+            findmaneuvers(data)
+
+    loadtime = datetime.now() - startloadtime
+
+    say("Track \"%s\" loaded (load time %i ms)!" % (os.path.basename(path), loadtime.seconds * 1000. + loadtime.microseconds/1000))
+
+    return data
+
+
+"""
+    Where the chunked loader puts its channel files, --out if given otherwise a temporary directory removed at exit
+"""
+def chunkworkdir():
+    if config['outdir']:
+        os.makedirs(config['outdir'], exist_ok=True)
+        return config['outdir']
+
+    import tempfile
+    import shutil
+    workdir = tempfile.mkdtemp(prefix="marinegpxgrapher-")
+    atexit.register(shutil.rmtree, workdir, True)
+    return workdir
+
+
+"""
+    Work out every channel for the points the parser has collected and append them to the channel files
+    carry holds what has to cross from one chunk to the next, the last point (its heading needs the next one),
+    the tail of speeds the rolling average still looks back at and the running stats
+"""
+def chunkflush(state, data, carry, files):
+    n = state['count']
+    if n == 0:
+        return
+
+    lat = state['lat'][:n]
+    lon = state['lon'][:n]
+
+    if carry['count'] == 0:
+        checkdtformat(state['time'][0])
+        data['starttime'], times = convdatetime(state['time'])
+        carry['lat0'] = lat[0]
+        carry['lon0'] = lon[0]
+
+    else:
+        times = convdatetime(state['time'], data['starttime'])[1]
+
+    del state['time'][:]
+
+    if config['clean']:
+        if carry['count'] == 0:
+            lat, lon, times, report = cleanpoints(lat, lon, times)
+            if times.shape[0] > 0 and times[0] != 0:
+                data['starttime'] += times[0]
+                times = times - times[0]
+
+        else:
+            #clean with the last point written in front, it can't be changed now so whatever lines up with it goes
+            prev = carry['prevraw']
+            lat, lon, times, report = cleanpoints(np.insert(lat, 0, prev[0]), np.insert(lon, 0, prev[1]), np.insert(times, 0, prev[2]))
+            if times.shape[0] > 0 and times[0] == prev[2]:
+                lat, lon, times = lat[1:], lon[1:], times[1:]
+
+        for key in report:
+            carry['cleaning'][key] += report[key]
+
+        n = times.shape[0]
+        if n == 0:
+            state['count'] = 0
+            return
+
+        if carry['count'] == 0:
+            carry['lat0'] = lat[0]
+            carry['lon0'] = lon[0]
+
+    latnm, lonnm = projectlatlon(lat, lon, carry['lat0'], carry['lon0'])
+
+    #put the last point of the previous chunk on the front so speed and heading run across the join
+    if carry['count'] == 0:
+        tail = {'data':{'lat':lat, 'lon':lon, 'latnm':latnm, 'lonnm':lonnm, 'time':times}}
+        speed = np.insert(calcdist(tail) / calctimedelta(tail), 0, [0.0])
+    else:
+        prev = carry['prev']
+        prevraw = carry['prevraw']
+        tail = {'data':{'lat':np.insert(lat, 0, prevraw[0]), 'lon':np.insert(lon, 0, prevraw[1]),
+                        'latnm':np.insert(latnm, 0, prev[0]), 'lonnm':np.insert(lonnm, 0, prev[1]), 'time':np.insert(times, 0, prev[2])}}
+        speed = calcdist(tail) / calctimedelta(tail)
+
+    #every heading but the newest point's is final now
+    if tail['data']['latnm'].shape[0] > 1:
+        calcangle(tail)
+        angles = tail['data']['angle'][:-1]
+        carry['angle'] = angles[-1]
+        files['angle'].write(angles.astype(config['dtype']).tobytes())
+
+    #rolling average over the carried tail plus the new speeds
+    old = carry['speed'].shape[0]
+    roll = {'data':{'speed':np.concatenate((carry['speed'], speed)), 'time':np.concatenate((carry['time'], times)),
+                    'speedavg':np.concatenate((carry['speedavg'], np.zeros(n)))}}
+    extendrollavg(roll, old, config['rollavg_points'], config['rollavg_method'], config['rollavg_seconds'])
+    speedavg = roll['data']['speedavg'][old:]
+
+    #keep just what the next chunk's windows can reach back to
+    lo = max(roll['data']['speed'].shape[0] - config['rollavg_points'] - 1, 0)
+    if config['rollavg_seconds']:
+        lo = min(lo, np.searchsorted(roll['data']['time'], roll['data']['time'][-1] - config['rollavg_seconds'], side='right') - 1)
+    for name in ('speed', 'time', 'speedavg'):
+        carry[name] = roll['data'][name][max(lo, 0):].copy()
+
+    for name, values in (('time', times), ('lat', lat), ('lon', lon)):
+        files[name].write(values.tobytes())
+
+    for name, values in (('latnm', latnm), ('lonnm', lonnm), ('speed', speed), ('speedavg', speedavg)):
+        files[name].write(values.astype(config['dtype']).tobytes())
+
+    stats = carry['stats']
+    stats['distance'] += np.sum(calcdist(tail))
+    stats['maxspeed'] = max(stats['maxspeed'], np.nanmax(speed))
+    stats['maxspeedavg'] = max(stats['maxspeedavg'], np.nanmax(speedavg))
+    stats['minlat'] = min(stats['minlat'], np.min(lat))
+    stats['maxlat'] = max(stats['maxlat'], np.max(lat))
+    stats['minlon'] = min(stats['minlon'], np.min(lon))
+    stats['maxlon'] = max(stats['maxlon'], np.max(lon))
+    stats['elapsed'] = times[-1]
+
+    carry['prev'] = (latnm[-1], lonnm[-1], times[-1])
+    carry['prevraw'] = (lat[-1], lon[-1], times[-1])
+    carry['count'] += n
+    state['count'] = 0
+
+
+"""
+    Load a track a chunk of points at a time for logs too big to hold in memory
+    the channels are written to files and memory mapped back, stats are added up as it goes so they never need the whole track
+"""
+def loadchunked(path):
+
+    startloadtime = datetime.now()
+
+    #the first chunk has to cover the rolling average start up
+    chunkpoints = max(config['chunkpoints'], config['rollavg_points'] + 1)
+
+    say("Loading data from \"%s\" in chunks of %d points" % (os.path.basename(path), chunkpoints))
+
+    data = {'filename':os.path.basename(path), 'markfiles':config['markfiles'], 'cachekey':None, 'name':None}
+
+    workdir = chunkworkdir()
+    base = os.path.splitext(os.path.basename(path))[0]
+    dtypes = {name:(np.float64 if name in ('time', 'lat', 'lon') else np.dtype(config['dtype'])) for name in exportchannels}
+    filenames = {name:os.path.join(workdir, "%s.%s.%s" % (base, name, np.dtype(dtypes[name]).name)) for name in exportchannels}
+
+    state = newgpxstate(min(chunkpoints, 1 << 16))
+    carry = {'count':0, 'angle':0., 'cleaning':{'backwards':0, 'duplicates':0, 'spikes':0, 'filled':0}, 'speed':np.zeros(0), 'time':np.zeros(0), 'speedavg':np.zeros(0),
+             'stats':{'distance':0., 'maxspeed':-np.inf, 'maxspeedavg':-np.inf, 'minlat':np.inf, 'maxlat':-np.inf, 'minlon':np.inf, 'maxlon':-np.inf, 'elapsed':0.}}
+    parser = ElementTree.XMLPullParser(events=("start", "end"))
+
+    files = {name:open(filenames[name], 'wb') for name in exportchannels}
+    try:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 16), b''):
+                parser.feed(block)
+                gpxevents(parser.read_events(), state, data)
+
+                if state['count'] >= chunkpoints:
+                    with stage("chunk", state['count']):
+                        chunkflush(state, data, carry, files)
+
+            parser.close()
+            gpxevents(parser.read_events(), state, data)
+
+        with stage("chunk", state['count']):
+            chunkflush(state, data, carry, files)
+
+        #the last point has no next one so it keeps the heading before it, like calcangle does
+        if carry['count'] > 0:
+            files['angle'].write(np.array([carry['angle']], dtype=config['dtype']).tobytes())
+
+    except ElementTree.ParseError:
+        raise TrackError(2, "GPX file is not properly formated XML, sorry I cant help you with this", path)
+
+    except IOError:
+        raise TrackError(5, "Could not open file", path)
+
+    finally:
+        for f in files.values():
+            f.close()
+
+    if carry['count'] == 0:
+        raise TrackError(100, "File contains no tracking points, program can not continue!", path)
+
+    #same metadata rules as parsegpx
+    if state['metadatacount'] != 1:
+        for key in ('time','maxlat','maxlon','minlat','minlon'):
+            data.pop(key, None)
+
+    if 'time' not in data:
+        for key in ('maxlat','maxlon','minlat','minlon'):
+            data.pop(key, None)
+
+    data['segcount'] = state['segcount']
+    data['hasmetadata'] = state['metadatacount'] == 1
+    data['ptcount'] = carry['count']
+    data['stats'] = carry['stats']
+    data['data'] = {name:np.memmap(filenames[name], dtype=dtypes[name], mode='r', shape=(carry['count'],)) for name in exportchannels}
+
+    data['cleaning'] = carry['cleaning']
+
+    printtrackinfo(data)
+    if config['clean']:
+        printcleaning(data)
+    say("Channels written to %s" % workdir)
+
+    #load marks from markfiles
+    if data['markfiles']:
+        with stage("loadmarkfiles"):
+            loadmarkfiles(data)
+
+        with stage("markroundings", data['ptcount']):
+            markroundings(data, config['markradius'])
+
+    if config['maneuvers']:
+        with stage("findmaneuvers", data['ptcount']):
+            findmaneuvers(data)
+
+    loadtime = datetime.now() - startloadtime
+
+    say("Track \"%s\" loaded (load time %i ms)!" % (os.path.basename(path), loadtime.seconds * 1000. + loadtime.microseconds/1000))
+
+    return data
+
+
+"""
+    Decode a batch of ISO-8601 time stamps to UTC epoch seconds without calling strptime per point
+    handles all the formats checkdtformat knows about, returns whole seconds (int64) and fractions (float)
+"""
+def decodetimes(dtstrs):
+    raw = np.asarray(dtstrs, dtype='S')
+    n = raw.shape[0]
+    width = raw.dtype.itemsize
+    chars = raw.view(np.uint8).reshape(n, width)
+    rows = np.arange(n)
+
+    #pull a column of characters, anything past the end of the string reads as 0
+    def charat(idx):
+        out = np.zeros(n, dtype=np.int64)
+        inside = idx < width
+        out[inside] = chars[rows[inside], idx[inside]]
+        return out
+
+    #the first 19 characters are always YYYY-MM-DDTHH:MM:SS and numpy can parse those in C
+    secs = raw.astype('S19').astype('datetime64[s]').astype(np.int64)
+
+    #fractional seconds are the run of digits after a '.' in position 19
+    hasfrac = charat(np.full(n, 19)) == ord('.')
+    frac = np.zeros(n)
+    ndigits = np.zeros(n, dtype=np.int64)
+    indigits = hasfrac.copy()
+    for pos in range(20, min(width, 29)):
+        digit = chars[:, pos].astype(np.int64) - ord('0')
+        indigits &= (digit >= 0) & (digit <= 9)
+        frac[indigits] += digit[indigits] * 10.0 ** (19 - pos)
+        ndigits += indigits
+
+    #whatever is left is the offset, either Z or +HH:MM / +HHMM / +HH
+    offidx = 19 + np.where(hasfrac, ndigits + 1, 0)
+    sign = charat(offidx)
+    sign = np.where(sign == ord('+'), 1, np.where(sign == ord('-'), -1, 0))
+    hours = (charat(offidx + 1) - ord('0')) * 10 + (charat(offidx + 2) - ord('0'))
+    minidx = np.where(charat(offidx + 3) == ord(':'), offidx + 4, offidx + 3)
+    tens = charat(minidx) - ord('0')
+    units = charat(minidx + 1) - ord('0')
+    minutes = np.where((tens >= 0) & (tens <= 9) & (units >= 0) & (units <= 9), tens * 10 + units, 0)
+
+    secs -= sign * (hours * 3600 + minutes * 60)
+
+    return secs, frac
+
+
+"""
+    Convert Garmin UTC format time stamps to float seconds from starttime (epoch seconds, defaults to the first point)
+    returns the start time used and the converted array
+"""
+def convdatetime(dtstrs, starttime=None):
+
+    try:
+        secs, frac = decodetimes(dtstrs)
+
+    except ValueError:
+        #odd stamp somewhere in the file, fall back to the slow way using the format checkdtformat found
+        say("***Warning, could not batch decode time stamps falling back to strptime***")
+        moments = [datetime.strptime(dtstr, config['datetimeformat']) for dtstr in dtstrs]
+        #timegm takes the naive Z format times as UTC, .timestamp() would take them as local time
+        secs = np.array([calendar.timegm(moment.utctimetuple()) for moment in moments], dtype=np.int64)
+        frac = np.array([moment.microsecond / 1e6 for moment in moments])
+
+    #subtract the whole seconds as integers so we dont lose the fractions to float precision
+    if starttime == None:
+        startsecs = int(secs[0])
+        startfrac = float(frac[0])
+        starttime = startsecs + startfrac
+
+    else:
+        startsecs = int(np.floor(starttime))
+        startfrac = starttime - startsecs
+
+    return starttime, (secs - startsecs).astype(np.float64) + (frac - startfrac)
+
+"""
+    Check time format potential time formats and set convdatetime
+"""
+def checkdtformat(dtstr):
+
+    format_strings = ["%Y-%m-%dT%H:%M:%S.%f%z","%Y-%m-%dT%H:%M:%S.%fZ","%Y-%m-%dT%H:%M:%S%z","%Y-%m-%dT%H:%M:%SZ"]
+    config['datetimeformat'] = None
+    
+    for idx, fstr in enumerate( format_strings ):
+        try:
+            datetime.strptime(dtstr,fstr)
+            config['datetimeformat'] =   fstr
+            break
+            
+        except ValueError:
+            if idx == (len(format_strings) - 1):
+
+                raise TrackError(1, "No valid time format found for \"%s\" fatal error!  Please report this error at https://github.com/GarysCorner/marinegpxgrapher/issues" % (dtstr))
+
+    say("Time format string found \"%s\"" % (config['datetimeformat']))
+
+
+"""
+    Largest-Triangle-Three-Buckets, picks maxpts indices of the (x, y) line that keep its shape
+    the first and last points are always kept, the loop is over buckets not points
+"""
+def lttb(x, y, maxpts):
+    n = x.shape[0]
+    if maxpts >= n or maxpts < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, maxpts - 1).astype(np.int64)
+    counts = np.diff(edges)
+    xavg = np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / counts
+    yavg = np.add.reduceat(y[1:n - 1], edges[:-1] - 1) / counts
+
+    selected = np.empty(maxpts, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    for bucket in range(maxpts - 2):
+        lo, hi = edges[bucket], edges[bucket + 1]
+        ax, ay = x[selected[bucket]], y[selected[bucket]]
+
+        if bucket + 1 < maxpts - 2:
+            cx, cy = xavg[bucket + 1], yavg[bucket + 1]
+        else:
+            cx, cy = x[n - 1], y[n - 1]
+
+        area = np.abs((ax - cx) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (cy - ay))
+        selected[bucket + 1] = lo + np.argmax(area)
+
+    return selected
+
+
+"""
+    Pick about maxpts indices to draw, shape from lttb plus the extreme samples of every array in keep so no colour gets lost
+"""
+def decimate(x, y, maxpts, keep=()):
+    if maxpts == None or x.shape[0] <= maxpts:
+        return np.arange(x.shape[0])
+
+    extremes = []
+    for values in keep:
+        if np.any(np.isfinite(values)):
+            extremes += [np.nanargmin(values), np.nanargmax(values)]
+
+    return np.union1d(lttb(x, y, maxpts - len(extremes)), np.array(extremes, dtype=np.int64))
+
+
+"""
+    Redraw a decimated plot from the full arrays whenever the user pans or zooms
+    update(idx) is handed the indices of the points to show
+"""
+def attachlod(ax, x, y, maxpts, keep, update):
+
+    def onlimits(changedax):
+        x0, x1 = sorted(ax.get_xlim())
+        y0, y1 = sorted(ax.get_ylim())
+
+        visible = (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+
+        #keep one point either side of the view so lines run off the edge
+        visible[1:] |= visible[:-1].copy()
+        visible[:-1] |= visible[1:].copy()
+
+        idx = np.flatnonzero(visible)
+        if idx.shape[0] > maxpts:
+            idx = idx[decimate(x[idx], y[idx], maxpts, [values[idx] for values in keep])]
+
+        update(idx)
+
+    ax.callbacks.connect('xlim_changed', onlimits)
+    ax.callbacks.connect('ylim_changed', onlimits)
+
+
+"""
+    Draw a line graph decimated to config['maxpoints'] if set
+"""
+def plottimeseries(ax, x, y):
+    maxpts = config['maxpoints']
+    idx = decimate(x, y, maxpts, (y,))
+    line, = ax.plot(x[idx], y[idx])
+
+    if maxpts != None and x.shape[0] > maxpts:
+
+        def update(idx):
+            line.set_data(x[idx], y[idx])
+
+        attachlod(ax, x, y, maxpts, (y,), update)
+
+    return line
+
+
+"""
+    Set the window title if the backend has windows
+"""
+def setwindowtitle(fig, title):
+    manager = getattr(fig.canvas, 'manager', None)
+    if manager is not None:
+        manager.set_window_title(title)
+
+
+"""
+    Draw the track as a line with points coloured by one channel at a time, decimated to config['maxpoints'] if set
+    the geometry is built once and mapchannel() swaps the colours, returns the state mapchannel() works on
+"""
+def plottrack(ax, x, y, keep=()):
+    maxpts = config['maxpoints']
+    idx = decimate(x, y, maxpts, keep)
+
+    state = {'ax':ax, 'idx':None, 'colors':None}
+    state['points'] = ax.scatter(x[idx], y[idx], c=np.zeros(idx.shape[0]), zorder=2)
+    state['line'], = ax.plot(x[idx], y[idx], color='y', zorder=1)
+
+    if maxpts != None and x.shape[0] > maxpts:
+        say("Drawing %d of %d points" % (idx.shape[0], x.shape[0]))
+        state['idx'] = idx
+
+        def update(idx):
+            state['idx'] = idx
+            state['points'].set_offsets(np.column_stack((x[idx], y[idx])))
+            state['points'].set_array(state['colors'][idx])
+            state['line'].set_data(x[idx], y[idx])
+
+        attachlod(ax, x, y, maxpts, keep, update)
+
+    return state
+
+
+"""
+    All the mark names as one artist, a single Text is moved about to stamp each name that is in view
+    instead of an annotate per mark, which gets slow to build and draw with thousands of marks
+    each name goes on the side of its mark towards the middle of the graph so the ones near the edges don't get cut off
+"""
+def marklabels(ax, x, y, names):
+    import matplotlib.artist
+    import matplotlib.text
+    import matplotlib.transforms
+
+    class MarkLabels(matplotlib.artist.Artist):
+
+        def __init__(self):
+            matplotlib.artist.Artist.__init__(self)
+            self.offsets = np.column_stack((x, y))
+            self.names = names
+            self.stamp = matplotlib.text.Text(transform=matplotlib.transforms.IdentityTransform(), clip_on=True)
+            self.set_zorder(3)
+
+        def draw(self, renderer):
+            if not self.get_visible():
+                return
+
+            points = ax.transData.transform(self.offsets)
+            bbox = ax.bbox
+            inside = np.flatnonzero((points[:, 0] >= bbox.x0) & (points[:, 0] <= bbox.x1) & (points[:, 1] >= bbox.y0) & (points[:, 1] <= bbox.y1))
+
+            self.stamp.set_figure(self.figure)
+            self.stamp.set_clip_box(bbox)
+            pad = renderer.points_to_pixels(3.)
+            for idx in inside:
+                px, py = points[idx]
+                right = px > (bbox.x0 + bbox.x1) / 2.
+                top = py > (bbox.y0 + bbox.y1) / 2.
+
+                self.stamp.set_horizontalalignment('right' if right else 'left')
+                self.stamp.set_verticalalignment('top' if top else 'bottom')
+                self.stamp.set_position((px - pad if right else px + pad, py - pad if top else py + pad))
+                self.stamp.set_text(self.names[idx])
+                self.stamp.draw(renderer)
+
+            self.stale = False
+
+    return ax.add_artist(MarkLabels())
+
+
+"""
+    Draw the marks from the mark files on the map
+"""
+def drawmarks(data, ax):
+    if data['markfiles'] and len(data['waypoints']) > 0:
+        return [ax.scatter(data['waypoints']['lonnm'], data['waypoints']['latnm'], marker='x'),
+                marklabels(ax, data['waypoints']['lonnm'], data['waypoints']['latnm'], data['waypoints']['names'])]
+
+    return []
+
+
+"""
+    What the map can be coloured by, graph name -> (title, colorbar label, colormap option)
+"""
+mapchannels = {'time':("Tracking with Time as color", "Time (%s)", 'timecmap'),
+               'angle':("Tracking with angle as color", "Angle (Degrees)", 'speedcmap'),
+               'speed':("Tracking with speed as color", "Speed (knots)", 'speedcmap')}
+
+
+"""
+    Full resolution colours for a map channel
+"""
+def mapcolors(data, name, timescale):
+    if name == 'time':
+        return data['data']['time'] / timescale
+
+    return data['data'][name]
+
+
+"""
+    Colour the map by another channel, only the colour array, colormap and titles change
+"""
+def mapchannel(state, data, name):
+    title, label, cmapoption = mapchannels[name]
+    state['name'] = name
+    points = state['points']
+
+    colors = mapcolors(data, name, state['timescale'])
+    state['colors'] = colors
+
+    if state['idx'] is None:
+        #following a growing track folds the pieces drawn since into the main artists
+        x, y, c = state['series'](slice(0, data['ptcount']))
+        points.set_offsets(np.column_stack((x, y)))
+        points.set_array(c)
+        state['line'].set_data(x, y)
+
+        for artist in state['chunks']:
+            artist.remove()
+        state['chunks'] = []
+
+    else:
+        points.set_array(colors[state['idx']])
+
+    points.set_cmap(config[cmapoption])
+    points.set_clim(np.nanmin(colors), np.nanmax(colors))
+    state['colorbar'].set_label(label % state['timeunit'] if name == 'time' else label)
+    state['ax'].set_title(title)
+
+
+"""
+    Build the track map once with the marks and maneuvers, coloured by the first of names
+    with toggle there are buttons to switch between the names in place of a window each
+"""
+def makemap(data, names, timeunit, timescale, toggle=True):
+    trkname = data['name'] if data['name'] != None else data['filename']
+
+    say("Plotting tracking data with %s as color" % " / ".join(names))
+
+    fig, ax = plt.subplots(figsize=config['figsize'])
+    setwindowtitle(fig, trkname)
+    ax.set_aspect('equal')
+    ax.set_ylabel("NM North-South from start")
+    ax.set_xlabel("NM West-East from start")
+
+    x = data['data']['lonnm']
+    y = data['data']['latnm']
+    state = plottrack(ax, x, y, (data['data']['speed'], data['data']['angle']))
+    state.update({'fig':fig, 'names':names, 'timeunit':timeunit, 'timescale':timescale, 'start':0, 'chunks':[],
+                  'series':lambda sl: (data['data']['lonnm'][sl], data['data']['latnm'][sl], mapcolors(data, state['name'], timescale)[sl])})
+    state['colorbar'] = fig.colorbar(state['points'], ax=ax)
+    ax.grid()
+
+    state['marks'] = drawmarks(data, ax)
+    plt.sca(ax)
+    drawmaneuvers(data)
+
+    mapchannel(state, data, names[0])
+
+    if toggle and len(names) > 1:
+        from matplotlib.widgets import RadioButtons
+
+        fig.subplots_adjust(bottom=0.2)
+        state['buttons'] = RadioButtons(fig.add_axes([0.02, 0.02, 0.16, 0.04 * len(names)]), names)
+
+        def onclick(name):
+            mapchannel(state, data, name)
+            fig.canvas.draw_idle()
+
+        state['buttons'].on_clicked(onclick)
+
+    return state
+
+
+"""
+    Hours or minutes for the time axes and colours, returns the unit and seconds in one
+"""
+def timeunits(data):
+    #this is very ugly fix it
+    if config['hours']:
+        return "hours", 3600.
+
+    if config['minutes']:
+        return "minutes", 60.
+
+    if data['data']['time'][len(data['data']['time'])-1] > 9000:
+        return "hours", 3600.
+
+    return "minutes", 60.
+
+
+"""
+    Build the enabled graphs, the speed history and one track map that switches between time, angle and speed
+    returns a list of (name, figure), if artists is a dict it gets the axes, artists and a series(slice) function for each figure
+    so they can be updated later (the map's is what mapchannel() works on)
+"""
+def makefigures(data, artists=None, toggle=True):
+    loadpyplot()
+    figures = []
+
+    trkname = data['name'] if data['name'] != None else data['filename']
+    timeunit, timescale = timeunits(data)
+    timedatahours = data['data']['time'] / timescale
+
+    if config['showhist']:
+        with stage("plot hist", data['ptcount']):
+   
+            say("Plotting speed over time (%s)..." % (timeunit))
+
+            #plot speed/time    
+            fig, ax = plt.subplots(figsize=config['figsize'])
+            setwindowtitle(fig, trkname)
+            plt.suptitle("Speed / time (knots/%s)" % (timeunit))
+            if config['rollavg_seconds']:
+                rollavgskip = np.searchsorted(data['data']['time'], data['data']['time'][0] + config['rollavg_seconds'])
+                plt.title("(%g second rolling %s)" % (config['rollavg_seconds'], config['rollavg_method']), fontsize='small')
+
+            else:
+                rollavgskip = config['rollavg_points']
+                plt.title("(%d point rolling %s)" % (config['rollavg_points'], config['rollavg_method']), fontsize='small')
+
+            plt.xlabel(timeunit)
+            plt.ylabel("Speed (knots)")
+            line = plottimeseries(ax, timedatahours[rollavgskip:],data['data']['speedavg'][rollavgskip:])
+            figures.append(("hist", fig))
+
+            if artists != None:
+                artists['hist'] = {'fig':fig, 'ax':ax, 'points':None, 'line':line, 'start':rollavgskip, 'chunks':[],
+                                   'series':lambda sl: (data['data']['time'][sl] / timescale, data['data']['speedavg'][sl], None)}
+
+    names = [name for name in mapchannels if config['show' + name]]
+    if names:
+        with stage("plot map", data['ptcount']):
+            state = makemap(data, names, timeunit, timescale, toggle)
+
+        figures.append(("map", state['fig']))
+
+        if artists != None:
+            artists['map'] = state
+
+    return figures
+
+
+"""
+    Draw every enabled graph for saving, save(name, figure) is called for the speed history and then the map once per colour
+    channel (time, angle, speed) as it gets switched, so each still comes out as its own image
+"""
+def renderfigures(data, save):
+    artists = {}
+    figures = makefigures(data, artists, toggle=False)
+
+    if 'hist' in artists:
+        save("hist", artists['hist']['fig'])
+
+    if 'map' in artists:
+        state = artists['map']
+        for name in state['names']:
+            with stage("plot %s" % name, data['ptcount']):
+                mapchannel(state, data, name)
+                save(name, state['fig'])
+
+    for name, fig in figures:
+        plt.close(fig)
+
+
+"""
+    The numbers for the track, distance in NM, elapsed hours and speeds in knots
+"""
+def trackstats(data):
+    #the chunked loader already added these up
+    stats = data['stats'] if 'stats' in data else {'distance':np.sum(calcdist(data)), 'maxspeed':np.nanmax(data['data']['speed']), 'maxspeedavg':np.nanmax(data['data']['speedavg'])}
+
+    hours = (data['data']['time'][-1] - data['data']['time'][0]) / 3600.
+
+    return {'points':data['ptcount'], 'hours':float(hours), 'distance':float(stats['distance']), 'avgspeed':float(stats['distance'] / hours if hours > 0 else 0.),
+            'maxspeed':float(stats['maxspeed']), 'maxspeedavg':float(stats['maxspeedavg'])}
+
+
+"""
+    Print the numbers for the track without drawing anything
+"""
+def printstats(data):
+    stats = trackstats(data)
+
+    say("")
+    say("Track:\t\t\t%s" % (data['name'] if data['name'] != None else data['filename']))
+    say("Points:\t\t\t%d" % data['ptcount'])
+    say("Elapsed time:\t\t%.2f hours" % stats['hours'])
+    say("Distance:\t\t%.2f NM" % stats['distance'])
+    say("Average speed:\t\t%.2f knots" % stats['avgspeed'])
+    say("Maximum speed:\t\t%.2f knots" % stats['maxspeed'])
+    say("Maximum rolling avg:\t%.2f knots" % stats['maxspeedavg'])
+
+    if data['markfiles']:
+        say("Marks in area:\t\t%d" % len(data['waypoints']['names']))
+        printroundings(data)
+
+    if 'maneuvers' in data:
+        printmaneuvers(data)
+
+
+"""
+    Graph all the data this is what you came here for
+"""
+def plotdata(data):
+
+    makefigures(data)
+
+    say("The graphs may be displayed one in front of the other!")
+    
+    with stage("show"):
+        plt.show()
+
+
+"""
+    Channels written by --export, in column order
+"""
+exportchannels = ('time', 'lat', 'lon', 'latnm', 'lonnm', 'speed', 'speedavg', 'angle')
+
+
+"""
+    Track metadata for the export files, everything json can handle
+"""
+def exportmeta(data):
+    meta = {'filename':data['filename'], 'name':data['name'], 'ptcount':int(data['ptcount']), 'segcount':data['segcount'],
+            'starttime':data['starttime'], 'starttimeutc':time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(data['starttime'])),
+            'rollavg_points':config['rollavg_points'], 'rollavg_method':config['rollavg_method'], 'rollavg_seconds':config['rollavg_seconds'],
+            'units':{'time':"seconds from starttime", 'lat':"degrees", 'lon':"degrees", 'latnm':"NM north of first point", 'lonnm':"NM east of first point",
+                     'speed':"knots", 'speedavg':"knots", 'angle':"degrees"}}
+
+    for key in ('time','maxlat','maxlon','minlat','minlon'):
+        if key in data:
+            meta[key] = data[key]
+
+    if data['markfiles'] and len(data['waypoints']['names']) > 0:
+        meta['waypoints'] = {'names':data['waypoints']['names'], 'lat':data['waypoints']['lat'].tolist(), 'lon':data['waypoints']['lon'].tolist()}
+
+    return meta
+
+
+"""
+    Write the channels to a CSV file chunksize rows at a time, the metadata goes in # comment lines at the top
+    only one chunk is ever copied so huge tracks dont need twice the memory
+"""
+def exportcsv(data, filename, chunksize=65536):
+    channels = [data['data'][name] for name in exportchannels]
+
+    with open(filename, 'w') as f:
+        for key, value in exportmeta(data).items():
+            f.write("# %s: %s\n" % (key, json.dumps(value)))
+        f.write(",".join(exportchannels) + "\n")
+
+        for start in range(0, data['ptcount'], chunksize):
+            np.savetxt(f, np.column_stack([channel[start:start + chunksize] for channel in channels]), fmt="%.15g", delimiter=",")
+
+
+"""
+    Write the channels to an uncompressed npz, metadata is a json string in 'meta' (same as the cache files)
+"""
+def exportnpz(data, filename):
+    arrays = {name:data['data'][name] for name in exportchannels}
+    arrays['meta'] = np.array(json.dumps(exportmeta(data)))
+
+    with open(filename, 'wb') as f:
+        np.savez(f, **arrays)
+
+
+"""
+    Write the channels to a parquet file, needs pyarrow so it is only imported here
+"""
+def exportparquet(data, filename):
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise TrackError(12, "Parquet export needs pyarrow (pip install pyarrow), try --export npz or csv instead")
+
+    table = pyarrow.table({name:data['data'][name] for name in exportchannels})
+    table = table.replace_schema_metadata({'marinegpxgrapher':json.dumps(exportmeta(data))})
+    pyarrow.parquet.write_table(table, filename)
+
+
+"""
+    Writer for each --export format
+"""
+exporters = {'csv':exportcsv, 'npz':exportnpz, 'parquet':exportparquet}
+
+
+"""
+    Export the track channels in config['export'] format, to config['outdir'] if set otherwise the current directory
+    returns the filename written
+"""
+def exporttrack(data):
+    outdir = config['outdir'] if config['outdir'] else "."
+    os.makedirs(outdir, exist_ok=True)
+    filename = os.path.join(outdir, os.path.splitext(data['filename'])[0] + "." + config['export'])
+
+    with stage("export %s" % config['export'], data['ptcount']):
+        exporters[config['export']](data, filename)
+
+    say("Exported %d points to %s" % (data['ptcount'], filename))
+
+    return filename
+
+
+"""
+    Load one track and save its graphs to outdir, this runs in a batch worker process
+    returns the file's line for summary.json, a file that fails gets its TrackError code and message there (-1 and the exception for anything else)
+"""
+def batchrender(path, outdir, workerconfig):
+    with Options(workerconfig):
+        loadpyplot('Agg')
+
+        del stagetimings[:]
+        if config['timings'] and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+        result = {'file':path, 'ok':False, 'error':None, 'code':0, 'outputs':[], 'loadms':0., 'renderms':0., 'ptcount':0}
+        log = io.StringIO()
+        starttime = time.perf_counter()
+
+        try:
+            with contextlib.redirect_stdout(log):
+                data = loaddata(path)
+                result['ptcount'] = data['ptcount']
+                result['loadms'] = (time.perf_counter() - starttime) * 1000.
+
+                starttime = time.perf_counter()
+                basename = os.path.splitext(os.path.basename(path))[0]
+
+                def save(name, fig):
+                    for fmt in config['batchformats']:
+                        outname = os.path.join(outdir, "%s-%s.%s" % (basename, name, fmt))
+                        with stage("save %s %s" % (name, fmt)):
+                            fig.savefig(outname, format=fmt)
+                        result['outputs'].append(outname)
+
+                renderfigures(data, save)
+
+                result['renderms'] = (time.perf_counter() - starttime) * 1000.
+                result['ok'] = True
+
+        except TrackError as e:
+            result['error'] = e.message
+            result['code'] = e.code
+
+        except Exception as e:
+            result['error'] = "%s: %s" % (type(e).__name__, e)
+            result['code'] = -1
+
+        plt.close('all')
+        result['log'] = log.getvalue()
+        result['timings'] = list(stagetimings)
+
+        return result
+
+
+"""
+    Render every GPX file in config['batchdir'] to config['outdir'] using a pool of worker processes
+    writes summary.json to the output directory and returns the number of failed files
+"""
+def runbatch():
+    import concurrent.futures
+
+    paths = sorted(glob.glob(os.path.join(glob.escape(config['batchdir']), "*.gpx")) + glob.glob(os.path.join(glob.escape(config['batchdir']), "*.GPX")))
+    outdir = config['outdir']
+    os.makedirs(outdir, exist_ok=True)
+    workers = config['workers'] if config['workers'] else (os.cpu_count() or 1)
+
+    say("Rendering %d files from \"%s\" to \"%s\" with %d workers" % (len(paths), config['batchdir'], outdir, workers))
+
+    starttime = time.perf_counter()
+    results = []
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(batchrender, path, outdir, dict(config)) for path in paths]
+
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            results.append(result)
+
+            if result['ok']:
+                say("OK\t%8.0f ms load\t%8.0f ms render\t%s" % (result['loadms'], result['renderms'], os.path.basename(result['file'])))
+            else:
+                say("FAILED\t%s\t(error %d) %s" % (os.path.basename(result['file']), result['code'], result['error']))
+
+    results.sort(key=lambda result: result['file'])
+    failed = len([result for result in results if not result['ok']])
+    totalms = (time.perf_counter() - starttime) * 1000.
+
+    with open(os.path.join(outdir, "summary.json"), 'w') as f:
+        json.dump({'files':len(results), 'failed':failed, 'totalms':totalms, 'workers':workers, 'results':results}, f, indent=2)
+
+    say("Rendered %d/%d files in %i ms, summary written to %s" % (len(results) - failed, len(results), totalms, os.path.join(outdir, "summary.json")))
+
+    return failed
+
+
+"""
+    Load just the positions and UTC times of one boat for a fleet comparison, runs in a worker process
+    a boat that won't load comes back with error and code set, loadfleet() warns and leaves it out of the fleet
+"""
+def fleetreadtrack(path, workerconfig):
+    with Options(workerconfig):
+        result = {'file':path, 'name':os.path.basename(path), 'error':None, 'code':0}
+
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                data = {'filename':os.path.basename(path), 'markfiles':None, 'cachekey':None}
+                loadbase(path, data)
+
+                #np.interp needs the times in order
+                if config['clean']:
+                    cleantrack(data)
+
+        except TrackError as e:
+            result['error'] = e.message
+            result['code'] = e.code
+            return result
+
+        if data['name'] != None:
+            result['name'] = data['name']
+
+        result['lat'] = data['data']['lat']
+        result['lon'] = data['data']['lon']
+        result['time'] = data['data']['time'] + data['starttime']
+
+        return result
+
+
+"""
+    Load a list of track files in parallel, returns the boats that loaded (in the order given)
+"""
+def loadfleet(paths):
+    import concurrent.futures
+
+    workers = config['workers'] if config['workers'] else (os.cpu_count() or 1)
+    say("Loading %d boats with %d workers" % (len(paths), workers))
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(fleetreadtrack, paths, [dict(config)] * len(paths)))
+
+    boats = []
+    for result in results:
+        if result['error'] != None:
+            say("***Warning, dropping %s (error %d) %s***" % (os.path.basename(result['file']), result['code'], result['error']))
+        else:
+            say("Loaded %d points for %s" % (result['lat'].shape[0], result['name']))
+            boats.append(result)
+
+    return boats
+
+
+"""
+    Put every boat on one UTC time grid (step seconds apart) projected from one shared origin
+    the grid only covers the time every boat was logging, races that don't overlap would otherwise make a huge empty grid
+    each channel is a (boats, times) float32 array, NaN where a boat has no data
+"""
+def resamplefleet(boats, step):
+    start = max(boat['time'][0] for boat in boats)
+    end = min(boat['time'][-1] for boat in boats)
+    if start > end:
+        raise TrackError(100, "The fleet tracks don't overlap in time, they have to be from the same race to be compared")
+
+    #stepping past end would have np.interp hold the last position there, so the grid stops at end
+    grid = start + step * np.arange(int((end - start) // step) + 1)
+
+    #the middle of everyones tracks, so nobody gets their own first point as zero
+    lat0 = (min(np.min(boat['lat']) for boat in boats) + max(np.max(boat['lat']) for boat in boats)) / 2.
+    lon0 = (min(np.min(boat['lon']) for boat in boats) + max(np.max(boat['lon']) for boat in boats)) / 2.
+
+    shape = (len(boats), grid.shape[0])
+    fleet = {'names':[boat['name'] for boat in boats], 'grid':grid, 'step':step, 'origin':(lat0, lon0),
+             'data':{name:np.empty(shape, dtype=np.float32) for name in ('lat', 'lon', 'latnm', 'lonnm', 'speed', 'sailed')}}
+    channels = fleet['data']
+
+    for idx, boat in enumerate(boats):
+        lat = np.interp(grid, boat['time'], boat['lat'], left=np.nan, right=np.nan)
+        lon = np.interp(grid, boat['time'], boat['lon'], left=np.nan, right=np.nan)
+        latnm, lonnm = projectlatlon(lat, lon, lat0, lon0)
+
+        dist = np.empty(grid.shape[0])
+        dist[0] = np.nan
+        dist[1:] = calcdist({'data':{'lat':lat, 'lon':lon, 'latnm':latnm, 'lonnm':lonnm}})
+
+        sailed = np.cumsum(np.nan_to_num(dist))
+        sailed[np.isnan(latnm)] = np.nan
+
+        channels['lat'][idx] = lat
+        channels['lon'][idx] = lon
+        channels['latnm'][idx] = latnm
+        channels['lonnm'][idx] = lonnm
+        channels['speed'][idx] = dist / (step / 3600.)
+        channels['sailed'][idx] = sailed
+
+    return fleet
+
+
+"""
+    Work out how each boat compares to the rest of the fleet at every grid time
+    gap is NM behind the leader, by distance to the mark if one is given otherwise by distance sailed
+    relspeed is knots faster (or slower) than the fleet average
+"""
+def fleetmetrics(fleet, mark=None):
+    channels = fleet['data']
+
+    with warnings.catch_warnings():
+        #times where nobody is sailing give all NaN columns, that's fine
+        warnings.simplefilter('ignore', RuntimeWarning)
+
+        if mark != None:
+            channels['markdist'] = np.hypot(channels['latnm'] - mark[0], channels['lonnm'] - mark[1])
+            channels['gap'] = channels['markdist'] - np.nanmin(channels['markdist'], axis=0)
+
+        else:
+            channels['gap'] = np.nanmax(channels['sailed'], axis=0) - channels['sailed']
+
+        channels['relspeed'] = channels['speed'] - np.nanmean(channels['speed'], axis=0)
+
+
+"""
+    Find a mark by name in the mark files, returns its (latnm, lonnm) from the fleet origin and the waypoints for drawing
+"""
+def fleetmarks(boats, fleet, markname):
+    if not config['markfiles']:
+        if markname:
+            say("***Warning, --fleet-mark needs mark files (-mf), ignoring it***")
+        return None, None
+
+    #loadmarkfiles filters against (and projects from) a track, give it everyone
+    marks = {'markfiles':config['markfiles'], 'data':{'lat':np.concatenate([boat['lat'] for boat in boats]), 'lon':np.concatenate([boat['lon'] for boat in boats])}}
+    loadmarkfiles(marks)
+
+    waypoints = marks['waypoints']
+    waypoints['latnm'], waypoints['lonnm'] = projectlatlon(waypoints['lat'], waypoints['lon'], fleet['origin'][0], fleet['origin'][1])
+
+    if not markname:
+        return None, waypoints
+
+    if markname not in waypoints['names']:
+        say("***Warning, mark \"%s\" not found in the area, no distance to mark graph***" % markname)
+        return None, waypoints
+
+    idx = waypoints['names'].index(markname)
+    return (waypoints['latnm'][idx], waypoints['lonnm'][idx]), waypoints
+
+
+"""
+    Build the fleet graphs, returns a list of (name, figure)
+"""
+def makefleetfigures(fleet, waypoints=None, markname=None):
+    loadpyplot()
+    figures = []
+    channels = fleet['data']
+    hours = (fleet['grid'] - fleet['grid'][0]) / 3600.
+
+    fig, ax = plt.subplots(figsize=config['figsize'])
+    setwindowtitle(fig, "Fleet")
+    ax.set_aspect('equal')
+    plt.title("Fleet tracks")
+    plt.ylabel("NM North-South from fleet center")
+    plt.xlabel("NM West-East from fleet center")
+    for idx, name in enumerate(fleet['names']):
+        ax.plot(channels['lonnm'][idx], channels['latnm'][idx], label=name)
+
+    if waypoints != None and len(waypoints['names']) > 0:
+        ax.scatter(waypoints['lonnm'], waypoints['latnm'], marker='x', color='k')
+        for idx in range(len(waypoints['names'])):
+            ax.annotate(waypoints['names'][idx], (waypoints['lonnm'][idx], waypoints['latnm'][idx]))
+
+    ax.legend(fontsize='small')
+    plt.grid()
+    figures.append(("tracks", fig))
+
+    graphs = [("gap", "gap", "NM behind leader", "Gap to leader" + (" (distance to %s)" % markname if 'markdist' in channels else " (distance sailed)")),
+              ("relspeed", "relspeed", "Knots vs fleet average", "Speed relative to the fleet")]
+    if 'markdist' in channels:
+        graphs.append(("markdist", "markdist", "NM", "Distance to %s" % markname))
+
+    for figname, channel, ylabel, title in graphs:
+        fig, ax = plt.subplots(figsize=config['figsize'])
+        setwindowtitle(fig, "Fleet")
+        plt.title(title)
+        plt.xlabel("hours from when every boat was logging")
+        plt.ylabel(ylabel)
+        for idx, name in enumerate(fleet['names']):
+            ax.plot(hours, channels[channel][idx], label=name)
+        ax.legend(fontsize='small')
+        plt.grid()
+        figures.append((figname, fig))
+
+    return figures
+
+
+"""
+    Compare a fleet of boats, shows the graphs or saves them to config['outdir'] if it is set
+"""
+def runfleet(paths):
+    boats = loadfleet(paths)
+    if len(boats) == 0:
+        raise TrackError(100, "None of the fleet tracks could be loaded")
+
+    fleet = resamplefleet(boats, config['fleetstep'])
+    say("Fleet of %d boats on a %d point grid (%g second steps)" % (len(boats), fleet['grid'].shape[0], fleet['step']))
+
+    logged = sum(boat['time'][-1] - boat['time'][0] for boat in boats)
+    if logged > 0 and fleet['grid'][-1] - fleet['grid'][0] < 0.5 * logged / len(boats):
+        say("***Warning, the boats were only all logging for %.1f hours, the graphs only cover that***" % ((fleet['grid'][-1] - fleet['grid'][0]) / 3600.))
+
+    mark, waypoints = fleetmarks(boats, fleet, config['fleetmark'])
+    del boats
+
+    fleetmetrics(fleet, mark)
+
+    if config['outdir']:
+        loadpyplot('Agg')
+        os.makedirs(config['outdir'], exist_ok=True)
+
+    figures = makefleetfigures(fleet, waypoints, config['fleetmark'] if mark != None else None)
+
+    if config['outdir']:
+        for name, fig in figures:
+            for fmt in config['batchformats']:
+                outname = os.path.join(config['outdir'], "fleet-%s.%s" % (name, fmt))
+                fig.savefig(outname, format=fmt)
+                say("Saved %s" % outname)
+    else:
+        plt.show()
+
+    return fleet
+
+
+"""
+    Start following a GPX file that is still being written, reads what is there so far
+    returns data (like loaddata) and the follow state used by followpoll
+"""
+def followload(path):
+
+    say("Following \"%s\"" % os.path.basename(path))
+
+    data = {'filename':os.path.basename(path), 'markfiles':config['markfiles'], 'cachekey':None, 'name':None,
+            'cleaning':{'backwards':0, 'duplicates':0, 'spikes':0, 'filled':0}}
+
+    state = newgpxstate()
+    state['path'] = path
+    state['offset'] = 0
+    state['parser'] = ElementTree.XMLPullParser(events=("start", "end"))
+    state['channels'] = {}
+
+    try:
+        followfeed(state, data)
+
+    except ElementTree.ParseError:
+        raise TrackError(2, "GPX file is not properly formated XML, sorry I cant help you with this", path)
+
+    except IOError:
+        raise TrackError(5, "Could not open file", path)
+
+    if state['count'] < 2:
+        raise TrackError(100, "File contains no tracking points yet, program can not continue!", path)
+
+    checkdtformat(state['time'][0])
+    followextend(state, data, 0)
+
+    if data['ptcount'] < 2:
+        raise TrackError(100, "Less than two points left after cleaning the track, program can not continue!", path)
+
+    if data['name'] != None:
+        say("Track title: ", data['name'])
+
+    say("Found %i points of tracking data" % (data['ptcount']))
+    printcleaning(data)
+
+    if data['markfiles']:
+        loadmarkfiles(data)
+        data['markarea'] = trackbounds(data)
+        markroundings(data, config['markradius'])
+
+    return data, state
+
+
+"""
+    Feed whatever has been appended to the file since last time into the parser
+    only complete track points are fed, loggers that rewrite the closing tags on every write would confuse it otherwise
+    returns the number of new points or -1 if the file got shorter (so it was replaced)
+"""
+def followfeed(state, data):
+
+    if os.path.getsize(state['path']) < state['offset']:
+        return -1
+
+    with open(state['path'], 'rb') as f:
+        f.seek(state['offset'])
+        newbytes = f.read()
+
+    cut = None
+    for match in re.finditer(rb'</(?:[\w.-]+:)?trkpt\s*>', newbytes):
+        cut = match.end()
+
+    if cut == None:
+        return 0
+
+    state['parser'].feed(newbytes[:cut])
+    state['offset'] += cut
+
+    before = state['count']
+    gpxevents(state['parser'].read_events(), state, data)
+
+    return state['count'] - before
+
+
+"""
+    Work out every channel for the points from old onward, only touching the new tail
+    the channels live in growable buffers and data['data'] holds views of the filled part
+"""
+def followextend(state, data, old):
+    channels = state['channels']
+
+    #the strings are only needed until they are decoded
+    if old == 0:
+        data['starttime'], times = convdatetime(state['time'])
+    else:
+        times = convdatetime(state['time'], data['starttime'])[1]
+    del state['time'][:]
+
+    if config['clean']:
+        times = followclean(state, data, old, times)
+
+    n = state['count']
+
+    for name in ('time', 'latnm', 'lonnm', 'speed', 'speedavg', 'angle'):
+        if name not in channels:
+            channels[name] = np.zeros(max(n, 4096))
+
+        elif channels[name].shape[0] < n:
+            channels[name] = growbuffer(channels[name], n)
+
+    channels['time'][old:n] = times
+
+    lat = state['lat']
+    lon = state['lon']
+    channels['latnm'][old:n], channels['lonnm'][old:n] = projectlatlon(lat[old:n], lon[old:n], lat[0], lon[0])
+
+    data['data'] = {'lat':lat[:n], 'lon':lon[:n]}
+    for name in channels:
+        data['data'][name] = channels[name][:n]
+
+    #speed and angle need the point before the new ones
+    lo = max(old - 1, 0)
+    tail = {'data':{name:data['data'][name][lo:n] for name in ('lat', 'lon', 'latnm', 'lonnm', 'time')}}
+
+    data['data']['speed'][lo + 1:n] = calcdist(tail) / calctimedelta(tail)
+
+    calcangle(tail)
+    data['data']['angle'][lo:n - 1] = tail['data']['angle'][:-1]
+    data['data']['angle'][n - 1] = data['data']['angle'][n - 2]
+
+    extendrollavg(data, old, config['rollavg_points'], config['rollavg_method'], config['rollavg_seconds'])
+
+    data['ptcount'] = n
+
+
+"""
+    Clean the points from old onward the same way chunkflush() does, with the last kept point in front since it's already drawn
+    the cleaned lat/lon go back into the buffers and state['count'] is set to match, returns the cleaned times
+"""
+def followclean(state, data, old, times):
+    n = state['count']
+    lat = state['lat'][old:n]
+    lon = state['lon'][old:n]
+
+    if old == 0:
+        lat, lon, times, report = cleanpoints(lat, lon, times)
+        if times.shape[0] > 0 and times[0] != 0:
+            data['starttime'] += times[0]
+            times = times - times[0]
+    else:
+        prev = (state['lat'][old - 1], state['lon'][old - 1], state['channels']['time'][old - 1])
+        lat, lon, times, report = cleanpoints(np.insert(lat, 0, prev[0]), np.insert(lon, 0, prev[1]), np.insert(times, 0, prev[2]))
+        if times.shape[0] > 0 and times[0] == prev[2]:
+            lat, lon, times = lat[1:], lon[1:], times[1:]
+
+    for key in report:
+        data['cleaning'][key] += report[key]
+
+    #filling gaps can leave more points than were read
+    n = old + times.shape[0]
+    for name in ('lat', 'lon'):
+        if state[name].shape[0] < n:
+            state[name] = growbuffer(state[name], n)
 
-    #The insert statement gives us a starting speed of zero and make sure the speed array has the same dimensions as the other arrays
-    data['data']['speed'] = np.insert(calcdist(data) / calctimedelta(data), 0, [0.0])
+    state['lat'][old:n] = lat
+    state['lon'][old:n] = lon
+    state['count'] = n
+
+    return times
 
 
 """
-    Why did I put my comments here?
-    Calculate thr olling averge of speed
+    Check the file for new points and update data, returns the number of points added after cleaning
 """
-def calcspeed_rollavg(data, pts):
-    data['data']['speedavg'] = np.zeros(data['data']['speed'].shape[0], dtype=np.float)
-    data['data']['speedavg'][:pts] = np.mean(data['data']['speed'][:pts-1]) # set the first points to their average for simplicity
-    for idx in range(pts,data['data']['speed'].shape[0]):
-        data['data']['speedavg'][idx] = np.mean(data['data']['speed'][idx-pts:idx])
-        
+def followpoll(state, data):
+    old = state['count']
+    added = followfeed(state, data)
+
+    if added > 0:
+        followextend(state, data, old)
+        added = data['ptcount'] - old
+        state['newmarks'] = followmarks(data, old)
+
+    return added
+
 
-    
 """
-    Calculate and return timedelta in hours as float of two points.  Enter points in the order in which they were recorded
+    Keep the marks up to date as the track grows, they were picked for the area the track covered when it was loaded
+    the area grows with some headroom so the marks only get loaded again now and then, the roundings are redone every time
+    returns True if different marks are in the area now
 """
-def calctimedelta(data):
+def followmarks(data, old):
+    if not data['markfiles']:
+        return False
 
-    return (data['data']['time'][1:] - data['data']['time'][:-1]) / 3600
+    changed = False
+    if config['filterwaypoints'] and not config['markregion']:
+        minlat, maxlat, minlon, maxlon = data['markarea']
+        lat = growlimits(minlat, maxlat, data['data']['lat'][old:])
+        lon = growlimits(minlon, maxlon, data['data']['lon'][old:])
+
+        if lat != None or lon != None:
+            data['markarea'] = (lat or (minlat, maxlat)) + (lon or (minlon, maxlon))
+            names = data['waypoints']['names']
 
+            with Options(config, quiet=True):
+                loadmarkfiles(data, data['markarea'])
+            changed = data['waypoints']['names'] != names
+
+    markroundings(data, config['markradius'])
+    return changed
 
 
 """
-    Calculate distance between two points in nautical miles
+    Grow a pair of limits to take in values, with some headroom so a growing track only forces a few full redraws
+    returns the new limits or None if they didn't need to change
 """
-def calcdist(data):
-        
-    return np.sqrt(np.square(data['data']['latnm'][:-1] -data['data']['latnm'][1:]) + np.square(data['data']['lonnm'][:-1]-data['data']['lonnm'][1:]))
-    
+def growlimits(lo, hi, values):
+    vmin = np.nanmin(values)
+    vmax = np.nanmax(values)
+
+    if vmin >= lo and vmax <= hi:
+        return None
+
+    lo = min(lo, vmin)
+    hi = max(hi, vmax)
+    pad = (hi - lo) * 0.25 if hi > lo else 1.
+
+    return (lo - pad if vmin < lo + pad else lo, hi + pad if vmax > hi - pad else hi)
 
 
 """
-convert lat and long to offset from orgin using Haversine
+    Swap the marks drawn on the map for the ones now in the area
 """
-def havconvlatlon(data,frame='data'):
-    
-    
-    latrad = np.radians(data[frame]['lat'])
-    lonrad = np.radians(data[frame]['lon'])
-    data[frame]['latnm'] = latrad * earthrad
-    data[frame]['latnm'] = data[frame]['latnm'] - data[frame]['latnm'][0]
-    
-    data[frame]['lonnm'] = ((lonrad-lonrad[0]) * np.cos(latrad)) * earthrad
-    
-    
-    #data['data']['lonnm'] = data['data']['lonnm'] - data['data']['lonnm'][0]
+def followmarkartists(state, data):
+    for artist in state['marks']:
+        artist.remove()
+
+    state['marks'] = drawmarks(data, state['ax'])
+    state['fig'].canvas.draw_idle()
+
 
-    
 """
-Load waypoints
+    Draw the points from old onward on the figures makefigures built
+    new points go on as small extra artists blitted over what is already drawn, so the cost follows the number of new points
+    only when the axes or colour scale have to grow (or too many pieces pile up) is everything merged and redrawn
 """
-def loadmarkfiles(data):
-    waypoints = set()
-    totaldropped = 0
-    
-    for filename in data['markfiles']:
-        print("Loading mark data from \"%s\"" % os.path.basename(filename))
+def followrefresh(artists, data, old):
+    n = data['ptcount']
 
-        droppedinfile = 0
+    for entry in artists.values():
+        ax = entry['ax']
+        canvas = entry['fig'].canvas
+        lo = max(old - 1, entry['start'])
+        if lo >= n:
+            continue
+
+        x, y, c = entry['series'](slice(lo, n))
+        full = len(entry['chunks']) > 100
+
+        newartists = [ax.plot(x, y, color=entry['line'].get_color(), zorder=1)[0]]
+        if entry['points'] != None:
+            norm = entry['points'].norm
+            newartists.append(ax.scatter(x[1:], y[1:], c=c[1:], cmap=entry['points'].cmap, norm=norm, zorder=2))
+
+            limits = growlimits(norm.vmin, norm.vmax, c)
+            if limits != None:
+                norm.vmin, norm.vmax = limits
+                full = True
+
+        entry['chunks'] += newartists
+
+        xlim = growlimits(*sorted(ax.get_xlim()), x)
+        ylim = growlimits(*sorted(ax.get_ylim()), y)
+        if xlim != None or ylim != None:
+            ax.set_xlim(xlim if xlim != None else ax.get_xlim())
+            ax.set_ylim(ylim if ylim != None else ax.get_ylim())
+            full = True
+
+        if full:
+            #fold the pieces back into the main artists and draw everything once
+            x, y, c = entry['series'](slice(entry['start'], n))
+            entry['line'].set_data(x, y)
+            if entry['points'] != None:
+                entry['points'].set_offsets(np.column_stack((x, y)))
+                entry['points'].set_array(c)
+
+            for artist in entry['chunks']:
+                artist.remove()
+            entry['chunks'] = []
+
+            canvas.draw_idle()
+
+        else:
+            for artist in newartists:
+                ax.draw_artist(artist)
+            canvas.blit(ax.bbox)
+
+        canvas.flush_events()
 
-        try:
-            root = xml.parse(filename)
-
-        except xmlerror:
-            print("")
-            print("")
-            print("***Fatal Error:  mark GPX file is not properly formated XML, sorry I cant help you with this***")
-            print("File: %s" % filename)
-            exit(8)
-
-        except IOError:
-            print("")
-            print("")
-            print("***Fatal Error:  Could not open mark file ***")
-            print("File: %s" % filename)
-            exit(9)
-
-        wpt = root.getElementsByTagName("wpt")
-        if len(wpt) == 0:
-            print("***Warning, no waypoints in %s***" % filename)
-        
-        wptcountfile = 0
-        for w in wpt:
-            nameelm = w.getElementsByTagName('name')
-            if not (w.hasAttribute('lat') and w.hasAttribute('lon') and len(nameelm) == 1):
-                print("***Warning, some waypoints missing data [%s] dropping***" % filename)
-                droppedinfile += 1
-                
-            else:
-                
-                datapoint = (float(w.getAttribute('lat')), float(w.getAttribute('lon')),nameelm[0].firstChild.data)
-                if (not config['filterwaypoints']) or (datapoint[0] > np.min(data['data']['lat']) and datapoint[0] < np.max(data['data']['lat']) and datapoint[1] > np.min(data['data']['lon']) and datapoint[1] < np.max(data['data']['lon'])):
-                    waypoints.add(datapoint)
-                else:
-                    droppedinfile += 1
-                
-            
-                
-            wptcountfile += 1
-        
-        totaldropped += droppedinfile
-        
-        print("Loaded %d/%d waypoints from %s" % (wptcountfile,droppedinfile + wptcountfile,filename))
 
-    data['waypoints'] = {}
-    data['waypoints']['names'] = []
-    data['waypoints']['lat'] = np.zeros(len(waypoints)+1,dtype=np.float)
-    data['waypoints']['lon'] = np.zeros(len(waypoints)+1,dtype=np.float)
-    
-    #this is for passing it into our previous functions
-    data['waypoints']['lat'][0] = data['data']['lat'][0]
-    data['waypoints']['lon'][0] = data['data']['lon'][0]
-        
-    for idx,w in zip(range(1,len(waypoints)+1),waypoints):
-        data['waypoints']['names'].append(w[2])
-        data['waypoints']['lat'][idx] = w[0]
-        data['waypoints']['lon'][idx] = w[1]
-    
-    
-    havconvlatlon(data, frame='waypoints')
-    
-    data['waypoints']['lat'] = data['waypoints']['lat'][1:]
-    data['waypoints']['lon'] = data['waypoints']['lon'][1:]
-    data['waypoints']['latnm'] = data['waypoints']['latnm'][1:]
-    data['waypoints']['lonnm'] = data['waypoints']['lonnm'][1:]
-    
-    print("Loaded %d/%d total waypoints!" % (len(waypoints),len(waypoints) + totaldropped))
-      
-    
-              
-        
 """
-    Load garmin data, provide filename 
-    returns object with metadata and datapoints
+    Show the graphs and keep adding points to them as the file grows, until the windows are closed
 """
-def loaddata(path):
+def runfollow(path):
+    loadpyplot()
+    data, state = followload(path)
 
-    startloadtime = datetime.now()
+    #the decimation callbacks hold on to the arrays they were built with, which go stale as the track grows
+    if config['maxpoints'] != None:
+        say("***Warning, --max-points doesn't work with --follow, every point gets drawn***")
+        config['maxpoints'] = None
 
-    print("Loading data from \"%s\"" % os.path.basename(path))
+    artists = {}
+    makefigures(data, artists)
+    plt.show(block=False)
+
+    say("Watching for new points every %g seconds, close the graphs to stop" % config['followinterval'])
 
-    data = {'filename':os.path.basename(path), 'markfiles':config['markfiles']}
-    
     try:
-        root = xml.parse(path)
+        while plt.get_fignums():
+            plt.pause(config['followinterval'])
 
-    except xmlerror:
-        print("")
-        print("")
-        print("***Fatal Error:  GPX file is not properly formated XML, sorry I cant help you with this***")
-        print("File: %s" % path)
-        exit(2)
+            old = data['ptcount']
+            passed = len(data['roundings']['names']) if data['markfiles'] else 0
+            added = followpoll(state, data)
 
-    except IOError:
-        print("")
-        print("")
-        print("***Fatal Error:  Could not open file ***")
-        print("File: %s" % path)
-        exit(5)
+            if added < 0:
+                say("***Warning, file got shorter, it has been replaced so starting over***")
+                plt.close('all')
+                data, state = followload(path)
+                artists = {}
+                makefigures(data, artists)
+                plt.show(block=False)
 
-    #parse metadata
-    #add some error checking here to since I dont know if this metadata is availble in all tracking file
+            elif added > 0:
+                say("Added %d points (%d total)" % (added, data['ptcount']))
+                if state['newmarks']:
+                    say("Marks in area:\t\t%d" % len(data['waypoints']['names']))
+                    if 'map' in artists:
+                        followmarkartists(artists['map'], data)
 
-    trk = root.getElementsByTagName("trk")
-    if len(trk) > 0 and len(trk[0].getElementsByTagName("name")) == 1:
-        data['name'] = trk[0].getElementsByTagName("name")[0].firstChild.data
-        print("Track title: ", data['name'])
+                if data['markfiles']:
+                    for name in data['roundings']['names'][passed:]:
+                        say("Passed %s" % name)
 
-    else:
-        print("Track has no name")
-        data['name'] = None
+                followrefresh(artists, data, old)
 
+    except KeyboardInterrupt:
+        say("Stopped following")
 
-    if len(root.getElementsByTagName("metadata")) == 1:
 
-        metadata = root.getElementsByTagName("metadata")[0]
-       
-        if len(metadata.getElementsByTagName("time")) == 1:
-            data['time'] = metadata.getElementsByTagName("time")[0].firstChild.data 
-            print("Track recorded at %s with" % ( data['time'] ))
+"""
+    One track for using marinegpxgrapher as a library, nothing gets printed or exits and problems raise TrackError
+    the derived channels are worked out the first time they're used and kept, and everything runs with the track's own Options
+    so a long running process can have any number of tracks open with different settings
 
+        track = Track.load("race.gpx", rollavg_points=30)
+        print(track.name, track.stats()['distance'], track.speed.max())
+"""
+class Track(object):
+    __slots__ = ('data', 'options')
 
-            if len(metadata.getElementsByTagName("bounds")) == 1:
+    def __init__(self, data, options=None, **kwargs):
+        self.data = data
+        self.options = Options(options if options != None else {}, **kwargs)
+        self.options['quiet'] = True
 
-                bounds = metadata.getElementsByTagName("bounds")[0]
-                data['maxlat'] = float(bounds.getAttribute('maxlat'))
-                data['maxlon'] = float(bounds.getAttribute('maxlon'))
-                data['minlat'] = float(bounds.getAttribute('minlat'))
-                data['minlon'] = float(bounds.getAttribute('minlon'))
-        
-                print("\tMaximum/Minimum Latitude:\t%s\t/\t%s" % ( data['maxlat'], data['minlat'] ))
-                print("\tMaximum/Minimum Longitude:\t%s\t/\t%s" % ( data['maxlon'], data['minlon'] )) 
+    """
+        Read a GPX file, options is an Options (or dict) and keywords change single options
+    """
+    @classmethod
+    def load(cls, path, options=None, **kwargs):
+        track = cls(None, options, **kwargs)
 
-    else:
-        print("Metadata not found continuing")
-    
-    print("Track has %i segments" % len(root.getElementsByTagName("trkseg")))
+        with track.options:
+            track.data = {'filename':os.path.basename(path), 'markfiles':track.options['markfiles'], 'cachekey':None}
+            loadbase(path, track.data)
 
+            if track.options['clean']:
+                cleantrack(track.data)
 
-    gpxpts = root.getElementsByTagName("trkpt")
+        return track
 
-    #I am concerned about how len(gpxpts) is handled and weather it could cause performance issues
-    print("Found %i points of tracking data" % (len(gpxpts)))
-    if len(gpxpts) == 0:
-        print("")
-        print("")
-        print("File (%s) contains no tracking points, program can not continue!")
-        exit(100)
+    """
+        Call func with the track's options in force
+    """
+    def run(self, func, *args):
+        with self.options:
+            return func(*args)
 
-    data['ptcount'] = len(gpxpts)
-    data['data'] = { 'lat': np.zeros(data['ptcount']), 'lon':np.zeros(data['ptcount']), 'time':np.zeros(data['ptcount']) }
+    def __len__(self):
+        return self.data['ptcount']
 
-    #setup time converter
-    checkdtformat(gpxpts[0].getElementsByTagName("time")[0].firstChild.data)
-    
-    starttime = datetime.strptime(gpxpts[0].getElementsByTagName("time")[0].firstChild.data, config['datetimeformat']) 
+    def __repr__(self):
+        return "<Track %r, %d points>" % (self.name, len(self))
 
-    #go through and process all tracking points
-    for i in range(data['ptcount']):
-        
-        data['data']['lat'][i] = float(gpxpts[i].getAttribute("lat"))
-        data['data']['lon'][i] = float(gpxpts[i].getAttribute("lon"))
-        data['data']['time'][i] = convdatetime(gpxpts[i].getElementsByTagName("time")[0].firstChild.data, starttime)
+    @property
+    def name(self):
+        return self.data['name'] if self.data['name'] != None else self.data['filename']
 
-    
-    totaltime = data['data']['time'][len(data['data']['time'])-1]
+    #UTC seconds of the first point, time is seconds from there
+    @property
+    def starttime(self):
+        return self.data['starttime']
 
-    if totaltime > 9000:
-        print("Track elapsed time is: %f hours" % (totaltime / 3600.))
+    """
+        A channel by name, derived ones are worked out (or read from the cache) the first time
+    """
+    def channel(self, name):
+        if name not in self.data['data']:
+            self.run(derivechannel, self.data, name)
 
-    else:
-        print("Track elapsed time is: %f minutes" % (totaltime / 60.))
+        return self.data['data'][name]
 
+    time = property(lambda self: self.channel('time'))
+    lat = property(lambda self: self.channel('lat'))
+    lon = property(lambda self: self.channel('lon'))
+    latnm = property(lambda self: self.channel('latnm'))
+    lonnm = property(lambda self: self.channel('lonnm'))
+    speed = property(lambda self: self.channel('speed'))
+    speedavg = property(lambda self: self.channel('speedavg'))
+    angle = property(lambda self: self.channel('angle'))
 
-    #convert latlong to nautical mile offset
-    #convlatlon(data)
-    havconvlatlon(data)
+    """
+        Work out every derived channel now
+    """
+    def derive(self):
+        for name in derivedchannels:
+            self.channel(name)
 
-    #calc speeds
-    calcspeed(data)
-    
-    #calc speed rolling avg
-    calcspeed_rollavg(data,config['rollavg_points'])
-    
-    calcangle(data)
-    
-    #load marks from markfiles
-    if data['markfiles']:
-        loadmarkfiles(data)
+        return self
 
-    loadtime = datetime.now() - startloadtime
+    """
+        Distance, elapsed hours and speeds, see trackstats()
+    """
+    def stats(self):
+        if 'stats' not in self.data:
+            self.channel('speedavg')
 
-    print("Track \"%s\" loaded (load time %i ms)!" % (os.path.basename(path), loadtime.seconds * 1000. + loadtime.microseconds/1000))
+        return self.run(trackstats, self.data)
 
-    return data
+    """
+        The table of tacks and gybes, see findmaneuvers()
+    """
+    def maneuvers(self):
+        if 'maneuvers' not in self.data:
+            self.channel('latnm')
+            self.run(findmaneuvers, self.data)
 
+        return self.data['maneuvers']
 
-"""
-    Convert Garmin UTC format to datetime object
-"""
-def convdatetime(dtstr, starttime):
-    pttime = datetime.strptime(dtstr,config['datetimeformat']) - starttime
-    return float(pttime.seconds + pttime.days*24*3600)
+    """
+        The table of marks passed and rounded, None without mark files, see markroundings()
+    """
+    def roundings(self):
+        if not self.data['markfiles']:
+            return None
 
-"""
-    Check time format potential time formats and set convdatetime
-"""
-def checkdtformat(dtstr):
+        if 'roundings' not in self.data:
+            self.channel('latnm')
+            self.run(loadmarkfiles, self.data)
+            self.run(markroundings, self.data, self.options['markradius'])
 
-    format_strings = ["%Y-%m-%dT%H:%M:%S.%f%z","%Y-%m-%dT%H:%M:%S.%fZ","%Y-%m-%dT%H:%M:%S%z","%Y-%m-%dT%H:%M:%SZ"]
-    config['datetimeformat'] = None
-    
-    for idx, fstr in enumerate( format_strings ):
-        try:
-            datetime.strptime(dtstr,fstr)
-            config['datetimeformat'] =   fstr
-            break
-            
-        except ValueError:
-            if idx == (len(format_strings) - 1):
+        return self.data['roundings']
 
-                print("No valid time format found for \"%s\" fatal error!" % (dtstr))
-                print("Please report this error at https://github.com/GarysCorner/marinegpxgrapher/issues")
+    """
+        Where each leg starts and ends, see findlegs()
+    """
+    def legs(self):
+        if 'legs' not in self.data:
+            self.roundings()
+            self.channel('latnm')
+            self.run(findlegs, self.data)
 
-                exit(1)
+        return self.data['legs']
 
-    print("Time format string found \"%s\"" % (config['datetimeformat']))
+    """
+        Part of the track from start to end seconds in, as a new Track sharing the arrays
+        the channels are worked out over the whole track first so they come out the same as the command line's
+    """
+    def slice(self, start=None, end=None, label=None):
+        return self.view(self.run(timerange, self.data, start, end), label)
 
+    """
+        One leg (counted from 1) as a new Track
+    """
+    def leg(self, number):
+        legs = self.legs()
+        count = legs['start'].shape[0]
+        if number < 1 or number > count:
+            raise TrackError(13, "There is no leg %d, the track only has %d legs" % (number, count), self.data['filename'])
 
-"""
-    Graph all the data this is what you came here for
-"""
-def plotdata(data):
-    # ['lat','lon','time', 'latrad', 'lonrad', 'speed']  
-    
-    if data['name'] == None:
-        trkname = data['filename']
+        return self.view(slice(int(legs['start'][number - 1]), int(legs['end'][number - 1]) + 1), "leg %d" % number)
 
-    else:
-        trkname = data['name']
+    def view(self, sl, label=None):
+        self.derive()
+        if sl.stop - sl.start < 2:
+            raise TrackError(13, "Less than two points in the selected range", self.data['filename'])
 
-    
+        view = sliceview(self.data, sl, label)
+        view.pop('legs', None)
+        return Track(view, self.options)
 
-    if data['data']['time'][len(data['data']['time'])-1] > 9000:
+    """
+        Build the graphs, returns a list of (name, figure), the speed history and a map that switches between time, angle and speed
+        backend is passed to loadpyplot (use Agg in a server)
+    """
+    def figures(self, backend=None):
+        self.derive()
+        if self.options['maneuvers']:
+            self.maneuvers()
+        self.roundings()
+        loadpyplot(backend)
 
-        timeunit = "hours"
-        timedatahours = data['data']['time'] / 3600.
+        return self.run(makefigures, self.data)
 
-    else:
-        timeunit = "minutes"
-        timedatahours = data['data']['time'] / 60.
+    """
+        Draw each graph and hand it to save(name, figure) to be written out, see renderfigures()
+    """
+    def render(self, save):
+        self.derive()
+        if self.options['maneuvers']:
+            self.maneuvers()
+        self.roundings()
+        loadpyplot('Agg')
 
+        self.run(renderfigures, self.data, save)
 
-    #this is very ugly fix it
-    if config['hours']:
+    """
+        Save the graphs as outdir/<file>-<graph>.<format>, returns the files written
+    """
+    def save(self, outdir, formats=("png",)):
+        os.makedirs(outdir, exist_ok=True)
+        basename = os.path.splitext(self.data['filename'])[0]
+        outputs = []
 
-        timeunit = "hours"
-        timedatahours = data['data']['time'] / 3600.
+        def save(name, fig):
+            for fmt in formats:
+                outname = os.path.join(outdir, "%s-%s.%s" % (basename, name, fmt))
+                fig.savefig(outname, format=fmt)
+                outputs.append(outname)
 
-    elif config['minutes']:
-        timeunit = "minutes"
-        timedatahours = data['data']['time'] / 60.
+        self.render(save)
 
+        return outputs
 
+    """
+        Write the track and its channels to a npz, parquet or csv file
+    """
+    def export(self, filename, fmt=None):
+        fmt = fmt if fmt else os.path.splitext(filename)[1][1:].lower()
+        if fmt not in exporters:
+            raise TrackError(12, "Can't export to \"%s\", use npz, parquet or csv" % fmt, filename)
 
-    if config['showhist']:
-   
-        print("Plotting speed over time (%s)..." % (timeunit))
+        self.derive()
+        self.run(exporters[fmt], self.data, filename)
 
-        #plot speed/time    
-        fig, ax = plt.subplots(figsize=config['figsize'])
-        fig.canvas.set_window_title(trkname)
-        plt.suptitle("Speed / time (knots/%s)" % (timeunit))
-        plt.title("(%d point rolling average)" % config['rollavg_points'], fontsize='small')
-        plt.xlabel(timeunit)
-        plt.ylabel("Speed (knots)")
-        plt.plot( timedatahours[config['rollavg_points']:],data['data']['speedavg'][config['rollavg_points']:])
-        #plt.show()
+        return filename
 
-    if config['showtime']:
+    """
+        Write an animated replay of the track to a .mp4 or .gif, see marinegpxreplay.exportreplay()
+    """
+    def replay(self, filename):
+        import marinegpxreplay
 
-        print("Plotting tracking data with time in %s" % (timeunit))
-        
-        #plot time data
-        fig, ax = plt.subplots(figsize=config['figsize'])
-        fig.canvas.set_window_title(trkname)
-        ax.set_aspect('equal')
-        plt.title("Tracking with Time as color")
-        plt.ylabel("NM North-South from start")
-        plt.xlabel("NM West-East from start")
-        plt.scatter(data['data']['lonnm'],data['data']['latnm'], c=timedatahours, cmap=config['timecmap'],zorder=2)
-        plt.plot(data['data']['lonnm'],data['data']['latnm'], color='y', zorder=1)
-        plt.colorbar(label="Time (%s)" % (timeunit))
-        plt.grid()
-        
-        #add marks
-        if data['markfiles'] and len(data['waypoints']) > 0:
-            plt.scatter(data['waypoints']['lonnm'], data['waypoints']['latnm'], marker='x')
-            for idx in range(len(data['waypoints']['names'])):
-                plt.annotate(data['waypoints']['names'][idx],(data['waypoints']['lonnm'][idx],data['waypoints']['latnm'][idx]))
-        
-        #plt.show()
-    
-    if config['showangle']:
-        print("Plotting tracking data with angle in degrees")
+        self.derive()
+        self.roundings()
+        loadpyplot('Agg')
 
-        fig, ax = plt.subplots(figsize=config['figsize'])
-        fig.canvas.set_window_title(trkname)
-        ax.set_aspect('equal')
-        plt.title("Tracking with angle as color")
-        plt.ylabel("NM North-South from start")
-        plt.xlabel("NM West-East from start")
-        plt.scatter(data['data']['lonnm'],data['data']['latnm'], c=data['data']['angle'], cmap=config['speedcmap'], zorder=2)
-        plt.plot(data['data']['lonnm'],data['data']['latnm'], color='y', zorder=1)
-        plt.colorbar(label="Angle (Degrees)")
-        plt.grid()
-        
-        #add marks
-        if data['markfiles'] and len(data['waypoints']) > 0:
-            plt.scatter(data['waypoints']['lonnm'], data['waypoints']['latnm'], marker='x')
-            for idx in range(len(data['waypoints']['names'])):
-                plt.annotate(data['waypoints']['names'][idx],(data['waypoints']['lonnm'][idx],data['waypoints']['latnm'][idx]))
-    
-    if config['showspeed']:
-    
-        print("Plotting tracking data with speed in nautical miles per hour")
+        return self.run(marinegpxreplay.exportreplay, self.data, filename)
 
-        fig, ax = plt.subplots(figsize=config['figsize'])
-        fig.canvas.set_window_title(trkname)
-        ax.set_aspect('equal')
-        plt.title("Tracking with speed as color")
-        plt.ylabel("NM North-South from start")
-        plt.xlabel("NM West-East from start")
-        plt.scatter(data['data']['lonnm'],data['data']['latnm'], c=data['data']['speed'], cmap=config['speedcmap'], zorder=2)
-        plt.plot(data['data']['lonnm'],data['data']['latnm'], color='y', zorder=1)
-        plt.colorbar(label="Speed (knots)")
-        plt.grid()
-        
-        #add marks
-        if data['markfiles'] and len(data['waypoints']) > 0:
-            plt.scatter(data['waypoints']['lonnm'], data['waypoints']['latnm'], marker='x')
-            for idx in range(len(data['waypoints']['names'])):
-                plt.annotate(data['waypoints']['names'][idx],(data['waypoints']['lonnm'][idx],data['waypoints']['latnm'][idx]))
 
-    print("The graphs may be displayed one in front of the other!")
-    
-    plt.show()
+"""
+    GPX files given on the command line, directories stand for the .gpx files in them
+"""
+def gpxfiles(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(glob.escape(path), "*.gpx")) + glob.glob(os.path.join(glob.escape(path), "*.GPX")))
+        else:
+            files.append(path)
+
+    return files
+
 
 """
     Displays list of valid colormaps
 """
 def showcolormaps():
-    allcolormaps = dir(colormaps)
-    for i in allcolormaps:
-        if i[0] != '_':
-            print(i + "\t", end=' ')
+    for i in colormapnames():
+        say(i + "\t", end=' ')
 
 """
-    Parses the command line arguments
+    Parses the command line arguments into options
+    returns None to go on and run, or the exit status if there's nothing more to do (colormaps listed, cache cleared or a bad colormap)
 """
-def parsecmdline():
+def parsecmdline(argv, options):
     
     parser = argparse.ArgumentParser(prog="Marine GPX Grapher",
                                      description="This program is designed to provide useful graphs of GPX tracking data from Garmin Quatix watches, though it should work with other files.  The program will display two graphs both of which show all of the tracking points as offsets for a zero position which is the first data point.  One graph will show the speed at each data point as color, and the other will show the time at each datapoint as color.  There is also a third graph showing speed with respect to time, however this is just for comparison.  Since this program is intended for marine data it does not take altitude into account.")
@@ -526,6 +3853,12 @@ def parsecmdline():
     parser.add_argument("-mf", "--markfile", help = "Add waypoints from GPX file to graphs (can be called multiple times)", action="append", type=str, metavar = "file")
     parser.add_argument("-nf", "--nofilter",  help = "Loads all marks even if they are outside the track area", action="store_true")
     
+    parser.add_argument("-mn", "--mark-name", help = "Only use marks with names matching this pattern, * and ? work (can be called multiple times)", action="append", type=str, metavar = "pattern", dest="marknames")
+    parser.add_argument("--mark-region", help = "Use the marks inside this area instead of the ones around the track", nargs=4, type=float, metavar = ("minlat", "maxlat", "minlon", "maxlon"), dest="markregion")
+    parser.add_argument("--mark-db", help = "Mark database file, built from the mark files and kept up to date (default marks.sqlite in the cache directory)", metavar = "file", type = str, dest="markdb")
+    parser.add_argument("-mr", "--mark-radius", help = "Passing within this many NM of a mark counts as passing it (default 0.1)", metavar = "NM", type = float, dest="markradius")
+    parser.add_argument("--roundings", help = "Print the table of marks passed and rounded", action="store_true")
+    
     parser.add_argument("-H", "--hours",  help = "Force graphs to use hours instead of minutes", action="store_true")
     parser.add_argument("-M", "--minutes" , help = "Force graphs to use minutes intead of hours", action="store_true")
     
@@ -534,138 +3867,499 @@ def parsecmdline():
     parser.add_argument("-ga", "--graphangle" , help = "Show angle graph", action="store_true")
     parser.add_argument("-gh", "--graphhist" , help = "Show speed history graph (rolling average)", action="store_true")
     parser.add_argument("-ra", "--rollavgpts" , help = "The number of points to use for rolling average (default 20)" , metavar="points", type=int)
+    parser.add_argument("-rs", "--rollavgsecs" , help = "Use a rolling window of this many seconds instead of a number of points (for irregular logging intervals)" , metavar="seconds", type=float)
+    parser.add_argument("-rm", "--rollavgmethod" , help = "Rolling average filter, mean, ewma or median (default mean)" , choices=["mean","ewma","median"])
+    
+    parser.add_argument("--from", help = "Only graph and count the track from this many minutes in", metavar = "minutes", type = float, dest="rangefrom")
+    parser.add_argument("--to", help = "Only graph and count the track up to this many minutes in", metavar = "minutes", type = float, dest="rangeto")
+    parser.add_argument("--leg", help = "Only graph and count this leg (legs are split at mark roundings, or big course changes without marks)", metavar = "N", type = int)
+    parser.add_argument("--legs", help = "Print the legs found in the track", action="store_true")
+    
+    parser.add_argument("--maneuvers", help = "Find the tacks and gybes, print their table and draw them on the map", action="store_true")
+    parser.add_argument("--wind", help = "Direction the wind is coming from in degrees, for telling tacks from gybes (default work it out from the track)", metavar = "degrees", type = float)
+    
+    parser.add_argument("--no-clean", help = "Use the points exactly as logged, don't merge duplicate time stamps or drop spikes", action="store_true", dest="noclean")
+    parser.add_argument("--max-speed", help = "Points that jump faster than this are GPS spikes and get dropped (default 30 knots)", metavar = "knots", type = float, dest="cleanmaxspeed")
+    parser.add_argument("--max-accel", help = "Points the boat would have to speed up to and slow back down from faster than this are dropped (default 3 knots/second)", metavar = "knots/s", type = float, dest="cleanmaxaccel")
+    parser.add_argument("--fill-gaps", help = "Fill gaps in the log up to this long with straight lines (default off)", metavar = "seconds", type = float, dest="fillgaps")
+    
+    parser.add_argument("-mp", "--max-points", help = "Decimate graphs to about this many points (the full track is still used for all the numbers)", metavar = "N", type = int, dest="maxpoints")
     
     parser.add_argument("-cs", "--speedcmap", help = "Colormap for speed graph", metavar = "colormap", type = str)
     parser.add_argument("-ct", "--timecmap", help = "Colormap for time graph", metavar = " colormap", type = str)
     parser.add_argument("-sc","--showcolormaps", help = "Displays a list of colormaps", action="store_true")
+    parser.add_argument("--follow", help = "Keep watching the file and add new points to the graphs as it grows (for logs still being written)", action="store_true")
+    parser.add_argument("--follow-interval", help = "Seconds between checks for new points with --follow (default 5)", metavar = "seconds", type = float, dest="followinterval")
+    parser.add_argument("--fleet", help = "Compare several boats on one time grid (give all their GPX files), saves to --out if given", nargs="+", metavar = "file", type = str)
+    parser.add_argument("--fleet-step", help = "Seconds between fleet comparison grid points (default 10)", metavar = "seconds", type = float, dest="fleetstep")
+    parser.add_argument("--fleet-mark", help = "Name of a mark (from -mf files) to measure each boat's distance to", metavar = "name", type = str, dest="fleetmark")
+    parser.add_argument("--polar", help = "Add the race files to the season polar and show it (without files just shows it), saves to --out if given", nargs="*", metavar = "file", type = str)
+    parser.add_argument("--polar-store", help = "Season polar file (default polars/heading.npz or polars/wind.npz in the cache directory)", metavar = "file", type = str, dest="polarstore")
+    parser.add_argument("--polar-wind", help = "Bin the polar by angle off the wind (--wind or worked out for each race) instead of compass heading", action="store_true", dest="polarwind")
+    parser.add_argument("--polar-sectors", help = "Number of heading sectors in the polar (default 36)", metavar = "N", type = int, dest="polarsectors")
+    parser.add_argument("--polar-hours", help = "Also split the polar into this many bands of the day (local solar time)", metavar = "N", type = int, dest="polarhours")
+    parser.add_argument("--heatmap", help = "Draw where all these tracks (files or directories of them) went as one image, saves to --out if given", nargs="+", metavar = "file", type = str)
+    parser.add_argument("--heatmap-cell", help = "Size of the heatmap cells in NM (default 0.01)", metavar = "NM", type = float, dest="heatmapcell")
+    parser.add_argument("--heatmap-value", help = "What the heatmap colors show, time spent, points logged, mean speed or number of tracks (default time)", choices=["time","count","speed","tracks"], dest="heatmapvalue")
+    parser.add_argument("--heatmap-pixels", help = "Most pixels on a side of the heatmap, cells get added together past this (default 2000)", metavar = "N", type = int, dest="heatmappixels")
+    parser.add_argument("--serve", help = "Serve the graphs of these tracks (files or directories of them) over http for browsers on the local network", nargs="+", metavar = "file", type = str)
+    parser.add_argument("--port", help = "Port for --serve (default 8080)", metavar = "port", type = int, dest="serveport")
+    parser.add_argument("--host", help = "Address for --serve to listen on (default 0.0.0.0, everywhere)", metavar = "address", type = str, dest="servehost")
+    parser.add_argument("--serve-cache", help = "MB of rendered graphs --serve keeps (default 64)", metavar = "MB", type = int, dest="servecache")
+    parser.add_argument("--serve-tracks", help = "Tracks each --serve render worker keeps loaded (default 8)", metavar = "N", type = int, dest="servetracks")
+    parser.add_argument("--replay", help = "Animate the boat going round the track with a fading trail, in a window or saved with --replay-out", action="store_true")
+    parser.add_argument("--replay-out", help = "Save the replay to this .mp4 (needs ffmpeg) or .gif file instead of showing it, the frames are drawn by --workers processes", metavar = "file", type = str, dest="replayout")
+    parser.add_argument("--replay-speed", help = "Race seconds per second of replay (default 60)", metavar = "x", type = float, dest="replayspeed")
+    parser.add_argument("--replay-fps", help = "Frames per second of replay (default 25)", metavar = "fps", type = int, dest="replayfps")
+    parser.add_argument("--replay-trail", help = "Seconds of track the trail behind the boat shows (default 300)", metavar = "seconds", type = float, dest="replaytrail")
+    parser.add_argument("--batch", help = "Render every GPX file in a directory without showing any windows (needs --out)", metavar = "dir", type = str)
+    parser.add_argument("--out", help = "Directory to write batch graphs and summary.json, fleet graphs or exports to", metavar = "dir", type = str)
+    parser.add_argument("--workers", help = "Number of worker processes for --batch, --fleet and --replay-out (default number of CPUs)", metavar = "n", type = int)
+    parser.add_argument("--format", help = "Image format for --batch, png, svg or pdf (can be called multiple times, default png)", action="append", choices=["png","svg","pdf"], dest="formats")
+    parser.add_argument("--export", help = "Write the track and all the calculated channels to a npz, parquet (needs pyarrow) or csv file in --out (or here) instead of graphing", choices=["npz","parquet","csv"])
+    parser.add_argument("--chunked", help = "Load the track a chunk at a time with the channels kept in files on disk (--out or a temporary directory), for tracks too big for memory", action="store_true")
+    parser.add_argument("--chunk-points", help = "Points per chunk with --chunked (default 262144)", metavar = "N", type = int, dest="chunkpoints")
+    parser.add_argument("--dtype", help = "Precision for the positions and distances (and storage for the calculated channels with --chunked), float32 halves the disk and memory use (default float64)", choices=["float32","float64"])
+    parser.add_argument("--geodesy", help = "How positions and distances come from lat/lon, equirectangular (quick, fine round a race course), haversine (great circle distances) or tm (transverse mercator on the WGS84 ellipsoid, for long tracks) (default equirectangular)", choices=sorted(geodesies))
+    parser.add_argument("--stats-only", help = "Just print the track statistics, no graphs (quick, never loads matplotlib)", action="store_true", dest="statsonly")
+    parser.add_argument("--timings", help = "Print how long each stage took (with memory use and point counts) when done", action="store_true")
+    parser.add_argument("--timings-json", help = "Write the stage timings to a JSON file instead of printing them", metavar = "file", type = str, dest="timingsjson")
+    parser.add_argument("--profile", help = "Write a cProfile of the whole run to file (read it with python -m pstats)", metavar = "file", type = str)
+    parser.add_argument("--no-cache", help = "Don't read or write the parsed track cache", action="store_true", dest="nocache")
+    parser.add_argument("--clear-cache", help = "Empty the parsed track cache", action="store_true", dest="clearcache")
+    parser.add_argument("--cache-size", help = "Maximum size of the parsed track cache in MB (default 256)", metavar="MB", type=int, dest="cachesize")
+    parser.add_argument("--cache-dir", help = "Directory for the parsed track cache (default ~/.cache/marinegpxgrapher)", metavar="dir", type=str, dest="cachedir")
     parser.add_argument("-s","--size", help="Sets the figure size (X & Y) in inches", metavar="inches", type=int)
     parser.add_argument("-sx", "--xsize", help="Sets the size in inches for the X axis", metavar="inches", type=int)
     parser.add_argument("-sy", "--ysize", help="Sets the size in inches for the Y axis", metavar="inches", type=int)
     
     
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     if args.showcolormaps:
         showcolormaps()
-        exit(0)
+        return 0
+
+    if args.cachedir:
+        options['cachedir'] = args.cachedir
+
+    if args.cachesize:
+        options['cachesize'] = args.cachesize
+
+    if args.nocache:
+        options['usecache'] = False
+
+    if args.clearcache:
+        clearcache()
+        if not args.file:
+            return 0
+
+    if args.batch:
+        if not args.out:
+            parser.error("--batch needs an --out directory")
+
+        options['batchdir'] = args.batch
+        options['outdir'] = args.out
+        options['workers'] = args.workers if args.workers else (os.cpu_count() or 1)
+
+    if args.statsonly:
+        options['statsonly'] = True
+
+    if args.export:
+        options['export'] = args.export
+        options['outdir'] = args.out
+
+    if args.chunked:
+        options['chunked'] = True
+        options['outdir'] = args.out
+
+    if args.chunkpoints:
+        options['chunkpoints'] = args.chunkpoints
+
+    if args.dtype:
+        options['dtype'] = args.dtype
+
+    if args.geodesy:
+        options['geodesy'] = args.geodesy
+
+    if args.timings or args.timingsjson:
+        options['timings'] = True
+        options['timingsjson'] = args.timingsjson
+
+    if args.profile:
+        options['profile'] = args.profile
+
+    if args.follow:
+        options['follow'] = True
+
+    if args.followinterval:
+        options['followinterval'] = args.followinterval
+
+    if args.maxpoints:
+        options['maxpoints'] = args.maxpoints
+
+    if args.fleet:
+        options['fleet'] = args.fleet
+        options['workers'] = args.workers
+        options['outdir'] = args.out
+
+    if args.polar != None:
+        options['polar'] = args.polar
+        options['workers'] = args.workers
+        options['outdir'] = args.out
+
+    if args.heatmap:
+        options['heatmap'] = args.heatmap
+        options['workers'] = args.workers
+        options['outdir'] = args.out
+
+    if args.serve:
+        options['serve'] = args.serve
+        options['workers'] = args.workers
+
+    if args.replay or args.replayout:
+        options['replay'] = True
+        options['replayout'] = args.replayout
+        options['workers'] = args.workers
+
+    if args.replayspeed:
+        options['replayspeed'] = args.replayspeed
+
+    if args.replayfps:
+        options['replayfps'] = args.replayfps
+
+    if args.replaytrail:
+        options['replaytrail'] = args.replaytrail
+
+    if args.serveport:
+        options['serveport'] = args.serveport
+
+    if args.servehost:
+        options['servehost'] = args.servehost
+
+    if args.servecache:
+        options['servecache'] = args.servecache
+
+    if args.servetracks:
+        options['servetracks'] = args.servetracks
+
+    if args.heatmapcell:
+        options['heatmapcell'] = args.heatmapcell
+
+    if args.heatmapvalue:
+        options['heatmapvalue'] = args.heatmapvalue
+
+    if args.heatmappixels:
+        options['heatmappixels'] = args.heatmappixels
+
+    if args.polarstore:
+        options['polarstore'] = args.polarstore
+
+    if args.polarwind:
+        options['polarreference'] = "wind"
+
+    if args.polarsectors:
+        options['polarsectors'] = args.polarsectors
+
+    if args.polarhours:
+        options['polarhours'] = min(args.polarhours, 24)
+
+    if args.fleetstep:
+        options['fleetstep'] = args.fleetstep
+
+    if args.fleetmark:
+        options['fleetmark'] = args.fleetmark
+
+    if args.formats:
+        options['batchformats'] = args.formats
 
     if args.rollavgpts:
-        config['rollavg_points'] = args.rollavgpts
+        options['rollavg_points'] = args.rollavgpts
     
     else:
-        config['rollavg_points'] = 20
+        options['rollavg_points'] = 20
+
+    if args.rollavgsecs:
+        options['rollavg_seconds'] = args.rollavgsecs
+
+    if args.rollavgmethod:
+        options['rollavg_method'] = args.rollavgmethod
         
     if args.speedcmap:
-        config['speedcmap'] = args.speedcmap
+        options['speedcmap'] = args.speedcmap
 
     if args.timecmap:
-        config['timecmap'] = args.timecmap
+        options['timecmap'] = args.timecmap
     
     if args.hours:
-        config['hours'] = True
+        options['hours'] = True
 
     if args.minutes:
-        config['minutes'] = True
+        options['minutes'] = True
 
     if args.file:
-        config['filename'] = args.file
+        options['filename'] = args.file
     
     if args.size:
-        config['figsize'] = (args.size, args.size)
+        options['figsize'] = (args.size, args.size)
         
     if args.xsize:
-        listfigsize = list(config['figsize'])
+        listfigsize = list(options['figsize'])
         listfigsize[0] = args.xsize
-        config['figsize'] = tuple(listfigsize)
+        options['figsize'] = tuple(listfigsize)
         
     if args.ysize:
-        listfigsize = list(config['figsize'])
+        listfigsize = list(options['figsize'])
         listfigsize[1] = args.ysize
-        config['figsize'] = tuple(listfigsize)
+        options['figsize'] = tuple(listfigsize)
         
+    #picking graphs means just those ones
+    if args.graphspeed or args.graphtime or args.graphhist or args.graphangle:
+        for flag in ('showspeed', 'showtime', 'showhist', 'showangle'):
+            options[flag] = False
+
     if args.graphspeed:
-        config['showall'] = False
-        config['showspeed'] = True
+        options['showall'] = False
+        options['showspeed'] = True
     
     if args.graphtime:
-        config['showall'] = False
-        config['showtime'] = True
+        options['showall'] = False
+        options['showtime'] = True
         
     if args.graphhist:
-        config['showall'] = False
-        config['showhist'] = True
+        options['showall'] = False
+        options['showhist'] = True
         
     if args.graphangle:
-        config['showall'] = False
-        config['showangle'] = True
+        options['showall'] = False
+        options['showangle'] = True
     
     if args.markfile:
-        config['markfiles'] = set(args.markfile)
+        options['markfiles'] = set(args.markfile)
     else:
-        config['markfiles'] = None
+        options['markfiles'] = None
     
+    if args.marknames:
+        options['marknames'] = args.marknames
+
+    if args.markregion:
+        options['markregion'] = args.markregion
+
+    if args.markdb:
+        options['markdb'] = args.markdb
+
+    if args.rangefrom != None:
+        options['rangefrom'] = args.rangefrom
+
+    if args.rangeto != None:
+        options['rangeto'] = args.rangeto
+
+    if args.leg:
+        options['leg'] = args.leg
+
+    if args.legs:
+        options['legs'] = True
+
+    if args.maneuvers:
+        options['maneuvers'] = True
+
+    if args.noclean:
+        options['clean'] = False
+
+    if args.cleanmaxspeed:
+        options['cleanmaxspeed'] = args.cleanmaxspeed
+
+    if args.cleanmaxaccel:
+        options['cleanmaxaccel'] = args.cleanmaxaccel
+
+    if args.fillgaps:
+        options['fillgaps'] = args.fillgaps
+
+    if args.wind != None:
+        options['wind'] = args.wind % 360.
+
+    if args.markradius:
+        options['markradius'] = args.markradius
+
+    if args.roundings:
+        options['roundings'] = True
+
     if args.nofilter:
-        config['filterwaypoints'] = False
+        options['filterwaypoints'] = False
     else:
-        config['filterwaypoints'] = True
+        options['filterwaypoints'] = True
     
-    if config['showall']:
-        config['showtime'] = True
-        config['showspeed'] = True
-        config['showhist'] = True
-        config['showangle'] = True
+    if options['showall']:
+        options['showtime'] = True
+        options['showspeed'] = True
+        options['showhist'] = True
+        options['showangle'] = True
         
     
         
 
 
-    #Check to make sure a valid colormap is set
-    allcolormaps = dir(colormaps)
-    if not (config['speedcmap'] in allcolormaps and config['timecmap'] in allcolormaps):
-        print("")
-        print("")
+    #Check to make sure a valid colormap is set (no point if nothing gets drawn)
+    if options['statsonly'] or options['export']:
+        return None
+
+    allcolormaps = colormapnames()
+    if not (options['speedcmap'] in allcolormaps and options['timecmap'] in allcolormaps):
+        say("")
+        say("")
 
         showcolormaps()
 
-        print("")
-        print("")
+        say("")
+        say("")
         
-        print("Bad colormap selected.  You need to selected a valid colormap from above (Error 10)")
-        print("Better yet go to https://matplotlib.org/examples/color/colormaps_reference.html")
+        say("Bad colormap selected.  You need to selected a valid colormap from above (Error 10)")
+        say("Better yet go to https://matplotlib.org/examples/color/colormaps_reference.html")
         
         
-        exit(10)
+        return 10
 
+    return None
 
-if __name__ == "__main__":
-    
-    parsecmdline()
 
-    #get filename
+"""
+    Ask for the track file with a Tk dialog, returns None if canceled
+"""
+def askfilename():
+    try:
+        from tkinter import Tk
+        import tkinter.filedialog
+
+    except ImportError:
+        raise TrackError(8, "You don't have Tkinter installed, run the program with the -f [--file] option and give a filename to get round this")
+
+    root = Tk()
+    filename = tkinter.filedialog.askopenfilename(title="Track File", filetypes=[("GPX File", "*.gpx"),("All files","*")])
+    root.destroy()
+
+    return filename if filename else None
+
+
+"""
+    Run whatever the command line options asked for, returns the exit code
+"""
+def runcommand(options):
+
+    try:
+        if options['batchdir']:
+            return 11 if runbatch() > 0 else 0
+
+        if options['fleet']:
+            runfleet(options['fleet'])
+            return 0
+
+        if options['heatmap']:
+            import marinegpxheatmap
+            marinegpxheatmap.runheatmap(options['heatmap'])
+            return 0
+
+        if options['serve']:
+            import marinegpxserver
+            marinegpxserver.runserve(options['serve'])
+            return 0
+
+        if options['polar'] != None:
+            import marinegpxpolar
+            marinegpxpolar.runpolar(options['polar'])
+            return 0
+
+        #get filename
+        if not options['filename']:
+            options['filename'] = askfilename()
+
+            if not options['filename']:
+                say("Canceled")
+                return 25
+
+        if options['follow']:
+            runfollow(options['filename'])
+            return 0
+
+        #for now just load the file we are working with
+        if options['chunked']:
+            data = loadchunked(options['filename'])
+        else:
+            data = loaddata(options['filename'])
+
+        if options['leg'] or options['legs'] or options['rangefrom'] != None or options['rangeto'] != None:
+            data = selectrange(data)
+
+        if options['statsonly']:
+            printstats(data)
+            return 0
+
+        if options['roundings'] and data['markfiles']:
+            printroundings(data)
+
+        if options['maneuvers']:
+            printmaneuvers(data)
+
+        if options['export']:
+            exporttrack(data)
+            return 0
+
+        if options['replay']:
+            import marinegpxreplay
+            marinegpxreplay.runreplay(data)
+            return 0
 
-    if not config['filename']:
+        plotdata(data)
+
+    except TrackError as e:
+        e.report()
+        return e.code
+
+    return 0
+
+
+"""
+    The command line program, argv defaults to sys.argv, returns the exit code
+    the options are only in force while it runs, the defaults library users get are left alone
+"""
+def main(argv=None):
+    options = Options()
+
+    with options:
         try:
-            from tkinter import Tk
-            import tkinter.filedialog
-        except ImportError:
-            print("")
-            print("")
-            print("You don't have Tkinter installed, this can be installed with python 2.x.  Try reinstalling python 2.x.  Error 8")
-            print("If you run the program with the -f [--file] option and specify a filename this error will be bypassed!!!")
-            exit(8)
-        
-        root = Tk()
-        config['filename'] = tkinter.filedialog.askopenfilename(title="Track File", filetypes=[("GPX File", "*.gpx"),("All files","*")])
-        root.destroy()
+            status = parsecmdline(argv, options)
 
-        if config['filename'] == ():
-            print("Canceled")
-            exit(25)
+        except SystemExit as e:
+            #argparse has already printed the help or what was wrong with the arguments
+            return e.code
 
-    #for now just load the file we are working with
-    data = loaddata(config['filename'])
+        if status != None:
+            return status
 
-   
+        #a run only reports its own stages, and only traces memory while it runs
+        del stagetimings[:]
+        if options['timings']:
+            tracemalloc.start()
+
+        profiler = None
+        if options['profile']:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        try:
+            return runcommand(options)
 
-    plotdata(data)
+        finally:
+            if profiler != None:
+                dumpprofile(profiler)
+
+            if options['timings']:
+                reporttimings()
+                tracemalloc.stop()
+
+
+if __name__ == "__main__":
+    #the modules beside this one (marinegpxpolar and the like) import it by name, they have to get this copy and its options
+    sys.modules.setdefault('marinegpxgrapher', sys.modules[__name__])
+    sys.exit(main())
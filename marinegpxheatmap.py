@@ -0,0 +1,275 @@
+#File:		marinegpxheatmap.py
+#Desc:		The density heatmap for marinegpxgrapher, --heatmap bins any number of tracks into one grid of cells and draws where the fleet went.  Kept apart from the grapher so the single race program doesn't have to carry it.
+
+#    marinegpxgrapher A GPX file graphing program for sailors
+#    Copyright (C) 2018  Gary Andrew Bezet
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import math
+import os
+import io
+import contextlib
+
+import numpy as np
+
+from marinegpxgrapher import Options, TrackError, calcdist, cleantrack, config, gpxfiles, gridcell, loadbase, loadmarkfiles, loadpyplot, projectlatlon, say, setwindowtitle, trackbounds
+
+
+"""
+    What --heatmap can show for each cell, (name, colorbar label)
+"""
+heatvalues = {'time':"hours spent", 'count':"points logged", 'speed':"mean knots", 'tracks':"tracks through"}
+
+
+"""
+    Bin one track into heatmap cells, runs in a worker process
+    the grid is the same for every track (config['heatmapcell'] NM squares projected with config['geodesy'] from one origin) so the results
+    can just be added, with no origin the middle of this track is used (for the first one)
+    returns the cells used with the points, seconds and summed speed in each, small next to the track itself
+"""
+def heatreadtrack(path, origin, workerconfig):
+    with Options(workerconfig):
+        result = {'file':path, 'error':None, 'code':0}
+
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                data = {'filename':os.path.basename(path), 'markfiles':None, 'cachekey':None}
+                loadbase(path, data)
+
+                if config['clean']:
+                    cleantrack(data)
+
+        except TrackError as e:
+            result['error'] = e.message
+            result['code'] = e.code
+            return result
+
+        lat = data['data']['lat']
+        lon = data['data']['lon']
+        if origin == None:
+            origin = (float(np.mean(lat)), float(np.mean(lon)))
+
+        latnm, lonnm = projectlatlon(lat, lon, origin[0], origin[1])
+        elapsed = np.diff(data['data']['time'])
+
+        #each step counts in the cell it starts from, steps over a gap in the log weren't really spent anywhere
+        steps = elapsed <= config['heatmapgap']
+        seconds = np.where(steps, elapsed, 0.)
+        dist = calcdist({'data':{'lat':lat, 'lon':lon, 'latnm':latnm, 'lonnm':lonnm}})
+        speed = np.divide(dist * 3600., elapsed, out=np.zeros(elapsed.shape[0]), where=steps & (elapsed > 0))
+
+        cells, inverse = np.unique(gridcell(latnm[:-1], lonnm[:-1], config['heatmapcell']), return_inverse=True)
+
+        result['origin'] = origin
+        result['bounds'] = trackbounds(data)
+        result['points'] = int(elapsed.shape[0])
+        result['cells'] = cells
+        result['count'] = np.bincount(inverse, weights=steps, minlength=cells.shape[0])
+        result['seconds'] = np.bincount(inverse, weights=seconds, minlength=cells.shape[0])
+        result['speed'] = np.bincount(inverse, weights=speed, minlength=cells.shape[0])
+        result['tracks'] = np.ones(cells.shape[0])
+
+        return result
+
+
+"""
+    Add up heatmap cells from several parts (tracks or already merged ones) into one
+"""
+def mergeheat(parts):
+    cells, inverse = np.unique(np.concatenate([part['cells'] for part in parts]), return_inverse=True)
+
+    heat = {'cells':cells}
+    for key in ('count', 'seconds', 'speed', 'tracks'):
+        heat[key] = np.bincount(inverse, weights=np.concatenate([part[key] for part in parts]), minlength=cells.shape[0])
+
+    return heat
+
+
+"""
+    Bin the tracks, the first one that loads here to get the origin and the rest in parallel, yields each result as it comes back
+"""
+def heatresults(paths, workers):
+    import concurrent.futures
+
+    for idx, path in enumerate(paths):
+        result = heatreadtrack(path, None, dict(config))
+        yield result
+
+        if result['error'] == None:
+            break
+    else:
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(heatreadtrack, path, result['origin'], dict(config)) for path in paths[idx + 1:]]
+
+        for future in concurrent.futures.as_completed(futures):
+            yield future.result()
+
+
+"""
+    Load the tracks and merge their cells as they come back
+    merging waits until there are about as many new cells as merged ones, so it stays linear in the number of tracks
+"""
+def loadheat(paths):
+    workers = config['workers'] if config['workers'] else (os.cpu_count() or 1)
+    say("Binning %d tracks with %d workers" % (len(paths), workers))
+
+    heat = None
+    pending = []
+    pendingcells = 0
+    tracks = 0
+    points = 0
+    bounds = []
+
+    for result in heatresults(paths, workers):
+        if result['error'] != None:
+            say("***Warning, dropping %s (error %d) %s***" % (os.path.basename(result['file']), result['code'], result['error']))
+            continue
+
+        tracks += 1
+        points += result['points']
+        origin = result['origin']
+        bounds.append(result['bounds'])
+        pending.append(result)
+        pendingcells += result['cells'].shape[0]
+
+        if pendingcells >= max(1 << 20, heat['cells'].shape[0] if heat else 0):
+            heat = mergeheat(([heat] if heat else []) + pending)
+            pending = []
+            pendingcells = 0
+
+    if pending:
+        heat = mergeheat(([heat] if heat else []) + pending)
+
+    if heat == None:
+        raise TrackError(100, "None of the heatmap tracks could be loaded")
+
+    bounds = np.array(bounds, dtype=float)
+    heat.update({'trackcount':tracks, 'points':points, 'origin':origin, 'cellsize':config['heatmapcell'],
+                 'bounds':(np.min(bounds[:, 0]), np.max(bounds[:, 1]), np.min(bounds[:, 2]), np.max(bounds[:, 3]))})
+    say("%d points from %d tracks in %d cells" % (points, tracks, heat['cells'].shape[0]))
+
+    return heat
+
+
+"""
+    Turn the merged cells into an image of config['heatmapvalue'], at most config['heatmappixels'] on a side (cells are added together
+    into bigger pixels when there are too many), costs the number of cells whatever the number of points
+    returns the image (NaN where nobody went), its extent in NM from the origin and the pixel size in NM
+"""
+def heatimage(heat):
+    cells = heat['cells']
+    rows = (cells + (1 << 31)) >> 32
+    cols = cells - (rows << 32)
+
+    rowmin = np.min(rows)
+    colmin = np.min(cols)
+    factor = max(1, int(math.ceil(max(np.max(rows) - rowmin + 1, np.max(cols) - colmin + 1) / float(config['heatmappixels']))))
+
+    rows = (rows - rowmin) // factor
+    cols = (cols - colmin) // factor
+    shape = (int(np.max(rows)) + 1, int(np.max(cols)) + 1)
+    flat = rows * shape[1] + cols
+
+    pixels = lambda key: np.bincount(flat, weights=heat[key], minlength=shape[0] * shape[1]).reshape(shape)
+
+    value = config['heatmapvalue']
+    if value == 'time':
+        image = pixels('seconds') / 3600.
+    elif value == 'count':
+        image = pixels('count')
+    elif value == 'speed':
+        count = pixels('count')
+        image = np.divide(pixels('speed'), count, out=np.zeros(shape), where=count > 0)
+    else:
+        #a track crossing several cells of one pixel should still only count once, so this one is the most of any cell
+        image = np.zeros(shape[0] * shape[1])
+        np.maximum.at(image, flat, heat['tracks'])
+        image = image.reshape(shape)
+
+    image[pixels('count') == 0] = np.nan
+
+    size = heat['cellsize'] * factor
+    bottom = rowmin * heat['cellsize']
+    left = colmin * heat['cellsize']
+    extent = (left, left + shape[1] * size, bottom, bottom + shape[0] * size)
+
+    return image, extent, size
+
+
+"""
+    Draw the heatmap as one image, with the marks from -mf files in the area
+"""
+def makeheatfigure(heat):
+    plt = loadpyplot()
+    import matplotlib.colors
+
+    image, extent, size = heatimage(heat)
+    value = config['heatmapvalue']
+    lat0, lon0 = heat['origin']
+
+    fig, ax = plt.subplots(figsize=config['figsize'])
+    setwindowtitle(fig, "Heatmap")
+    ax.set_aspect('equal')
+    plt.title("Where %d tracks went (%s per %.3g NM)" % (heat['trackcount'], heatvalues[value], size))
+    plt.ylabel("NM North-South from %.4f" % lat0)
+    plt.xlabel("NM West-East from %.4f" % lon0)
+
+    #counts and times bunch up on the start line and the marks, log keeps the rest of the course visible
+    norm = matplotlib.colors.LogNorm() if value in ('time', 'count') else None
+    cmap = config['speedcmap'] if value == 'speed' else config['timecmap']
+    shown = ax.imshow(image, origin='lower', extent=extent, cmap=cmap, norm=norm, interpolation='nearest')
+    fig.colorbar(shown, ax=ax, label=heatvalues[value])
+
+    if config['markfiles']:
+        #loadmarkfiles only wants the area, give it the corners of where the tracks went
+        minlat, maxlat, minlon, maxlon = heat['bounds']
+        marks = {'markfiles':config['markfiles'], 'data':{'lat':np.array([minlat, maxlat]), 'lon':np.array([minlon, maxlon])}}
+        with contextlib.redirect_stdout(io.StringIO()):
+            loadmarkfiles(marks)
+
+        waypoints = marks['waypoints']
+        if len(waypoints['names']) > 0:
+            y, x = projectlatlon(np.asarray(waypoints['lat'], dtype=float), np.asarray(waypoints['lon'], dtype=float), lat0, lon0)
+            ax.scatter(x, y, marker='x', color='k')
+            for idx in range(len(waypoints['names'])):
+                ax.annotate(waypoints['names'][idx], (x[idx], y[idx]), fontsize='small')
+
+    return fig
+
+
+"""
+    Draw where a whole archive of tracks went, files or directories of them, shows it or saves it to config['outdir']
+"""
+def runheatmap(paths):
+    heat = loadheat(gpxfiles(paths))
+
+    if config['outdir']:
+        loadpyplot('Agg')
+        os.makedirs(config['outdir'], exist_ok=True)
+
+    fig = makeheatfigure(heat)
+
+    if config['outdir']:
+        for fmt in config['batchformats']:
+            outname = os.path.join(config['outdir'], "heatmap.%s" % fmt)
+            fig.savefig(outname, format=fmt)
+            say("Saved %s" % outname)
+    else:
+        loadpyplot().show()
+
+    return heat
@@ -0,0 +1,419 @@
+#File:		marinegpxpolar.py
+#Desc:		The boat polar store for marinegpxgrapher, --polar adds races to a store of speed by angle and hour so the boat's polar builds up across a season.  Kept apart from the grapher so the single race program doesn't have to carry it.
+
+#    marinegpxgrapher A GPX file graphing program for sailors
+#    Copyright (C) 2018  Gary Andrew Bezet
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import hashlib
+import json
+import io
+import contextlib
+
+import numpy as np
+
+from marinegpxgrapher import Options, TrackError, cachedchannels, cachedir, cachewrite, calcangle, calcspeed, cleanparams, cleantrack, config, filehash, findmaneuvers, geodesyparams, havconvlatlon, loadbase, loadpyplot, say, setwindowtitle
+
+
+"""
+    Arrays kept for a polar, count/total/sumsq/peak are (sectors, 24 hours) and hist is (sectors, speed bins)
+"""
+polararrays = ('count', 'total', 'sumsq', 'peak', 'hist')
+
+
+"""
+    Everything a polar depends on, aggregates made with different settings can't be added together
+"""
+def polarparams():
+    return {'version':1, 'sectors':config['polarsectors'], 'speedstep':config['polarspeedstep'], 'maxspeed':config['polarmaxspeed'],
+            'minspeed':config['polarminspeed'], 'reference':config['polarreference'], 'clean':cleanparams(), 'geodesy':geodesyparams()}
+
+
+"""
+    Where the season polar is kept, --polar-store or one per heading reference under the cache directory
+    it lives in a subdirectory so cacheevict and --clear-cache leave it alone
+"""
+def polarstorefile():
+    if config['polarstore']:
+        return config['polarstore']
+
+    return os.path.join(cachedir(), "polars", "%s.npz" % config['polarreference'])
+
+
+"""
+    An empty polar for params
+"""
+def emptypolar(params):
+    shape = (params['sectors'], 24)
+    nspeed = int(round(params['maxspeed'] / params['speedstep']))
+
+    return {'count':np.zeros(shape, dtype=np.int64), 'total':np.zeros(shape), 'sumsq':np.zeros(shape), 'peak':np.zeros(shape),
+            'hist':np.zeros((params['sectors'], nspeed), dtype=np.int64)}
+
+
+"""
+    Bin one race into a polar, one pass of np.bincount/np.histogram2d over the points
+    sectors are compass headings, or the angle off the wind (0 head to wind, 90 starboard beam reach) if wind is given
+    hours are local solar time worked out from the longitude, close enough to the clock on the boat and no time zones needed
+"""
+def polaraggregate(data, wind=None):
+    params = polarparams()
+    sectors = params['sectors']
+    polar = emptypolar(params)
+
+    speed = np.asarray(data['data']['speed'], dtype=float)
+    heading = np.asarray(data['data']['angle'], dtype=float)
+    hours = ((data['starttime'] + data['data']['time']) / 3600. + np.asarray(data['data']['lon']) / 15.) % 24.
+
+    #drifting about doesn't say anything about how the boat sails
+    keep = np.isfinite(speed) & (speed >= params['minspeed'])
+    speed = speed[keep]
+    heading = heading[keep]
+    if wind != None:
+        heading = (heading - wind) % 360.
+
+    sector = np.minimum((heading * (sectors / 360.)).astype(np.int64), sectors - 1)
+    cell = sector * 24 + np.minimum(hours[keep].astype(np.int64), 23)
+    size = sectors * 24
+
+    polar['count'] += np.bincount(cell, minlength=size).reshape(sectors, 24)
+    polar['total'] += np.bincount(cell, weights=speed, minlength=size).reshape(sectors, 24)
+    polar['sumsq'] += np.bincount(cell, weights=speed * speed, minlength=size).reshape(sectors, 24)
+    np.maximum.at(polar['peak'].reshape(-1), cell, speed)
+
+    nspeed = polar['hist'].shape[1]
+    hist = np.histogram2d(sector, np.minimum(speed, params['maxspeed']), bins=(sectors, nspeed), range=((0, sectors), (0., params['maxspeed'])))[0]
+    polar['hist'] += hist.astype(np.int64)
+
+    return polar, int(speed.shape[0])
+
+
+"""
+    Add one polar into another, the maxima can't be summed so they're kept as the biggest
+"""
+def mergepolar(total, polar):
+    for key in ('count', 'total', 'sumsq', 'hist'):
+        total[key] += polar[key]
+
+    np.maximum(total['peak'], polar['peak'], out=total['peak'])
+
+
+"""
+    Load one race and bin it, runs in a worker process
+    a race that won't load comes back with error and code set, runpolar() warns and doesn't add it to the store
+"""
+def polarrace(path, workerconfig):
+    with Options(workerconfig):
+        result = {'file':path, 'name':os.path.basename(path), 'error':None, 'code':0}
+
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                data = {'filename':os.path.basename(path), 'markfiles':None, 'cachekey':None}
+                loadbase(path, data)
+
+                if config['clean']:
+                    cleantrack(data)
+
+                cachedchannels(data, ('latnm','lonnm'), {}, lambda: havconvlatlon(data))
+                cachedchannels(data, ('speed',), {}, lambda: calcspeed(data))
+                cachedchannels(data, ('angle',), {'method':'arctan2'}, lambda: calcangle(data))
+
+                wind = None
+                if config['polarreference'] == 'wind':
+                    #every race gets its own wind, given or worked out from its tacks and gybes
+                    findmaneuvers(data)
+                    wind = data['maneuvers']['wind']
+                    if wind == None:
+                        raise TrackError(14, "No tacks or gybes to work out the wind from, give it with --wind")
+
+                result['polar'], result['points'] = polaraggregate(data, wind)
+
+        except TrackError as e:
+            result['error'] = e.message
+            result['code'] = e.code
+            return result
+
+        if data['name'] != None:
+            result['name'] = data['name']
+
+        result['wind'] = wind
+        result['start'] = data['starttime']
+
+        return result
+
+
+"""
+    Open the season polar store, an empty one if it isn't there yet
+"""
+def loadpolarstore(filename):
+    import zipfile
+
+    #through json so it compares the same as what comes back out of the file
+    params = json.loads(json.dumps(polarparams()))
+    store = {'file':filename, 'params':params, 'races':{}, 'polar':emptypolar(params)}
+
+    if not os.path.exists(filename):
+        return store
+
+    try:
+        with np.load(filename) as saved:
+            meta = json.loads(str(saved['meta']))
+            polar = {key:saved[key] for key in polararrays}
+
+    except (IOError, ValueError, KeyError, zipfile.BadZipFile):
+        raise TrackError(14, "Could not read the polar store", filename)
+
+    #stores from before the geodesy could be picked used the default
+    meta['params'].setdefault('geodesy', None)
+    if meta['params'] != params:
+        raise TrackError(14, "The polar store was made with different settings (sectors, cleaning, geodesy or heading/wind), use another --polar-store", filename)
+
+    store['races'] = meta['races']
+    store['polar'] = polar
+
+    return store
+
+
+"""
+    Save the season polar store
+"""
+def savepolarstore(store):
+    os.makedirs(os.path.dirname(os.path.abspath(store['file'])), exist_ok=True)
+    cachewrite(store['file'], dict(store['polar'], meta=np.array(json.dumps({'params':store['params'], 'races':store['races']}))))
+
+
+"""
+    Add races to the store, returns how many went in
+    races are known by the sha1 of the file so ones already in are skipped without loading them, and each race's own
+    polar is kept next to the store so a lost or deleted store is put back together without reading any tracks
+"""
+def addpolarraces(store, paths):
+    import concurrent.futures
+
+    raceparams = dict(store['params'], wind=config['wind'] if config['polarreference'] == 'wind' else None)
+    paramkey = hashlib.sha1(json.dumps(raceparams, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    racedir = os.path.splitext(store['file'])[0] + ".races"
+
+    results = []
+    todo = []
+    for path in paths:
+        try:
+            sha1 = filehash(path)
+
+        except (IOError, OSError) as e:
+            say("***Warning, skipping %s (%s)***" % (os.path.basename(path), e))
+            continue
+
+        if sha1 in store['races'] or sha1 in [race['sha1'] for race in todo + results]:
+            say("%s is already in the polar" % os.path.basename(path))
+            continue
+
+        racefile = os.path.join(racedir, "%s.%s.npz" % (sha1, paramkey))
+        try:
+            with np.load(racefile) as saved:
+                result = json.loads(str(saved['meta']))
+                result['polar'] = {key:saved[key] for key in polararrays}
+
+        except (IOError, ValueError, KeyError):
+            todo.append({'file':path, 'sha1':sha1, 'racefile':racefile})
+            continue
+
+        result.update({'file':path, 'sha1':sha1, 'racefile':None})
+        results.append(result)
+
+    if len(todo) > 1:
+        workers = config['workers'] if config['workers'] else (os.cpu_count() or 1)
+        say("Binning %d races with %d workers" % (len(todo), workers))
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            loaded = list(pool.map(polarrace, [race['file'] for race in todo], [dict(config)] * len(todo)))
+
+    else:
+        loaded = [polarrace(race['file'], dict(config)) for race in todo]
+
+    for race, result in zip(todo, loaded):
+        result.update(race)
+        results.append(result)
+
+    added = 0
+    for result in results:
+        if result['error'] != None:
+            say("***Warning, dropping %s (error %d) %s***" % (os.path.basename(result['file']), result['code'], result['error']))
+            continue
+
+        race = {'file':os.path.basename(result['file']), 'name':result['name'], 'points':result['points'], 'wind':result['wind'], 'start':result['start']}
+
+        if result['racefile']:
+            try:
+                os.makedirs(racedir, exist_ok=True)
+                cachewrite(result['racefile'], dict(result['polar'], meta=np.array(json.dumps(dict(race, error=None, code=0)))))
+
+            except IOError as e:
+                say("***Warning, could not save the race polar (%s)***" % e)
+
+        mergepolar(store['polar'], result['polar'])
+        store['races'][result['sha1']] = race
+        added += 1
+
+        say("Added %s (%d points%s)" % (race['name'], race['points'], ", wind %.0f degrees" % race['wind'] if race['wind'] != None else ""))
+
+    return added
+
+
+"""
+    Speed by sector for the polar, the hours are added up into bands of the day
+    returns the band start hours and (sectors, bands) arrays of point counts, mean and top speeds, NaN where there's too little to go on
+"""
+def polarcurves(polar, bands=1):
+    starts = np.arange(bands) * 24 // bands
+
+    count = np.add.reduceat(polar['count'], starts, axis=1)
+    total = np.add.reduceat(polar['total'], starts, axis=1)
+    peak = np.maximum.reduceat(polar['peak'], starts, axis=1)
+
+    enough = count >= config['polarminpoints']
+    mean = np.where(enough, total / np.maximum(count, 1), np.nan)
+    peak = np.where(enough, peak, np.nan)
+
+    return starts, count, mean, peak
+
+
+"""
+    Speed that fraction of the points in each sector were slower than, from the speed histogram
+    the points are taken as spread evenly across the bin the fraction lands in, and it can't go past the fastest point of the sector
+"""
+def polarpercentile(polar, params, fraction):
+    counts = np.cumsum(polar['hist'], axis=1)
+    points = counts[:, -1]
+    target = fraction * points
+    idx = np.argmax(counts >= target[:, None], axis=1)
+
+    rows = np.arange(idx.shape[0])
+    inbin = polar['hist'][rows, idx]
+    below = counts[rows, idx] - inbin
+    speed = (idx + (target - below) / np.maximum(inbin, 1)) * params['speedstep']
+    speed = np.minimum(speed, polar['peak'].max(axis=1))
+
+    return np.where(points >= config['polarminpoints'], speed, np.nan)
+
+
+"""
+    Label for a band of the day
+"""
+def polarbandname(starts, idx):
+    end = starts[idx + 1] if idx + 1 < starts.shape[0] else 24
+    return "%02d-%02dh" % (starts[idx], end)
+
+
+"""
+    Print the polar as a table, one row per sector
+"""
+def printpolar(store):
+    polar = store['polar']
+    params = store['params']
+    starts, count, mean, peak = polarcurves(polar)
+    p90 = polarpercentile(polar, params, 0.9)
+
+    bands = config['polarhours']
+    if bands:
+        bandstarts, bandcount, bandmean, bandpeak = polarcurves(polar, bands)
+
+    width = 360. / params['sectors']
+    say("")
+    say("Polar from %d races (%d points), %s" % (len(store['races']), np.sum(polar['count']), "angle off the wind" if params['reference'] == 'wind' else "compass heading"))
+    say("\t%-9s %9s %7s %7s %7s" % ("Sector", "Points", "Mean", "P90", "Max") + ("".join(" %8s" % polarbandname(bandstarts, idx) for idx in range(bands)) if bands else ""))
+
+    for idx in range(params['sectors']):
+        line = "\t%3.0f-%3.0f   %9d %7.2f %7.2f %7.2f" % (idx * width, (idx + 1) * width, count[idx, 0], mean[idx, 0], p90[idx], peak[idx, 0])
+        if bands:
+            line += "".join(" %8.2f" % speed for speed in bandmean[idx])
+        say(line)
+
+
+"""
+    Draw the polar, mean and 90th percentile speed for each sector (and the mean for each band of the day with --polar-hours)
+"""
+def makepolarfigure(store):
+    plt = loadpyplot()
+
+    polar = store['polar']
+    params = store['params']
+    starts, count, mean, peak = polarcurves(polar)
+
+    #sector centres, round again to the first one to close the curve
+    width = 360. / params['sectors']
+    theta = np.radians(np.append(np.arange(params['sectors']) * width + width / 2., width / 2.))
+    closed = lambda values: np.append(values, values[0])
+
+    fig, ax = plt.subplots(figsize=config['figsize'], subplot_kw={'projection':'polar'})
+    setwindowtitle(fig, "Polar")
+    ax.set_theta_zero_location('N')
+    ax.set_theta_direction(-1)
+
+    plt.title("Polar from %d races (%s)" % (len(store['races']), "angle off the wind" if params['reference'] == 'wind' else "compass heading"))
+
+    bands = config['polarhours']
+    if bands:
+        bandstarts, bandcount, bandmean, bandpeak = polarcurves(polar, bands)
+        colors = plt.get_cmap(config['timecmap'])(np.linspace(0., 0.9, bands))
+        for idx in range(bands):
+            ax.plot(theta, closed(bandmean[:, idx]), color=colors[idx], label="mean %s" % polarbandname(bandstarts, idx))
+
+    ax.plot(theta, closed(mean[:, 0]), color='k', linewidth=2, label="mean")
+    ax.plot(theta, closed(polarpercentile(polar, params, 0.9)), color='k', linestyle='--', label="90th percentile")
+
+    ax.set_ylim(bottom=0)
+    ax.set_rlabel_position(135)
+    fig.subplots_adjust(bottom=0.18)
+    ax.legend(loc='upper center', bbox_to_anchor=(0.5, -0.06), ncol=3, fontsize='small')
+
+    return fig
+
+
+"""
+    Add races to the season polar and show it, or save it to config['outdir'] if that is set
+"""
+def runpolar(paths):
+    store = loadpolarstore(polarstorefile())
+
+    if paths and addpolarraces(store, paths) > 0:
+        savepolarstore(store)
+        say("Polar store %s has %d races" % (store['file'], len(store['races'])))
+
+    if len(store['races']) == 0:
+        raise TrackError(14, "The polar store is empty, give some race files with --polar", store['file'])
+
+    printpolar(store)
+
+    if config['statsonly']:
+        return store
+
+    if config['outdir']:
+        loadpyplot('Agg')
+        os.makedirs(config['outdir'], exist_ok=True)
+
+    fig = makepolarfigure(store)
+
+    if config['outdir']:
+        for fmt in config['batchformats']:
+            outname = os.path.join(config['outdir'], "polar.%s" % fmt)
+            fig.savefig(outname, format=fmt)
+            say("Saved %s" % outname)
+    else:
+        loadpyplot().show()
+
+    return store
@@ -0,0 +1,364 @@
+#File:		marinegpxreplay.py
+#Desc:		The animated race replay for marinegpxgrapher, --replay plays the boat round the track in a window or writes it to a MP4 or GIF with the frames drawn by several processes.  Kept apart from the grapher so the single race program doesn't have to carry it.
+
+#    marinegpxgrapher A GPX file graphing program for sailors
+#    Copyright (C) 2018  Gary Andrew Bezet
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import time
+
+import numpy as np
+
+from marinegpxgrapher import Options, TrackError, config, drawmarks, loadpyplot, say, setwindowtitle, stage
+
+
+"""
+    When each replay frame happens and what it shows, all worked out up front so drawing a frame is only slicing
+    frames are config['replayspeed'] race seconds per second of replay apart, the trail is the points from the
+    config['replaytrail'] seconds before each one, lo:hi into the track arrays
+"""
+def replayframes(data):
+    time = data['data']['time']
+    step = config['replayspeed'] / float(config['replayfps'])
+    frametimes = time[0] + np.arange(int((time[-1] - time[0]) // step) + 1) * step
+
+    return {'count':frametimes.shape[0], 'time':frametimes,
+            'x':np.interp(frametimes, time, data['data']['lonnm']),
+            'y':np.interp(frametimes, time, data['data']['latnm']),
+            'speed':np.interp(frametimes, time, data['data']['speedavg']),
+            'lo':np.searchsorted(time, frametimes - config['replaytrail'], side='left'),
+            'hi':np.searchsorted(time, frametimes, side='right')}
+
+
+"""
+    Just what a replay needs from a track, small enough to hand to worker processes
+"""
+def replaytrack(data):
+    track = {'filename':data['filename'], 'name':data['name'], 'markfiles':data['markfiles'], 'ptcount':data['ptcount'],
+             'data':{name:np.asarray(data['data'][name]) for name in ('time', 'latnm', 'lonnm', 'speed', 'speedavg')}}
+
+    if data['markfiles']:
+        track['waypoints'] = data['waypoints']
+
+    return track
+
+
+"""
+    Build the replay figure, the whole track faint and the marks are drawn once as the background
+    only the trail, the boat and the speed readout are animated, returns the state replayframe() works on
+"""
+def makereplay(data):
+    import matplotlib.collections
+    import matplotlib.colors
+    import matplotlib.cm
+    plt = loadpyplot()
+
+    x = data['data']['lonnm']
+    y = data['data']['latnm']
+    speed = data['data']['speed']
+
+    fig, ax = plt.subplots(figsize=config['figsize'])
+    setwindowtitle(fig, data['name'] if data['name'] != None else data['filename'])
+    ax.set_title("Replay of %s" % (data['name'] if data['name'] != None else data['filename']))
+    ax.set_aspect('equal')
+    ax.set_ylabel("NM North-South from start")
+    ax.set_xlabel("NM West-East from start")
+    ax.plot(x, y, color='0.8', zorder=1)
+    ax.grid()
+    drawmarks(data, ax)
+
+    norm = matplotlib.colors.Normalize(np.nanmin(speed), np.nanmax(speed))
+    mappable = matplotlib.cm.ScalarMappable(norm=norm, cmap=config['speedcmap'])
+    fig.colorbar(mappable, ax=ax).set_label("Speed (knots)")
+
+    #segment i runs from point i to i + 1 coloured by the speed at its end, a frame's trail is a view of these
+    points = np.column_stack((x, y))
+    state = {'fig':fig, 'ax':ax, 'frames':replayframes(data), 'time':data['data']['time'], 'background':None,
+             'segments':np.stack((points[:-1], points[1:]), axis=1), 'colors':mappable.to_rgba(speed[1:])}
+
+    state['trail'] = ax.add_collection(matplotlib.collections.LineCollection([], linewidths=3, zorder=2, animated=True))
+    state['boat'], = ax.plot([], [], marker='o', markersize=9, color='red', markeredgecolor='black', zorder=3, animated=True)
+    state['readout'] = ax.text(0.02, 0.98, "", transform=ax.transAxes, va='top', family='monospace', zorder=4, animated=True,
+                               bbox={'facecolor':'white', 'alpha':0.8})
+
+    return state
+
+
+"""
+    Move the animated artists to frame k and return them, the cost only depends on how many points are in the trail
+"""
+def replayframe(state, k):
+    frames = state['frames']
+    lo = frames['lo'][k]
+    hi = frames['hi'][k]
+    trail = config['replaytrail']
+
+    #older bits of the trail fade out
+    colors = state['colors'][lo:hi - 1].copy()
+    colors[:, 3] = np.clip((state['time'][lo + 1:hi] - frames['time'][k] + trail) / trail, 0.05, 1.)
+    state['trail'].set_segments(state['segments'][lo:max(hi - 1, lo)])
+    state['trail'].set_color(colors)
+
+    state['boat'].set_data([frames['x'][k]], [frames['y'][k]])
+
+    secs = int(frames['time'][k])
+    state['readout'].set_text("%d:%02d:%02d %5.1f knots" % (secs // 3600, secs // 60 % 60, secs % 60, frames['speed'][k]))
+
+    return [state['trail'], state['boat'], state['readout']]
+
+
+"""
+    Draw frame k off screen by blitting over the saved background, returns the RGBA pixels (a view, copy it to keep it)
+"""
+def replaydraw(state, k):
+    canvas = state['fig'].canvas
+
+    if state['background'] is None:
+        canvas.draw()
+        state['background'] = canvas.copy_from_bbox(state['fig'].bbox)
+    else:
+        canvas.restore_region(state['background'])
+
+    for artist in replayframe(state, k):
+        state['ax'].draw_artist(artist)
+
+    return np.asarray(canvas.buffer_rgba())
+
+
+"""
+    Where ffmpeg is, matplotlib's setting for it is used so there's only one place to point at it
+"""
+def ffmpegpath():
+    import shutil
+    import matplotlib
+
+    path = shutil.which(matplotlib.rcParams['animation.ffmpeg_path'])
+    if path == None:
+        raise TrackError(15, "Exporting MP4 needs ffmpeg, install it (or export a GIF instead)")
+
+    return path
+
+
+"""
+    Start writing frames to filename, a .mp4 is piped to ffmpeg and anything else gets GIF frames without the file header
+    so the parts from several workers can be joined by joinvideo()
+"""
+def openvideo(filename, size, fps):
+    video = {'filename':filename, 'size':size, 'fps':fps, 'frames':0}
+
+    if filename.endswith(".mp4"):
+        import subprocess
+
+        #x264 needs even sizes
+        video['process'] = subprocess.Popen([ffmpegpath(), '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', "%dx%d" % size, '-r', str(fps), '-i', '-',
+                                             '-vf', "pad=ceil(iw/2)*2:ceil(ih/2)*2", '-c:v', 'libx264', '-pix_fmt', 'yuv420p', filename], stdin=subprocess.PIPE)
+    else:
+        video['file'] = open(filename, 'wb')
+        video['previous'] = None
+
+    return video
+
+
+"""
+    Add one frame of RGBA pixels
+    GIF frames only hold the box that changed since the last one, in the fixed web palette so the frames from every worker match
+"""
+def writevideo(video, pixels):
+    if 'process' in video:
+        try:
+            video['process'].stdin.write(pixels.tobytes())
+        except BrokenPipeError:
+            closevideo(video)
+
+    else:
+        from PIL import Image
+        from PIL import GifImagePlugin
+
+        current = pixels.view(np.uint32)[:, :, 0]
+        if video['previous'] is None:
+            rows = cols = np.array([True])
+            box = (0, 0, video['size'][0], video['size'][1])
+        else:
+            changed = current != video['previous']
+            rows = np.flatnonzero(changed.any(axis=1))
+            cols = np.flatnonzero(changed.any(axis=0))
+
+        if rows.shape[0] == 0:
+            #nothing moved, make the last frame last longer instead (it has to be at least one pixel)
+            box = (0, 0, 1, 1)
+        elif video['previous'] is not None:
+            box = (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+
+        video['previous'] = current.copy()
+
+        image = Image.frombuffer('RGBA', video['size'], pixels, 'raw', 'RGBA', 0, 1).crop(box).convert('RGB')
+        image = image.convert('P', palette=Image.Palette.WEB, dither=Image.Dither.NONE)
+        video['file'].write(b"".join(GifImagePlugin.getdata(image, offset=box[:2], duration=1000. / video['fps'])))
+
+    video['frames'] += 1
+
+
+def closevideo(video):
+    if 'process' in video:
+        video['process'].stdin.close()
+        if video['process'].wait() != 0:
+            raise TrackError(15, "ffmpeg failed writing the replay (exit code %d)" % video['process'].returncode, video['filename'])
+
+    else:
+        video['file'].close()
+
+
+"""
+    Put the parts written by replaypart() together as filename
+    MP4 parts are joined by ffmpeg without encoding them again, GIF parts just need the header in front and the end marker
+"""
+def joinvideo(parts, filename, size):
+    if filename.lower().endswith(".mp4"):
+        if len(parts) == 1:
+            os.replace(parts[0], filename)
+            return
+
+        import subprocess
+
+        listfile = parts[0] + ".txt"
+        with open(listfile, 'w') as f:
+            f.write("".join("file '%s'\n" % part.replace("'", "'\\''") for part in parts))
+
+        if subprocess.run([ffmpegpath(), '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', listfile, '-c', 'copy', filename]).returncode != 0:
+            raise TrackError(15, "ffmpeg failed joining the replay", filename)
+
+    else:
+        import shutil
+        from PIL import Image
+        from PIL import GifImagePlugin
+
+        image = Image.new('RGB', size, 'white').convert('P', palette=Image.Palette.WEB, dither=Image.Dither.NONE)
+        header = GifImagePlugin.getheader(image, info={'loop':0})[0]
+
+        with open(filename, 'wb') as f:
+            f.write(b"".join(header))
+            for part in parts:
+                with open(part, 'rb') as partfile:
+                    shutil.copyfileobj(partfile, f)
+            f.write(b";")
+
+
+"""
+    Render frames start to stop of the replay to partfile, this runs in a worker process
+    returns the frames done, the milliseconds they took and the part's size, or the TrackError code and message for exportreplay() to raise
+"""
+def replaypart(track, start, stop, partfile, workerconfig):
+    with Options(workerconfig):
+        plt = loadpyplot('Agg')
+
+        result = {'start':start, 'stop':stop, 'error':None, 'code':0, 'ms':0., 'size':None}
+        starttime = time.perf_counter()
+
+        try:
+            state = makereplay(track)
+            pixels = replaydraw(state, start)
+            result['size'] = (pixels.shape[1], pixels.shape[0])
+            video = openvideo(partfile, result['size'], config['replayfps'])
+            writevideo(video, pixels)
+
+            for k in range(start + 1, stop):
+                writevideo(video, replaydraw(state, k))
+
+            closevideo(video)
+            plt.close(state['fig'])
+
+        except TrackError as e:
+            result['error'] = e.message
+            result['code'] = e.code
+
+        result['ms'] = (time.perf_counter() - starttime) * 1000.
+
+        return result
+
+
+"""
+    Export the replay as a MP4 or GIF (by the extension), the frames are split into ranges drawn by config['workers'] processes
+    returns the filename written
+"""
+def exportreplay(data, filename):
+    import concurrent.futures
+    import tempfile
+
+    fmt = os.path.splitext(filename)[1][1:].lower()
+    if fmt not in ("mp4", "gif"):
+        raise TrackError(15, "Can't write a replay as \"%s\", use mp4 or gif" % fmt, filename)
+
+    if fmt == "mp4":
+        ffmpegpath()
+
+    track = replaytrack(data)
+    count = replayframes(track)['count']
+    workers = config['workers'] if config['workers'] else (os.cpu_count() or 1)
+
+    #a worker has to start matplotlib and draw the background, not worth it for a few frames
+    nparts = max(1, min(workers, count // 250))
+    bounds = np.linspace(0, count, nparts + 1).astype(np.int64)
+
+    say("Rendering %d frames (%.0f seconds at %d fps) with %d workers" % (count, count / float(config['replayfps']), config['replayfps'], nparts))
+    starttime = time.perf_counter()
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(filename))) as tmpdir:
+        parts = [os.path.join(tmpdir, "part-%04d.%s" % (idx, fmt)) for idx in range(nparts)]
+
+        with stage("replay frames", count):
+            if nparts == 1:
+                results = [replaypart(track, 0, count, parts[0], dict(config))]
+            else:
+                with concurrent.futures.ProcessPoolExecutor(max_workers=nparts) as pool:
+                    results = list(pool.map(replaypart, [track] * nparts, bounds[:-1], bounds[1:], parts, [dict(config)] * nparts))
+
+        for result in results:
+            if result['error'] != None:
+                raise TrackError(result['code'], result['error'], filename)
+
+        with stage("replay join", count):
+            joinvideo(parts, filename, results[0]['size'])
+
+    say("Wrote %s in %i ms" % (filename, (time.perf_counter() - starttime) * 1000.))
+
+    return filename
+
+
+"""
+    Play the replay in a window, blitting so only the trail and boat get drawn each frame
+"""
+def showreplay(data):
+    plt = loadpyplot()
+    from matplotlib.animation import FuncAnimation
+
+    state = makereplay(data)
+    state['animation'] = FuncAnimation(state['fig'], lambda k: replayframe(state, k), frames=state['frames']['count'],
+                                       init_func=lambda: replayframe(state, 0), interval=1000. / config['replayfps'], blit=True, repeat=False)
+
+    with stage("show"):
+        plt.show()
+
+
+"""
+    Animate the boat going round the track, shown in a window or exported to config['replayout']
+"""
+def runreplay(data):
+    if config['replayout']:
+        loadpyplot('Agg')
+        return exportreplay(data, config['replayout'])
+
+    showreplay(data)
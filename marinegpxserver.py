@@ -0,0 +1,382 @@
+#File:		marinegpxserver.py
+#Desc:		The local HTTP render service for marinegpxgrapher, --serve draws the graphs for a directory of tracks on request and keeps recent figures in a cache.  Kept apart from the grapher so the single race program doesn't have to carry it.
+
+#    marinegpxgrapher A GPX file graphing program for sailors
+#    Copyright (C) 2018  Gary Andrew Bezet
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import json
+import io
+
+from marinegpxgrapher import Options, Track, TrackError, activeoptions, colormapnames, config, gpxfiles, loadpyplot, say
+
+
+"""
+    A least recently used cache holding up to limit worth of things (size is given with each one), safe to share between threads
+"""
+def newlru(limit):
+    import collections
+    import threading
+
+    return {'items':collections.OrderedDict(), 'size':0, 'limit':limit, 'lock':threading.Lock(), 'hits':0, 'misses':0}
+
+
+"""
+    Get key from the lru, None if it isn't there
+"""
+def lruget(lru, key):
+    with lru['lock']:
+        if key not in lru['items']:
+            lru['misses'] += 1
+            return None
+
+        lru['items'].move_to_end(key)
+        lru['hits'] += 1
+        return lru['items'][key][0]
+
+
+"""
+    Put value in the lru, dropping the least recently used things until it fits
+"""
+def lruput(lru, key, value, size=1):
+    with lru['lock']:
+        if key in lru['items']:
+            lru['size'] -= lru['items'].pop(key)[1]
+
+        #something bigger than the whole cache just isn't kept
+        if size > lru['limit']:
+            return
+
+        lru['items'][key] = (value, size)
+        lru['size'] += size
+
+        while lru['size'] > lru['limit']:
+            lru['size'] -= lru['items'].popitem(last=False)[1][1]
+
+
+"""
+    Graphs the server can draw and what they're called on the pages
+"""
+servegraphs = {'speed':"Speed", 'time':"Time", 'angle':"Heading", 'hist':"Speed history"}
+
+
+"""
+    Query parameters the server takes, name -> (type, option it sets)
+"""
+serveparams = {'speedcmap':(str, 'speedcmap'), 'timecmap':(str, 'timecmap'), 'from':(float, 'rangefrom'), 'to':(float, 'rangeto'),
+               'rollavg_points':(int, 'rollavg_points'), 'rollavg_method':(str, 'rollavg_method'), 'rollavg_seconds':(float, 'rollavg_seconds'),
+               'maxpoints':(int, 'maxpoints')}
+
+#tracks already loaded in this render worker
+servetracks = None
+
+
+"""
+    Set up a render worker process
+"""
+def servestart(workerconfig):
+    global servetracks
+
+    #the worker process only ever renders with these
+    activeoptions.set(Options(workerconfig))
+    loadpyplot('Agg')
+    servetracks = newlru(config['servetracks'])
+
+
+"""
+    Get a track loaded with the settings its channels depend on, from the worker's cache if it's there
+"""
+def servetrack(path, stamp, params):
+    global servetracks
+
+    if servetracks == None:
+        servetracks = newlru(config['servetracks'])
+
+    trackoptions = {key:params[key] for key in ('rollavg_points', 'rollavg_method', 'rollavg_seconds') if key in params}
+    key = (path, stamp, tuple(sorted(trackoptions.items())))
+
+    track = lruget(servetracks, key)
+    if track == None:
+        track = Track.load(path, dict(config), **trackoptions).derive()
+        lruput(servetracks, key, track)
+
+    if params.get('rangefrom') != None or params.get('rangeto') != None:
+        track = track.slice(None if params.get('rangefrom') == None else params['rangefrom'] * 60., None if params.get('rangeto') == None else params['rangeto'] * 60.)
+
+    return track
+
+
+"""
+    Draw one graph of a track as png or svg bytes, runs in a render worker
+    a TrackError becomes the result's error and code, which the handler answers with a 400 for a bad range or a 500 otherwise
+"""
+def serverender(path, stamp, graph, fmt, params):
+    result = {'error':None, 'code':0, 'body':None}
+
+    try:
+        track = servetrack(path, stamp, params)
+
+        #just the one graph, the other options only change the drawing so the track's data is shared
+        drawoptions = dict(track.options, **{flag:flag == 'show' + graph for flag in ('showspeed', 'showtime', 'showhist', 'showangle')})
+        drawoptions.update({key:params[key] for key in ('speedcmap', 'timecmap', 'maxpoints') if key in params})
+
+        body = io.BytesIO()
+        Track(track.data, drawoptions).render(lambda name, fig: fig.savefig(body, format=fmt))
+
+        result['body'] = body.getvalue()
+
+    except TrackError as e:
+        result['error'] = e.message
+        result['code'] = e.code
+
+    return result
+
+
+"""
+    Track numbers as a dict for the server, runs in a render worker
+"""
+def servestats(path, stamp, params):
+    result = {'error':None, 'code':0, 'body':None}
+
+    try:
+        track = servetrack(path, stamp, params)
+        result['body'] = dict(track.stats(), name=track.name, starttime=track.starttime)
+
+    except TrackError as e:
+        result['error'] = e.message
+        result['code'] = e.code
+
+    return result
+
+
+"""
+    Answers the requests for the server, one thread each
+        /                               list of tracks
+        /view/<track>                   page with all the graphs
+        /graph/<track>/<graph>.<fmt>    one graph as png or svg
+        /stats/<track>                  the numbers as json
+    the graph and stats urls take the serveparams, from and to are minutes into the track
+"""
+def servehandler():
+    import http.server
+    import urllib.parse
+    import html
+
+    class ServeHandler(http.server.BaseHTTPRequestHandler):
+
+        def send(self, status, body, contenttype, cache=None):
+            if isinstance(body, str):
+                body = body.encode('utf-8')
+
+            self.send_response(status)
+            self.send_header("Content-Type", contenttype)
+            self.send_header("Content-Length", str(len(body)))
+            if cache:
+                self.send_header("X-Cache", cache)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def fail(self, status, message):
+            self.send(status, message + "\n", "text/plain; charset=utf-8")
+
+        def log_message(self, format, *args):
+            say("%s %s" % (self.address_string(), format % args))
+
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            parts = [urllib.parse.unquote(part) for part in url.path.split('/') if part]
+            query = urllib.parse.parse_qs(url.query)
+
+            try:
+                if len(parts) == 0:
+                    return self.index()
+
+                if len(parts) == 2 and parts[0] == 'view':
+                    return self.view(parts[1], url.query)
+
+                if len(parts) == 2 and parts[0] == 'stats':
+                    return self.stats(parts[1], self.params(query))
+
+                if len(parts) == 3 and parts[0] == 'graph':
+                    graph, dot, fmt = parts[2].rpartition('.')
+                    if graph not in servegraphs or fmt not in ('png', 'svg'):
+                        return self.fail(404, "No graph %s, try %s as png or svg" % (parts[2], ", ".join(servegraphs)))
+
+                    return self.graph(parts[1], graph, fmt, self.params(query))
+
+            except ValueError as e:
+                return self.fail(400, str(e))
+
+            self.fail(404, "Nothing at %s" % url.path)
+
+        """
+            The serveparams given in the query, checked and converted
+        """
+        def params(self, query):
+            params = {}
+            for name, values in query.items():
+                if name not in serveparams:
+                    raise ValueError("Unknown parameter %s, the ones that work are %s" % (name, ", ".join(sorted(serveparams))))
+
+                kind, option = serveparams[name]
+                try:
+                    params[option] = kind(values[-1])
+                except ValueError:
+                    raise ValueError("Bad value for %s: %s" % (name, values[-1]))
+
+            for option in ('speedcmap', 'timecmap'):
+                if option in params and params[option] not in self.server.colormaps:
+                    raise ValueError("Unknown colormap %s" % params[option])
+
+            if 'rollavg_method' in params and params['rollavg_method'] not in ("mean", "ewma", "median"):
+                raise ValueError("rollavg_method is mean, ewma or median")
+
+            if params.get('rollavg_points', 1) < 1 or params.get('maxpoints', 3) < 3:
+                raise ValueError("rollavg_points has to be at least 1 and maxpoints at least 3")
+
+            return params
+
+        """
+            The file for a track name and a stamp that changes when the file does, None if there's no such track
+        """
+        def track(self, name):
+            path = self.server.tracks.get(name)
+            if path == None:
+                self.fail(404, "No track called %s" % name)
+                return None, None
+
+            try:
+                stat = os.stat(path)
+            except OSError:
+                self.fail(404, "Track %s has gone" % name)
+                return None, None
+
+            return path, (stat.st_size, stat.st_mtime_ns)
+
+        """
+            Run func in the worker pool unless the same thing is already being done, then wait for that instead
+        """
+        def work(self, key, func, *args):
+            server = self.server
+            with server.lock:
+                future = server.pending.get(key)
+                if future == None:
+                    future = server.pool.submit(func, *args)
+                    server.pending[key] = future
+
+            try:
+                return future.result()
+
+            finally:
+                with server.lock:
+                    if server.pending.get(key) is future:
+                        del server.pending[key]
+
+        def graph(self, name, graph, fmt, params):
+            path, stamp = self.track(name)
+            if path == None:
+                return
+
+            key = (path, stamp, graph, fmt, tuple(sorted(params.items())))
+            body = lruget(self.server.images, key)
+            if body != None:
+                return self.send(200, body, "image/svg+xml" if fmt == 'svg' else "image/png", "hit")
+
+            result = self.work(key, serverender, path, stamp, graph, fmt, params)
+            if result['error'] != None:
+                return self.fail(400 if result['code'] == 13 else 500, "%s (error %d)" % (result['error'], result['code']))
+
+            lruput(self.server.images, key, result['body'], len(result['body']))
+            self.send(200, result['body'], "image/svg+xml" if fmt == 'svg' else "image/png", "miss")
+
+        def stats(self, name, params):
+            path, stamp = self.track(name)
+            if path == None:
+                return
+
+            result = self.work((path, stamp, 'stats', tuple(sorted(params.items()))), servestats, path, stamp, params)
+            if result['error'] != None:
+                return self.fail(400 if result['code'] == 13 else 500, "%s (error %d)" % (result['error'], result['code']))
+
+            self.send(200, json.dumps(result['body'], indent=2), "application/json")
+
+        def index(self):
+            items = "".join('<li><a href="/view/%s">%s</a></li>' % (urllib.parse.quote(name), html.escape(name)) for name in sorted(self.server.tracks))
+            self.send(200, "<!DOCTYPE html><html><head><meta charset=\"utf-8\"><meta name=\"viewport\" content=\"width=device-width\"><title>Marine GPX Grapher</title></head>"
+                           "<body><h1>Tracks</h1><ul>%s</ul></body></html>" % items, "text/html; charset=utf-8")
+
+        def view(self, name, querystring):
+            if name not in self.server.tracks:
+                return self.fail(404, "No track called %s" % name)
+
+            quoted = urllib.parse.quote(name)
+            suffix = "?" + querystring if querystring else ""
+            graphs = "".join('<h2>%s</h2><img style="max-width:100%%" src="/graph/%s/%s.png%s">' % (title, quoted, graph, html.escape(suffix)) for graph, title in servegraphs.items())
+            self.send(200, "<!DOCTYPE html><html><head><meta charset=\"utf-8\"><meta name=\"viewport\" content=\"width=device-width\"><title>%s</title></head>"
+                           "<body><p><a href=\"/\">Tracks</a> | <a href=\"/stats/%s%s\">Numbers</a></p><h1>%s</h1>%s</body></html>" % (html.escape(name), quoted, html.escape(suffix), html.escape(name), graphs),
+                      "text/html; charset=utf-8")
+
+    return ServeHandler
+
+
+"""
+    Serve the graphs of the tracks (files or directories of them) over http until interrupted
+    tracks are called by their file name without the .gpx, images are kept in an LRU of config['servecache'] MB
+"""
+def runserve(paths):
+    import concurrent.futures
+    import http.server
+    import threading
+
+    tracks = {}
+    for path in gpxfiles(paths):
+        name = os.path.splitext(os.path.basename(path))[0]
+        if name in tracks:
+            say("***Warning, two tracks called %s, using %s***" % (name, tracks[name]))
+            continue
+        tracks[name] = path
+
+    if len(tracks) == 0:
+        raise TrackError(100, "No tracks to serve")
+
+    workers = config['workers'] if config['workers'] else (os.cpu_count() or 1)
+
+    server = http.server.ThreadingHTTPServer((config['servehost'], config['serveport']), servehandler())
+    server.daemon_threads = True
+    server.tracks = tracks
+    server.colormaps = set(colormapnames())
+    server.images = newlru(config['servecache'] * 1024 * 1024)
+    server.pending = {}
+    server.lock = threading.Lock()
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=servestart, initargs=(dict(config),)) as pool:
+        server.pool = pool
+        say("Serving %d tracks on http://%s:%d/ with %d render workers (Ctrl-C to stop)" % (len(tracks), config['servehost'], server.server_address[1], workers))
+
+        try:
+            server.serve_forever()
+
+        except KeyboardInterrupt:
+            say("")
+
+        finally:
+            server.server_close()
+
+    images = server.images
+    say("Stopped, %d image cache hits and %d misses" % (images['hits'], images['misses']))
+
+    return server
@@ -0,0 +1,80 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+os.environ.setdefault('MPLBACKEND', 'Agg')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import marinegpxgrapher as mgg
+
+
+#the sample files that come with the program
+repodir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+samplerace = os.path.join(repodir, "2018-07-29 03_36_41 Around the Lake Race Cookie Monster.gpx")
+sampleshort = os.path.join(repodir, "SummerSeries2_2018-06-30 101554.gpx")
+samplemarks = os.path.join(repodir, "2020LakePontchartrainRacingMarks.gpx")
+
+
+"""
+    Every test gets options of its own with the cache in its own directory, so nothing leaks from one test to the next
+"""
+@pytest.fixture(autouse=True)
+def options(tmp_path):
+    with mgg.Options(cachedir=str(tmp_path / "cache"), quiet=True) as options:
+        yield options
+
+
+"""
+    Write a GPX track, times are the <time> strings (None leaves a point without one)
+"""
+def writegpx(path, lat, lon, times, name="Test track"):
+    with open(str(path), 'w') as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        f.write('<gpx version="1.1" creator="tests" xmlns="http://www.topografix.com/GPX/1/1">\n')
+        f.write('  <trk>\n    <name>%s</name>\n    <trkseg>\n' % name)
+        for la, lo, stamp in zip(lat, lon, times):
+            f.write('      <trkpt lat="%.9f" lon="%.9f">\n' % (la, lo))
+            if stamp != None:
+                f.write('        <time>%s</time>\n' % stamp)
+            f.write('      </trkpt>\n')
+        f.write('    </trkseg>\n  </trk>\n</gpx>\n')
+
+    return str(path)
+
+
+"""
+    A boat sailing a square at about 5 knots logging every step seconds from 2018-07-28 22:00:00Z, returns lat, lon and time strings
+"""
+def squaretrack(npts=400, step=2, lat0=30.3, lon0=-90.05):
+    side = npts // 4
+    headings = np.repeat([0., 90., 180., 270.], side)
+    headings = np.concatenate((headings, np.full(npts - headings.shape[0], 0.)))
+
+    dist = 5. * step / 3600. / 60.
+    lat = lat0 + np.cumsum(dist * np.cos(np.radians(headings)))
+    lon = lon0 + np.cumsum(dist * np.sin(np.radians(headings)) / np.cos(np.radians(lat0)))
+    stamps = np.datetime64('2018-07-28T22:00:00', 's') + (np.arange(npts) * step).astype('timedelta64[s]')
+
+    return lat, lon, [stamp + "Z" for stamp in np.datetime_as_string(stamps, unit='s')]
+
+
+@pytest.fixture
+def squaregpx(tmp_path):
+    lat, lon, times = squaretrack()
+    return writegpx(tmp_path / "square.gpx", lat, lon, times)
+
+
+"""
+    Write a GPX file of marks, marks are (name, lat, lon)
+"""
+def writemarks(path, marks):
+    with open(str(path), 'w') as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        f.write('<gpx version="1.1" creator="tests" xmlns="http://www.topografix.com/GPX/1/1">\n')
+        for name, lat, lon in marks:
+            f.write('  <wpt lat="%.9f" lon="%.9f">\n    <name>%s</name>\n  </wpt>\n' % (lat, lon, name))
+        f.write('</gpx>\n')
+
+    return str(path)
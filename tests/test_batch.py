@@ -0,0 +1,51 @@
+import json
+import os
+import shutil
+import tracemalloc
+
+import marinegpxgrapher as mgg
+from conftest import samplerace, sampleshort
+
+
+def test_batch_renders_every_file_and_reports_the_broken_one(tmp_path, capsys):
+    indir = tmp_path / "races"
+    indir.mkdir()
+    shutil.copy(samplerace, str(indir / "long.gpx"))
+    shutil.copy(sampleshort, str(indir / "short.GPX"))
+    (indir / "broken.gpx").write_text("<gpx><trk><trkseg><trkpt")
+    (indir / "notes.txt").write_text("not a track")
+    outdir = tmp_path / "out"
+
+    status = mgg.main(["--batch", str(indir), "--out", str(outdir), "--format", "png", "--format", "svg", "--workers", "2", "--cache-dir", str(tmp_path / "cache")])
+    assert status == 11
+
+    with open(str(outdir / "summary.json")) as f:
+        summary = json.load(f)
+    assert (summary['files'], summary['failed'], summary['workers']) == (3, 1, 2)
+
+    results = {os.path.basename(result['file']):result for result in summary['results']}
+    assert sorted(results) == ["broken.gpx", "long.gpx", "short.GPX"]
+    assert (results['broken.gpx']['ok'], results['broken.gpx']['code']) == (False, 2)
+
+    for name in ("long", "short"):
+        result = results[name + (".gpx" if name == "long" else ".GPX")]
+        assert result['ok'] and result['ptcount'] > 0
+        assert sorted(os.path.basename(output) for output in result['outputs']) == sorted("%s-%s.%s" % (name, graph, fmt) for graph in ("hist", "speed", "time", "angle") for fmt in ("png", "svg"))
+        assert all(os.path.getsize(output) > 0 for output in result['outputs'])
+
+    #the tracks said nothing, it all went in the summary
+    assert "Loading data" not in capsys.readouterr().out
+    assert "Loading data" in results['short.GPX']['log']
+
+
+def test_worker_keeps_its_options_to_itself(tmp_path, options):
+    #a worker process leaves memory tracing on for its next file, here it has to be stopped again
+    try:
+        result = mgg.batchrender(sampleshort, str(tmp_path), dict(options, showtime=False, showhist=False, showangle=False, timings=True))
+    finally:
+        tracemalloc.stop()
+
+    assert result['ok']
+    assert [os.path.basename(output) for output in result['outputs']] == ["SummerSeries2_2018-06-30 101554-speed.png"]
+    assert any(record['stage'] == "parsegpx" for record in result['timings'])
+    assert options['showtime'] and not options['timings']
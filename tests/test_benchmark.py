@@ -0,0 +1,54 @@
+import argparse
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+import benchmark
+import marinegpxgrapher as mgg
+
+
+def test_synthetic_track_is_repeatable_and_sane(tmp_path, options):
+    one = str(tmp_path / "one.gpx")
+    two = str(tmp_path / "two.gpx")
+    benchmark.maketrack(one, 2500, segments=3, seed=4)
+    benchmark.maketrack(two, 2500, segments=3, seed=4)
+    assert open(one, 'rb').read() == open(two, 'rb').read()
+
+    #speed jumps of several knots in a second would look like spikes to the cleaning
+    options['clean'] = False
+    data = mgg.loaddata(one)
+    steps = np.diff(data['data']['time'])
+    assert (data['ptcount'], data['segcount']) == (2500, 3)
+    assert steps.min() >= 1. and steps.max() <= 3.
+    assert 1.9 < np.min(data['data']['speed'][1:]) and np.max(data['data']['speed']) < 8.1
+
+
+def test_vincenty_on_known_distances():
+    #a degree along the equator and up the meridian from it on WGS84
+    assert benchmark.vincenty(np.array([0., 0.]), np.array([0., 1.]))[0] * mgg.metrespernm == pytest.approx(111319.491, abs=1e-3)
+    assert benchmark.vincenty(np.array([0., 1.]), np.array([0., 0.]))[0] * mgg.metrespernm == pytest.approx(110574.389, abs=1e-3)
+    assert benchmark.vincenty(np.array([30.3, 30.3]), np.array([-90.05, -90.05]))[0] == 0.
+
+
+def test_every_stage_is_timed(tmp_path, options):
+    options.update(usecache=False, filterwaypoints=True)
+    track = str(tmp_path / "track.gpx")
+    marks = str(tmp_path / "marks.gpx")
+    benchmark.maketrack(track, 1000)
+    benchmark.makemarks(marks, 10)
+    args = argparse.Namespace(repeat=1, rollavgpts=20, rollavgsecs=60., rollavgmethods=["mean", "ewma", "median"], maxrenderpoints=0)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = benchmark.benchtrack(track, 1000, 1, [(10, marks)], args)
+
+    stages = [result['stage'] for result in results]
+    assert stages[:2] == ["parsegpx", "checkdtformat/convdatetime"]
+    assert "loadmarkfiles[marks=10]" in stages and "markroundings[marks=10]" in stages
+    assert "calcspeed_rollavg[median,60s]" in stages
+    assert all(result['seconds'] >= 0 and result['points'] == 1000 for result in results)
+
+    geodesy = [result for result in results if result['stage'].startswith("geodesy[")]
+    assert len(geodesy) == 2 * len(mgg.geodesies)
+    assert all(abs(result['total_error_percent']) < 1. for result in geodesy)
@@ -0,0 +1,94 @@
+import glob
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+import marinegpxgrapher as mgg
+from conftest import sampleshort, squaretrack, writegpx
+
+
+def cachefiles(options):
+    return sorted(glob.glob(os.path.join(options['cachedir'], "*")))
+
+
+def test_cached_load_is_the_same(tmp_path, options, monkeypatch):
+    path = shutil.copy(sampleshort, str(tmp_path / "race.gpx"))
+    first = mgg.loaddata(path)
+    assert len(cachefiles(options)) > 1
+
+    monkeypatch.setattr(mgg, 'readtrack', lambda path, data: pytest.fail("parsed again"))
+    second = mgg.loaddata(path)
+
+    assert second['name'] == first['name'] and second['starttime'] == first['starttime']
+    for name in first['data']:
+        np.testing.assert_array_equal(second['data'][name], first['data'][name])
+
+    #derived channels come straight off the disk
+    assert isinstance(second['data']['speedavg'], np.memmap)
+
+
+def test_same_size_file_with_other_content_is_a_miss(tmp_path, options):
+    lat, lon, times = squaretrack(npts=50)
+    path = writegpx(tmp_path / "race.gpx", lat, lon, times)
+    first = mgg.loaddata(path)
+    stat = os.stat(path)
+
+    #same number of characters, the boat just went somewhere else
+    writegpx(path, lat, lon + 0.01, times)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+    assert os.stat(path).st_size == stat.st_size
+
+    second = mgg.loaddata(path)
+    np.testing.assert_allclose(second['data']['lon'], first['data']['lon'] + 0.01)
+    assert not np.array_equal(second['data']['lonnm'], first['data']['lonnm'])
+
+
+def test_touched_but_unchanged_file_uses_the_cache(tmp_path, options, monkeypatch):
+    path = shutil.copy(sampleshort, str(tmp_path / "race.gpx"))
+    first = mgg.loaddata(path)
+    os.utime(path, (1e9, 1e9))
+
+    monkeypatch.setattr(mgg, 'readtrack', lambda path, data: pytest.fail("parsed again"))
+    second = mgg.loaddata(path)
+    np.testing.assert_array_equal(second['data']['speed'], first['data']['speed'])
+
+
+def test_broken_cache_file_is_a_miss(tmp_path, options):
+    path = shutil.copy(sampleshort, str(tmp_path / "race.gpx"))
+    first = mgg.loaddata(path)
+
+    for filename in cachefiles(options):
+        with open(filename, 'wb') as f:
+            f.write(b"not numpy")
+
+    second = mgg.loaddata(path)
+    np.testing.assert_array_equal(second['data']['speedavg'], first['data']['speedavg'])
+
+
+def test_channels_are_kept_per_setting(tmp_path, options):
+    path = shutil.copy(sampleshort, str(tmp_path / "race.gpx"))
+    mean = mgg.loaddata(path)['data']['speedavg']
+
+    options['rollavg_method'] = 'median'
+    median = mgg.loaddata(path)['data']['speedavg']
+    assert not np.array_equal(mean, median)
+
+    options['rollavg_method'] = 'mean'
+    np.testing.assert_array_equal(mgg.loaddata(path)['data']['speedavg'], mean)
+
+
+def test_evict_and_clear(tmp_path, options):
+    path = shutil.copy(sampleshort, str(tmp_path / "race.gpx"))
+    mgg.loaddata(path)
+    assert cachefiles(options)
+
+    options['cachesize'] = 0
+    mgg.cacheevict()
+    assert cachefiles(options) == []
+
+    options['cachesize'] = 256
+    mgg.loaddata(path)
+    mgg.clearcache()
+    assert cachefiles(options) == []
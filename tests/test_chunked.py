@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+import pytest
+
+import marinegpxgrapher as mgg
+from conftest import samplerace, sampleshort, squaretrack, writegpx
+
+
+"""
+    Load path both ways and check every channel and the stats come out the same
+"""
+def checksame(path, rtol=1e-9):
+    chunked = mgg.loadchunked(path)
+    full = mgg.loaddata(path)
+
+    assert chunked['ptcount'] == full['ptcount']
+    assert chunked['starttime'] == full['starttime'] and chunked['name'] == full['name']
+    for name in mgg.exportchannels:
+        np.testing.assert_allclose(chunked['data'][name], full['data'][name], rtol=rtol, atol=1e-9, err_msg=name)
+
+    chunkedstats, fullstats = mgg.trackstats(chunked), mgg.trackstats(full)
+    for key in fullstats:
+        assert chunkedstats[key] == pytest.approx(fullstats[key], rel=1e-9), key
+
+    return chunked, full
+
+
+@pytest.mark.parametrize('method,seconds', [('mean', None), ('ewma', None), ('median', None), ('mean', 60.), ('median', 60.)])
+def test_chunks_join_up_for_each_rolling_average(tmp_path, options, method, seconds):
+    #chunks smaller than the rolling window so every join is inside one
+    options.update(rollavg_method=method, rollavg_seconds=seconds, chunkpoints=25, outdir=str(tmp_path / "out"))
+    checksame(samplerace)
+
+
+def test_one_chunk_or_many(tmp_path, options):
+    options.update(outdir=str(tmp_path / "out"))
+    for chunkpoints in (1 << 18, 1000, 21):
+        options['chunkpoints'] = chunkpoints
+        chunked, full = checksame(sampleshort)
+
+    assert isinstance(chunked['data']['speedavg'], np.memmap)
+    assert os.path.exists(chunked['data']['speed'].filename)
+
+
+def test_cleaning_across_the_joins(tmp_path, options):
+    lat, lon, times = squaretrack(npts=300)
+    lat, lon = list(lat), list(lon)
+    #a duplicate, a point that goes back in time and a spike, each right at a join
+    times[100] = times[99]
+    times[150] = times[140]
+    lat[200] += 0.05
+    path = writegpx(tmp_path / "dirty.gpx", lat, lon, times)
+
+    for chunkpoints in (21, 50, 99, 100, 149, 150, 199, 200):
+        options.update(chunkpoints=chunkpoints, outdir=str(tmp_path / ("out%d" % chunkpoints)))
+        chunked, full = checksame(path)
+        assert chunked['cleaning'] == full['cleaning']
+        assert sum(full['cleaning'].values()) >= 3
+
+
+def test_float32_channels(tmp_path, options):
+    options.update(dtype="float32", chunkpoints=100, outdir=str(tmp_path / "out"))
+    chunked = mgg.loadchunked(sampleshort)
+
+    #positions and times stay full precision, what's worked out from them is stored small
+    assert chunked['data']['lat'].dtype == np.float64 and chunked['data']['time'].dtype == np.float64
+    assert chunked['data']['speed'].dtype == np.float32 and chunked['data']['speedavg'].dtype == np.float32
+
+    full = mgg.loaddata(sampleshort)
+    np.testing.assert_allclose(chunked['data']['speed'], full['data']['speed'], rtol=1e-4, atol=1e-4)
+
+
+def test_empty_track_is_error_100(tmp_path, options):
+    options.update(outdir=str(tmp_path / "out"))
+    path = writegpx(tmp_path / "empty.gpx", [], [], [])
+
+    with pytest.raises(mgg.TrackError) as error:
+        mgg.loadchunked(path)
+    assert error.value.code == 100
@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+import marinegpxgrapher as mgg
+from conftest import squaretrack, writegpx
+from test_follow import growfile
+
+
+"""
+    The square track with some of everything wrong with it, as arrays and as the GPX time strings
+    a duplicate stamp at 50, a point back in time at 120, spikes at 200 and 300, a 20 second gap at 350
+"""
+def dirtytrack(npts=400):
+    lat, lon, times = squaretrack(npts=npts)
+    seconds = np.arange(npts) * 2.
+
+    seconds[51] = seconds[50]
+    seconds[120] = seconds[100]
+    lat[200] += 0.01
+    lat[300] -= 0.01
+    seconds[350:] += 20.
+
+    stamps = np.datetime64('2018-07-28T22:00:00', 's') + seconds.astype('timedelta64[s]')
+    return lat, lon, seconds, [stamp + "Z" for stamp in np.datetime_as_string(stamps, unit='s')]
+
+
+def test_clean_track_is_left_alone():
+    lat, lon, times = squaretrack(npts=100)
+    seconds = np.arange(100) * 2.
+    cleanlat, cleanlon, cleantime, report = mgg.cleanpoints(lat, lon, seconds)
+
+    assert report == {'backwards':0, 'duplicates':0, 'spikes':0, 'filled':0}
+    np.testing.assert_array_equal(cleanlat, lat)
+    np.testing.assert_array_equal(cleantime, seconds)
+
+
+def test_everything_wrong_gets_fixed():
+    lat, lon, seconds, stamps = dirtytrack()
+    cleanlat, cleanlon, cleantime, report = mgg.cleanpoints(lat, lon, seconds)
+
+    assert report == {'backwards':1, 'duplicates':1, 'spikes':2, 'filled':0}
+    assert cleantime.shape[0] == 400 - 4
+    assert np.all(np.diff(cleantime) > 0)
+
+    #the duplicate is the average of the two positions
+    assert cleanlat[50] == pytest.approx((lat[50] + lat[51]) / 2.)
+    #no jumps left
+    assert np.max(np.abs(np.diff(cleanlat))) < 0.001
+
+
+def test_gaps_are_filled_with_straight_lines(options):
+    options['fillgaps'] = 30.
+    lat, lon, seconds, stamps = dirtytrack()
+    cleanlat, cleanlon, cleantime, report = mgg.cleanpoints(lat, lon, seconds)
+
+    #22 seconds at 2 second logging is 10 new points, and one goes back where each point dropped or merged was
+    assert report['filled'] == 10 + 4
+    gap = np.flatnonzero(cleantime == seconds[349])[0]
+    np.testing.assert_allclose(np.diff(cleantime[gap:gap + 12]), 2.)
+    np.testing.assert_allclose(np.diff(cleanlon[gap:gap + 12]), (cleanlon[gap + 11] - cleanlon[gap]) / 11.)
+
+    #gaps longer than asked for stay gaps
+    options['fillgaps'] = 10.
+    assert mgg.cleanpoints(lat, lon, seconds)[3]['filled'] == 4
+
+
+def test_spike_at_the_start_moves_the_start_time(tmp_path, options):
+    lat, lon, times = squaretrack(npts=100)
+    lat[0] += 0.01
+    path = writegpx(tmp_path / "spike.gpx", lat, lon, times)
+
+    data = mgg.loaddata(path)
+    assert data['ptcount'] == 99 and data['cleaning']['spikes'] == 1
+    assert data['data']['time'][0] == 0.
+    assert data['starttime'] == mgg.loaddata(writegpx(tmp_path / "clean.gpx", lat[1:], lon[1:], times[1:]))['starttime']
+
+    options['clean'] = False
+    assert mgg.loaddata(path)['ptcount'] == 100
+
+
+@pytest.mark.parametrize('fill', [None, 30.])
+def test_following_a_dirty_track_ends_up_the_same_as_loading_it(tmp_path, options, fill):
+    options.update(fillgaps=fill, usecache=False)
+    lat, lon, seconds, stamps = dirtytrack()
+    path = str(tmp_path / "live.gpx")
+    src = open(writegpx(path, lat, lon, stamps), 'rb').read()
+    body, closing = src[:src.rindex(b'</trkseg>')], src[src.rindex(b'</trkseg>'):]
+
+    #cut right by each of the bad points so they land at the joins
+    cuts = [body.index(b'<trkpt', body.index(stamps[idx].encode()) - 200) for idx in (50, 51, 120, 200, 201, 300, 301, 350)]
+    data, state = growfile(path, body, closing, [1000] + cuts)
+    full = mgg.loaddata(path)
+
+    assert data['cleaning'] == full['cleaning']
+    assert data['ptcount'] == full['ptcount'] and data['starttime'] == full['starttime']
+    for name in full['data']:
+        np.testing.assert_allclose(data['data'][name], full['data'][name], rtol=1e-9, atol=1e-9, err_msg=name)
@@ -0,0 +1,117 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+
+import marinegpxgrapher as mgg
+from conftest import samplemarks, sampleshort
+
+
+"""
+    Read back an exported CSV, returns the metadata from the # lines and the columns by name
+"""
+def readcsv(filename):
+    meta = {}
+    with open(filename) as f:
+        line = f.readline()
+        while line.startswith("#"):
+            key, value = line[2:].split(": ", 1)
+            meta[key] = json.loads(value)
+            line = f.readline()
+
+        names = line.strip().split(",")
+        table = np.loadtxt(f, delimiter=",", ndmin=2)
+
+    return meta, {name:table[:, i] for i, name in enumerate(names)}
+
+
+def test_npz_round_trip(tmp_path):
+    data = mgg.loaddata(sampleshort)
+    filename = str(tmp_path / "track.npz")
+    mgg.exportnpz(data, filename)
+
+    with np.load(filename) as saved:
+        assert sorted(saved.files) == sorted(mgg.exportchannels + ('meta',))
+        for name in mgg.exportchannels:
+            np.testing.assert_array_equal(saved[name], data['data'][name])
+            assert saved[name].dtype == data['data'][name].dtype
+        meta = json.loads(str(saved['meta']))
+
+    assert meta['name'] == data['name'] and meta['ptcount'] == data['ptcount']
+    assert meta['starttime'] == data['starttime']
+    assert meta['rollavg_points'] == mgg.config['rollavg_points']
+
+
+def test_csv_round_trip_in_any_chunk_size(tmp_path):
+    data = mgg.loaddata(sampleshort)
+    whole = str(tmp_path / "whole.csv")
+    pieces = str(tmp_path / "pieces.csv")
+    mgg.exportcsv(data, whole)
+    mgg.exportcsv(data, pieces, chunksize=7)
+
+    with open(whole) as f, open(pieces) as g:
+        assert f.read() == g.read()
+
+    meta, columns = readcsv(whole)
+    assert list(columns) == list(mgg.exportchannels)
+    assert meta['ptcount'] == data['ptcount'] and meta['units']['speed'] == "knots"
+    for name in mgg.exportchannels:
+        #15 significant digits is all a double needs to come back to within a rounding
+        np.testing.assert_allclose(columns[name], data['data'][name], rtol=1e-14, atol=1e-12)
+
+
+def test_export_keeps_the_marks(tmp_path, options):
+    options['markfiles'] = [samplemarks]
+    data = mgg.loaddata(sampleshort)
+    filename = str(tmp_path / "track.npz")
+    mgg.exportnpz(data, filename)
+
+    with np.load(filename) as saved:
+        meta = json.loads(str(saved['meta']))
+
+    assert meta['waypoints']['names'] == data['waypoints']['names']
+    np.testing.assert_array_equal(meta['waypoints']['lat'], data['waypoints']['lat'])
+
+
+def test_parquet_without_pyarrow_is_error_12(tmp_path, monkeypatch):
+    data = mgg.loaddata(sampleshort)
+    monkeypatch.setitem(sys.modules, 'pyarrow', None)
+
+    with pytest.raises(mgg.TrackError) as error:
+        mgg.exportparquet(data, str(tmp_path / "track.parquet"))
+    assert error.value.code == 12
+
+
+def test_parquet_round_trip(tmp_path):
+    pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+
+    data = mgg.loaddata(sampleshort)
+    filename = str(tmp_path / "track.parquet")
+    mgg.exportparquet(data, filename)
+
+    table = pyarrow.parquet.read_table(filename)
+    for name in mgg.exportchannels:
+        np.testing.assert_array_equal(table[name].to_numpy(), data['data'][name])
+    assert json.loads(table.schema.metadata[b'marinegpxgrapher'])['ptcount'] == data['ptcount']
+
+
+def test_export_from_the_command_line(tmp_path, options):
+    status = mgg.main(["-f", sampleshort, "--export", "npz", "--out", str(tmp_path / "out"), "--cache-dir", options['cachedir']])
+
+    assert status == 0
+    filename = tmp_path / "out" / (os.path.splitext(os.path.basename(sampleshort))[0] + ".npz")
+    with np.load(str(filename)) as saved:
+        np.testing.assert_array_equal(saved['speed'], mgg.loaddata(sampleshort)['data']['speed'])
+
+
+def test_track_export_picks_the_format_from_the_name(tmp_path):
+    track = mgg.Track.load(sampleshort)
+    track.export(str(tmp_path / "track.csv"))
+    assert readcsv(str(tmp_path / "track.csv"))[0]['name'] == track.data['name']
+
+    with pytest.raises(mgg.TrackError) as error:
+        track.export(str(tmp_path / "track.xlsx"))
+    assert error.value.code == 12
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+import marinegpxgrapher as mgg
+from conftest import samplemarks, sampleshort
+
+
+@pytest.fixture
+def plt():
+    plt = mgg.loadpyplot()
+    yield plt
+    plt.close('all')
+
+
+@pytest.mark.parametrize('maxpoints', [None, 500])
+def test_one_map_switches_between_the_channels(plt, options, maxpoints):
+    options['maxpoints'] = maxpoints
+    data = mgg.loaddata(sampleshort)
+    artists = {}
+    figures = mgg.makefigures(data, artists)
+
+    assert [name for name, fig in figures] == ["hist", "map"]
+    assert len(plt.get_fignums()) == 2
+
+    state = artists['map']
+    assert state['names'] == ["time", "angle", "speed"]
+    assert [label.get_text() for label in state['buttons'].labels] == state['names']
+    assert state['ax'].get_title() == mgg.mapchannels['time'][0]
+
+    #clicking a button recolours the same artists
+    points = state['points']
+    state['buttons'].set_active(2)
+    assert state['name'] == "speed" and state['points'] is points
+    assert state['ax'].get_title() == mgg.mapchannels['speed'][0]
+    assert points.get_cmap().name == options['speedcmap']
+
+    shown = np.asarray(data['data']['speed']) if state['idx'] is None else np.asarray(data['data']['speed'])[state['idx']]
+    np.testing.assert_array_equal(points.get_array(), shown)
+    assert points.get_clim() == (np.nanmin(data['data']['speed']), np.nanmax(data['data']['speed']))
+
+
+def test_one_channel_has_no_buttons(plt, options):
+    options.update(showtime=False, showangle=False, showhist=False)
+    artists = {}
+    figures = mgg.makefigures(mgg.loaddata(sampleshort), artists)
+
+    assert [name for name, fig in figures] == ["map"]
+    assert 'buttons' not in artists['map'] and artists['map']['name'] == "speed"
+
+
+def test_saving_draws_the_map_once_for_every_channel(plt, options):
+    options['markfiles'] = [samplemarks]
+    data = mgg.loaddata(sampleshort)
+    saved = []
+    mgg.renderfigures(data, lambda name, fig: saved.append((name, fig, fig.axes[0].get_title())))
+
+    assert [name for name, fig, title in saved] == ["hist", "time", "angle", "speed"]
+    #the three maps are the one figure recoloured
+    assert saved[1][1] is saved[2][1] is saved[3][1]
+    assert [title for name, fig, title in saved[1:]] == [mgg.mapchannels[name][0] for name in ("time", "angle", "speed")]
+    assert len(saved[1][1].axes[0].collections) == 2
+    assert plt.get_fignums() == []
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+import marinegpxgrapher as mgg
+
+
+"""
+    A boat sailing due north at knots from start (epoch seconds) for duration seconds, logged every 3 seconds
+"""
+def boat(name, start, duration, knots):
+    time = start + np.arange(0., duration, 3.)
+    lat = 30.3 + knots * (time - start) / 3600. / 60.
+    return {'name':name, 'time':time, 'lat':lat, 'lon':np.full(time.shape[0], -90.05)}
+
+
+def test_grid_is_the_overlap():
+    boats = [boat("a", 1000., 3600., 5.), boat("b", 1600., 3600., 5.)]
+    fleet = mgg.resamplefleet(boats, 10.)
+
+    assert fleet['grid'][0] == 1600.
+    assert fleet['grid'][-1] <= boats[0]['time'][-1]
+    assert np.isfinite(fleet['data']['lat']).all()
+
+
+def test_grid_never_goes_past_the_end():
+    boats = [boat("a", 0., 1000., 5.), boat("b", 0., 1000., 6.)]
+    end = min(b['time'][-1] for b in boats)
+    fleet = mgg.resamplefleet(boats, 7.)
+
+    assert fleet['grid'][-1] <= end
+    assert end - fleet['grid'][-1] < 7.
+    np.testing.assert_allclose(np.diff(fleet['grid']), 7.)
+
+
+def test_tracks_that_dont_overlap_are_refused():
+    with pytest.raises(mgg.TrackError):
+        mgg.resamplefleet([boat("a", 0., 600., 5.), boat("b", 10000., 600., 5.)], 10.)
+
+
+def test_faster_boat_leads():
+    fleet = mgg.resamplefleet([boat("slow", 0., 3600., 4.), boat("fast", 0., 3600., 6.)], 10.)
+    mgg.fleetmetrics(fleet)
+
+    gap = fleet['data']['gap']
+    assert np.all(gap[1, 1:] == 0.)
+    #2 knots slower the whole way
+    assert abs(gap[0, -1] - 2. * fleet['grid'][-1] / 3600.) < 0.01
+    np.testing.assert_allclose(fleet['data']['relspeed'][:, 1:].mean(axis=1), [-1., 1.], atol=0.05)
@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+
+import marinegpxgrapher as mgg
+from conftest import samplerace, squaretrack, writegpx, writemarks
+
+
+"""
+    Grow path to the whole of body (the file without its closing tags) in pieces cut at the given byte offsets
+    every write puts the closing tags back on the end the way loggers do, returns the followed track
+"""
+def growfile(path, body, closing, cuts):
+    with open(path, 'wb') as f:
+        f.write(body[:cuts[0]] + closing)
+
+    data, state = mgg.followload(path)
+    for start, end in zip(cuts, cuts[1:] + [len(body)]):
+        with open(path, 'r+b') as f:
+            f.seek(start)
+            f.write(body[start:end] + closing)
+        mgg.followpoll(state, data)
+
+    return data, state
+
+
+@pytest.mark.parametrize('method,seconds', [('mean', None), ('ewma', None), ('median', None), ('mean', 60.), ('ewma', 60.)])
+def test_growing_file_ends_up_the_same_as_loading_it(tmp_path, options, method, seconds):
+    options.update(rollavg_method=method, rollavg_seconds=seconds)
+    src = open(samplerace, 'rb').read()
+    body, closing = src[:src.rindex(b'</trkseg>')], src[src.rindex(b'</trkseg>'):]
+    path = str(tmp_path / "live.gpx")
+
+    #cuts land in the middle of points and tags, and one write adds nothing whole
+    data, state = growfile(path, body, closing, [3000, 40000, 40010, 200000, 500000])
+    full = mgg.loaddata(path)
+
+    assert data['ptcount'] == full['ptcount']
+    for name in full['data']:
+        np.testing.assert_allclose(data['data'][name], full['data'][name], rtol=1e-9, atol=1e-9, err_msg=name)
+
+
+def test_poll_without_a_whole_point_adds_nothing(tmp_path):
+    lat, lon, times = squaretrack(npts=20)
+    path = writegpx(tmp_path / "live.gpx", lat, lon, times)
+    data, state = mgg.followload(path)
+    offset = state['offset']
+
+    with open(path, 'a') as f:
+        f.write('<trkpt lat="30.4" lon="-90.1"><time>2018-07-28T')
+
+    assert mgg.followpoll(state, data) == 0
+    assert state['offset'] == offset and data['ptcount'] == 20
+
+
+def test_replaced_file_is_noticed(tmp_path):
+    lat, lon, times = squaretrack(npts=40)
+    path = writegpx(tmp_path / "live.gpx", lat, lon, times)
+    data, state = mgg.followload(path)
+
+    writegpx(path, lat[:10], lon[:10], times[:10])
+    assert mgg.followpoll(state, data) == -1
+
+
+"""
+    Marks for the square track, one just inside its far corner and one well away from it
+"""
+def squaremarks(path, lat, lon):
+    return writemarks(path, [("Corner", lat[199] - 0.0003, lon[199] - 0.0003), ("Faraway", lat[0] + 1., lon[0] + 1.)])
+
+
+def test_follow_picks_up_marks_the_track_grows_into(tmp_path):
+    lat, lon, times = squaretrack()
+    marks = squaremarks(tmp_path / "marks.gpx", lat, lon)
+    path = writegpx(tmp_path / "live.gpx", lat[:60], lon[:60], times[:60])
+
+    with mgg.Options(mgg.config, markfiles=[marks], usecache=False, filterwaypoints=True):
+        data, state = mgg.followload(path)
+        assert data['waypoints']['names'] == []
+        assert len(data['roundings']['names']) == 0
+
+        writegpx(path, lat, lon, times)
+        assert mgg.followpoll(state, data) == 340
+        assert state['newmarks']
+
+    assert data['waypoints']['names'] == ["Corner"]
+    assert data['roundings']['names'] == ["Corner"]
+    assert data['roundings']['rounded'][0]
+
+
+def test_follow_marks_match_a_full_load(tmp_path):
+    lat, lon, times = squaretrack()
+    marks = squaremarks(tmp_path / "marks.gpx", lat, lon)
+    path = writegpx(tmp_path / "live.gpx", lat[:60], lon[:60], times[:60])
+
+    with mgg.Options(mgg.config, markfiles=[marks], usecache=False, filterwaypoints=True):
+        data, state = mgg.followload(path)
+        for cut in (120, 250, 400):
+            writegpx(path, lat[:cut], lon[:cut], times[:cut])
+            mgg.followpoll(state, data)
+
+        full = mgg.loaddata(path)
+
+    assert data['waypoints']['names'] == full['waypoints']['names']
+    np.testing.assert_allclose(data['roundings']['time'], full['roundings']['time'])
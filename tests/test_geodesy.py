@@ -0,0 +1,95 @@
+import math
+
+import numpy as np
+import pytest
+
+import benchmark
+import marinegpxgrapher as mgg
+from conftest import sampleshort
+
+
+"""
+    A straight run of npts points stepnm apart on a bearing from lat0/lon0, as lat and lon
+"""
+def straightrun(lat0, lon0, bearing, npts, stepnm=0.01):
+    dist = np.arange(npts) * stepnm / mgg.earthrad
+    lat = np.degrees(dist * math.cos(math.radians(bearing))) + lat0
+    lon = np.degrees(dist * math.sin(math.radians(bearing)) / np.cos(np.radians(lat))) + lon0
+    return lat, lon
+
+
+"""
+    NM from each point to the next with mode and dtype
+"""
+def steps(lat, lon, mode, dtype="float64"):
+    with mgg.Options(mgg.config, geodesy=mode, dtype=dtype):
+        latnm, lonnm = mgg.projectlatlon(lat, lon, lat[0], lon[0])
+        return mgg.calcdist({'data':{'lat':lat, 'lon':lon, 'latnm':latnm, 'lonnm':lonnm}})
+
+
+def test_haversine_matches_the_formula_one_pair_at_a_time():
+    rng = np.random.default_rng(25)
+    lat = rng.uniform(-80., 80., 200)
+    lon = rng.uniform(-180., 180., 200)
+
+    expected = []
+    for lat1, lon1, lat2, lon2 in zip(lat[:-1], lon[:-1], lat[1:], lon[1:]):
+        a = math.sin(math.radians(lat2 - lat1) / 2.)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(math.radians(lon2 - lon1) / 2.)**2
+        expected.append(2. * mgg.earthrad * math.asin(math.sqrt(a)))
+
+    np.testing.assert_allclose(steps(lat, lon, "haversine"), expected, rtol=1e-12)
+
+
+@pytest.mark.parametrize('mode', sorted(mgg.geodesies))
+def test_every_mode_is_close_to_the_ellipsoid_round_a_race_course(mode):
+    lat, lon = straightrun(30.3, -90.1, 40., 500)
+    reference = benchmark.vincenty(lat, lon)
+
+    #the sphere is out by up to half a percent from the ellipsoid depending on latitude and direction
+    np.testing.assert_allclose(steps(lat, lon, mode), reference, rtol=5e-3)
+
+
+def test_transverse_mercator_holds_up_on_a_long_passage():
+    #100 NM heading north east, far enough that the sphere and the flat projection both show
+    lat, lon = straightrun(30.3, -90.1, 45., 10001)
+    reference = np.sum(benchmark.vincenty(lat, lon))
+
+    tm = np.sum(steps(lat, lon, "tm"))
+    assert tm / reference - 1. == pytest.approx(0., abs=1e-4)
+    assert abs(tm / reference - 1.) < abs(np.sum(steps(lat, lon, "equirectangular")) / reference - 1.)
+
+
+def test_transverse_mercator_is_true_on_the_central_meridian():
+    lat = np.array([30., 30.5, 31., 32.])
+    lon = np.full(4, -90.)
+    latnm, lonnm = mgg.transversemercator(lat, lon, lat[0], lon[0], np.float64)
+
+    assert latnm[0] == pytest.approx(0., abs=1e-9)
+    np.testing.assert_allclose(lonnm, 0., atol=1e-9)
+    np.testing.assert_allclose(latnm, np.concatenate(([0.], np.cumsum(benchmark.vincenty(lat, lon)))), rtol=1e-9)
+
+
+@pytest.mark.parametrize('mode', sorted(mgg.geodesies))
+def test_float32_only_rounds_the_offsets(mode):
+    data = mgg.loaddata(sampleshort)
+    lat, lon = data['data']['lat'], data['data']['lon']
+
+    with mgg.Options(mgg.config, geodesy=mode, dtype="float32"):
+        latnm, lonnm = mgg.projectlatlon(lat, lon, lat[0], lon[0])
+    assert latnm.dtype == np.float32 and lonnm.dtype == np.float32
+
+    #2 second steps are a few metres, float32 still gets them to well under a percent
+    single, double = steps(lat, lon, mode, "float32"), steps(lat, lon, mode)
+    assert single.dtype == np.float32
+    np.testing.assert_allclose(single, double, rtol=1e-3, atol=1e-6)
+    assert np.sum(single, dtype=np.float64) == pytest.approx(np.sum(double), rel=1e-5)
+
+
+def test_loaded_track_follows_the_geodesy(options):
+    equirectangular = mgg.loaddata(sampleshort)
+    options.update(geodesy="tm")
+    tm = mgg.loaddata(sampleshort)
+
+    #the cache keeps them apart
+    assert not np.array_equal(tm['data']['latnm'], equirectangular['data']['latnm'])
+    np.testing.assert_allclose(tm['data']['speed'][1:], equirectangular['data']['speed'][1:], rtol=5e-3)
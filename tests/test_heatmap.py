@@ -0,0 +1,82 @@
+import os
+
+import numpy as np
+
+import marinegpxgrapher as mgg
+import marinegpxheatmap
+from conftest import samplerace, sampleshort
+
+
+def test_track_cells_add_up_to_the_track(options):
+    result = marinegpxheatmap.heatreadtrack(sampleshort, None, dict(options))
+    data = mgg.loaddata(sampleshort)
+    elapsed = np.diff(data['data']['time'])
+
+    assert result['error'] == None
+    assert result['points'] == data['ptcount'] - 1
+    assert result['count'].sum() == np.count_nonzero(elapsed <= options['heatmapgap'])
+    assert result['seconds'].sum() == np.sum(elapsed[elapsed <= options['heatmapgap']])
+    assert np.all(result['tracks'] == 1.)
+
+
+def test_track_cells_match_a_loop_over_the_points(options):
+    result = marinegpxheatmap.heatreadtrack(sampleshort, None, dict(options))
+    data = mgg.loaddata(sampleshort)
+    latnm, lonnm = mgg.projectlatlon(data['data']['lat'], data['data']['lon'], result['origin'][0], result['origin'][1])
+    elapsed = np.diff(data['data']['time'])
+
+    seconds = {}
+    for idx in range(elapsed.shape[0]):
+        cell = int(mgg.gridcell(latnm[idx:idx + 1], lonnm[idx:idx + 1], options['heatmapcell'])[0])
+        if elapsed[idx] <= options['heatmapgap']:
+            seconds[cell] = seconds.get(cell, 0.) + elapsed[idx]
+
+    assert dict(zip(result['cells'].tolist(), result['seconds'].tolist())) == {cell:seconds.get(cell, 0.) for cell in result['cells'].tolist()}
+
+
+def test_merge_adds_shared_cells():
+    one = {'cells':np.array([1, 5, 9]), 'count':np.array([1., 2., 3.]), 'seconds':np.array([1., 2., 3.]), 'speed':np.array([4., 4., 4.]), 'tracks':np.ones(3)}
+    two = {'cells':np.array([5, 7]), 'count':np.array([10., 20.]), 'seconds':np.array([10., 20.]), 'speed':np.array([1., 1.]), 'tracks':np.ones(2)}
+    heat = marinegpxheatmap.mergeheat([one, two])
+
+    assert heat['cells'].tolist() == [1, 5, 7, 9]
+    assert heat['count'].tolist() == [1., 12., 20., 3.]
+    assert heat['tracks'].tolist() == [1., 2., 1., 1.]
+
+
+def test_same_track_twice_doubles_and_counts_two_tracks(options):
+    options['workers'] = 1
+    once = marinegpxheatmap.loadheat([sampleshort])
+    twice = marinegpxheatmap.loadheat([sampleshort, sampleshort])
+
+    np.testing.assert_array_equal(twice['cells'], once['cells'])
+    np.testing.assert_allclose(twice['seconds'], once['seconds'] * 2)
+    assert twice['trackcount'] == 2
+
+    options['heatmapvalue'] = 'tracks'
+    image = marinegpxheatmap.heatimage(twice)[0]
+    assert np.nanmax(image) == 2.
+
+
+def test_image_keeps_the_time_when_cells_are_merged(options):
+    options['workers'] = 1
+    heat = marinegpxheatmap.loadheat([samplerace])
+    fine, extent, size = marinegpxheatmap.heatimage(heat)
+
+    options['heatmappixels'] = 50
+    coarse, coarseextent, coarsesize = marinegpxheatmap.heatimage(heat)
+
+    assert max(coarse.shape) <= 50 < max(fine.shape)
+    assert coarsesize > size
+    np.testing.assert_allclose([np.nansum(coarse), np.nansum(fine)], heat['seconds'].sum() / 3600.)
+
+
+def test_broken_tracks_are_dropped_and_the_rest_drawn(tmp_path, options):
+    broken = tmp_path / "broken.gpx"
+    broken.write_text("<gpx><trk><trkseg><trkpt")
+    options.update(workers=1, outdir=str(tmp_path / "out"), batchformats=['png'])
+
+    heat = marinegpxheatmap.runheatmap([str(broken), sampleshort])
+
+    assert heat['trackcount'] == 1
+    assert os.path.exists(str(tmp_path / "out" / "heatmap.png"))
@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+import marinegpxgrapher as mgg
+from conftest import sampleshort, squaretrack, writegpx, writemarks
+
+
+@pytest.fixture
+def bigsquare(tmp_path, options):
+    #sides of 2000 seconds so each one is well over the leg window
+    options['usecache'] = False
+    lat, lon, times = squaretrack(npts=4000)
+    return writegpx(tmp_path / "square.gpx", lat, lon, times), lat, lon
+
+
+def test_timerange_is_the_points_in_the_range():
+    data = mgg.loaddata(sampleshort)
+    time = data['data']['time']
+
+    #on points, between points and off either end
+    for start, end in [(None, None), (600., 1200.), (time[10], time[20]), (time[10] + 0.5, time[20] - 0.5), (-100., 60.), (time[-1] - 1., time[-1] + 100.), (500., 400.)]:
+        sl = mgg.timerange(data, start, end)
+        inside = np.ones(time.shape[0], dtype=bool)
+        if start != None:
+            inside &= time >= start
+        if end != None:
+            inside &= time <= end
+
+        np.testing.assert_array_equal(np.arange(data['ptcount'])[sl], np.flatnonzero(inside))
+
+
+def test_sliceview_shares_the_arrays_and_moves_the_events(tmp_path, bigsquare, options):
+    path, lat, lon = bigsquare
+    options['markfiles'] = [writemarks(tmp_path / "marks.gpx", [("A", lat[999] - 0.0003, lon[999] + 0.0003), ("B", lat[2999] + 0.0003, lon[2999] - 0.0003)])]
+    data = mgg.loaddata(path)
+    view = mgg.sliceview(data, slice(1500, 3500), "part")
+
+    assert view['ptcount'] == 2000 and view['name'] == "Test track (part)"
+    for name in data['data']:
+        assert np.shares_memory(view['data'][name], data['data'][name])
+        np.testing.assert_array_equal(view['data'][name], data['data'][name][1500:3500])
+
+    #only B is in range, and its index counts from the start of the view
+    assert data['roundings']['names'] == ["A", "B"]
+    assert view['roundings']['names'] == ["B"]
+    assert view['roundings']['index'][0] == data['roundings']['index'][1] - 1500
+    assert 'stats' not in view and 'roundings' in data and len(data['roundings']['names']) == 2
+
+
+def test_legs_split_at_the_corners(bigsquare):
+    data = mgg.loaddata(bigsquare[0])
+    mgg.findlegs(data)
+    legs = data['legs']
+
+    assert legs['source'] == "course changes"
+    assert list(legs['start']) == [0] + list(legs['end'][:-1])
+    assert legs['end'][-1] == data['ptcount'] - 1
+    #the corners are after points 999, 1999 and 2999
+    np.testing.assert_allclose(legs['end'][:-1], [999, 1999, 2999], atol=2)
+
+
+def test_legs_split_at_roundings_when_there_are_marks(tmp_path, bigsquare, options):
+    path, lat, lon = bigsquare
+    options['markfiles'] = [writemarks(tmp_path / "marks.gpx", [("Corner", lat[1999] - 0.0003, lon[1999] - 0.0003)])]
+    data = mgg.loaddata(path)
+    mgg.findlegs(data)
+
+    assert data['legs']['source'] == "mark roundings"
+    assert list(data['legs']['end']) == [data['roundings']['index'][0], data['ptcount'] - 1]
+
+
+def test_select_leg_and_time_together(bigsquare, options):
+    data = mgg.loaddata(bigsquare[0])
+
+    options.update(leg=2)
+    leg = mgg.selectrange(data)
+    legs = data['legs']
+    np.testing.assert_array_equal(leg['data']['time'], data['data']['time'][legs['start'][1]:legs['end'][1] + 1])
+
+    #minutes from the start of the track, cut down to what's in the leg
+    options.update(rangefrom=40., rangeto=300.)
+    both = mgg.selectrange(data)
+    assert both['data']['time'][0] == pytest.approx(2400., abs=2.)
+    assert both['data']['time'][-1] == leg['data']['time'][-1]
+    assert both['name'].endswith("(leg 2, 40-300 min)")
+
+    options.update(leg=9)
+    with pytest.raises(mgg.TrackError) as error:
+        mgg.selectrange(data)
+    assert error.value.code == 13
+
+
+def test_track_legs(bigsquare):
+    track = mgg.Track.load(bigsquare[0])
+
+    assert track.legs()['start'].shape[0] == 4
+    third = track.leg(3)
+    legs = track.legs()
+    np.testing.assert_array_equal(third.speed, track.speed[legs['start'][2]:legs['end'][2] + 1])
+
+    with pytest.raises(mgg.TrackError) as error:
+        track.leg(5)
+    assert error.value.code == 13
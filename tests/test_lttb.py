@@ -0,0 +1,94 @@
+import math
+
+import numpy as np
+import pytest
+
+import marinegpxgrapher as mgg
+
+
+"""
+    Largest-Triangle-Three-Buckets written out point by point the way it was first published
+"""
+def slowlttb(x, y, threshold):
+    n = len(x)
+    every = (n - 2) / float(threshold - 2)
+    selected = [0]
+    a = 0
+
+    for i in range(threshold - 2):
+        nextstart = int(math.floor((i + 1) * every)) + 1
+        nextend = min(int(math.floor((i + 2) * every)) + 1, n)
+        avgx = sum(x[nextstart:nextend]) / (nextend - nextstart)
+        avgy = sum(y[nextstart:nextend]) / (nextend - nextstart)
+
+        start = int(math.floor(i * every)) + 1
+        end = int(math.floor((i + 1) * every)) + 1
+        best = -1.
+        for j in range(start, end):
+            area = abs((x[a] - avgx) * (y[j] - y[a]) - (x[a] - x[j]) * (avgy - y[a]))
+            if area > best:
+                best = area
+                pick = j
+
+        selected.append(pick)
+        a = pick
+
+    return selected + [n - 1]
+
+
+@pytest.mark.parametrize('n,maxpts', [(1000, 100), (1001, 3), (5000, 777), (257, 256)])
+def test_lttb_matches_the_published_algorithm(n, maxpts):
+    rng = np.random.default_rng(n)
+    x = np.cumsum(rng.random(n))
+    y = np.cumsum(rng.normal(size=n))
+
+    selected = mgg.lttb(x, y, maxpts)
+
+    assert selected.tolist() == slowlttb(x.tolist(), y.tolist(), maxpts)
+    assert selected.shape[0] == maxpts
+
+
+def test_lttb_leaves_short_lines_alone():
+    x = np.arange(10.)
+    assert mgg.lttb(x, x, 10).tolist() == list(range(10))
+    assert mgg.lttb(x, x, 2).tolist() == list(range(10))
+
+
+def test_decimate_keeps_the_extremes():
+    rng = np.random.default_rng(1)
+    x = np.arange(10000.)
+    y = rng.normal(size=10000)
+    colour = rng.normal(size=10000)
+    colour[1234] = 50.
+    colour[4321] = np.nan
+
+    idx = mgg.decimate(x, y, 500, (colour,))
+
+    assert idx.shape[0] <= 500
+    assert np.all(np.diff(idx) > 0)
+    assert {0, 9999, 1234, int(np.nanargmin(colour)), int(np.argmax(y)), int(np.argmin(y))} <= set(idx.tolist())
+    assert mgg.decimate(x, y, None).shape[0] == 10000
+
+
+def test_zooming_redraws_from_the_full_line(options):
+    plt = mgg.loadpyplot('Agg')
+    options['maxpoints'] = 200
+    x = np.linspace(0., 100., 20001)
+    y = np.sin(x * 7.)
+
+    fig, ax = plt.subplots()
+    line = mgg.plottimeseries(ax, x, y)
+    assert line.get_xdata().shape[0] <= 200
+
+    ax.set_xlim(10., 11.)
+    shown = line.get_xdata()
+    inside = np.count_nonzero((x >= 10.) & (x <= 11.))
+    assert inside > 180
+    assert shown.shape[0] <= 200
+    #one point either side so the line runs off the edges
+    assert shown[0] < 10. and shown[-1] > 11.
+    assert np.all((shown >= 10. - 0.005) & (shown <= 11. + 0.005))
+
+    ax.set_xlim(10., 10.5)
+    np.testing.assert_array_equal(line.get_xdata(), x[(x >= 10. - 0.005) & (x <= 10.5 + 0.005)])
+    plt.close(fig)
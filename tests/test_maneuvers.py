@@ -0,0 +1,54 @@
+import numpy as np
+
+import marinegpxgrapher as mgg
+from conftest import writegpx
+
+
+"""
+    Beat up the course, tacking between 45 and 315 degrees every legtime seconds at 5 knots, then run back down gybing
+    the boat slows to 2 knots for the first 30 seconds after each tack, gybes cost nothing
+"""
+def zigzag(path, legs=6, legtime=240):
+    headings = []
+    speeds = []
+    for leg in range(legs):
+        headings += [45. if leg % 2 == 0 else 315.] * legtime
+        speeds += ([2.] * 30 if leg > 0 else [5.] * 30) + [5.] * (legtime - 30)
+    for leg in range(legs):
+        headings += [135. if leg % 2 == 0 else 225.] * legtime
+        speeds += [5.] * legtime
+    headings = np.array(headings)
+
+    dist = np.array(speeds) / 3600. / 60.
+    lat = 30.3 + np.cumsum(dist * np.cos(np.radians(headings)))
+    lon = -90.05 + np.cumsum(dist * np.sin(np.radians(headings)) / np.cos(np.radians(30.3)))
+    stamps = np.datetime64('2018-07-28T22:00:00', 's') + np.arange(headings.shape[0]).astype('timedelta64[s]')
+
+    return writegpx(path, lat, lon, [stamp + "Z" for stamp in np.datetime_as_string(stamps, unit='s')])
+
+
+def test_not_found_on_a_plain_load(squaregpx):
+    assert 'maneuvers' not in mgg.loaddata(squaregpx)
+
+
+def test_tacks_and_gybes(tmp_path, options):
+    options.update(maneuvers=True, wind=0.)
+    data = mgg.loaddata(zigzag(tmp_path / "zigzag.gpx"))
+
+    kinds = data['maneuvers']['kind']
+    assert kinds.count("tack") == 5
+    assert kinds.count("gybe") == 5
+    assert np.all(np.abs(data['maneuvers']['turn']) > 60.)
+
+
+def test_wind_worked_out_when_not_given(tmp_path, options):
+    options.update(maneuvers=True)
+    data = mgg.loaddata(zigzag(tmp_path / "zigzag.gpx"))
+
+    assert abs(((data['maneuvers']['wind'] + 180.) % 360.) - 180.) < 20.
+
+
+def test_track_graphs_leave_them_out_unless_asked(squaregpx):
+    track = mgg.Track.load(squaregpx)
+    track.figures('Agg')
+    assert 'maneuvers' not in track.data
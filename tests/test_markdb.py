@@ -0,0 +1,81 @@
+import os
+
+import numpy as np
+import pytest
+
+import marinegpxgrapher as mgg
+from conftest import samplemarks, sampleshort, writemarks
+
+
+def allmarks():
+    marks = mgg.parsemarkfile(samplemarks)[0]
+    return np.array([mark[1] for mark in marks]), np.array([mark[2] for mark in marks])
+
+
+@pytest.mark.parametrize('names', [None, ["SYC*"], ["*1", "SL?_*"], ["[A-M]*"], ['SYC "[A-F]"'], ["nothing like it"]])
+def test_query_matches_filtering_the_file(options, names):
+    lat, lon = allmarks()
+    rng = np.random.default_rng(15)
+    markdb = mgg.openmarkdb()
+    mgg.refreshmarkdb(markdb, [samplemarks])
+
+    boxes = [None, (lat.min() - 1., lat.max() + 1., lon.min() - 1., lon.max() + 1.)]
+    for i in range(20):
+        boxes.append(tuple(np.sort(rng.uniform(lat.min(), lat.max(), 2))) + tuple(np.sort(rng.uniform(lon.min(), lon.max(), 2))))
+    #a box edge right on a mark, those are outside for both
+    boxes.append((lat[0], lat.max() + 1., lon.min() - 1., lon.max() + 1.))
+
+    for bounds in boxes:
+        assert sorted(mgg.querymarks(markdb, [samplemarks], bounds, names)) == mgg.filtermarks([samplemarks], bounds, names), bounds
+
+    markdb['db'].close()
+
+
+def test_changed_mark_file_is_indexed_again(tmp_path, options, monkeypatch):
+    path = writemarks(tmp_path / "marks.gpx", [("One", 30.1, -90.1), ("Two", 30.2, -90.2)])
+    markdb = mgg.openmarkdb()
+    mgg.refreshmarkdb(markdb, [path])
+    assert [mark[0] for mark in mgg.querymarks(markdb, [path])] == ["One", "Two"]
+
+    #touched without changing isn't parsed again
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+    parse = mgg.parsemarkfile
+    monkeypatch.setattr(mgg, 'parsemarkfile', lambda filename: pytest.fail("parsed again"))
+    mgg.refreshmarkdb(markdb, [path])
+
+    #same size but a different mark
+    monkeypatch.setattr(mgg, 'parsemarkfile', parse)
+    writemarks(path, [("One", 30.1, -90.1), ("Six", 30.2, -90.2)])
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2000000000))
+    mgg.refreshmarkdb(markdb, [path])
+    assert [mark[0] for mark in mgg.querymarks(markdb, [path])] == ["One", "Six"]
+
+    #no marks left behind in the box index either
+    if markdb['rtree']:
+        assert markdb['db'].execute("SELECT COUNT(*) FROM markbox").fetchone()[0] == 2
+
+    markdb['db'].close()
+
+
+def test_loaded_waypoints_are_the_same_with_or_without_the_db(options):
+    options.update(markfiles=[samplemarks], marknames=["PYC*", "*1"])
+    withdb = mgg.loaddata(sampleshort)['waypoints']
+    options['usecache'] = False
+    withoutdb = mgg.loaddata(sampleshort)['waypoints']
+
+    assert withdb['names'] == withoutdb['names']
+    assert withdb['names'] == ["L1", "M1", "PYC J"]
+    for key in ('lat', 'lon', 'latnm', 'lonnm'):
+        np.testing.assert_array_equal(withdb[key], withoutdb[key])
+
+
+def test_broken_db_falls_back_to_the_files(tmp_path, options):
+    options.update(markfiles=[samplemarks], markdb=str(tmp_path / "marks.sqlite"))
+    with open(options['markdb'], 'w') as f:
+        f.write("not a database at all")
+
+    data = mgg.loaddata(sampleshort)
+
+    options['usecache'] = False
+    assert data['waypoints']['names'] == mgg.loaddata(sampleshort)['waypoints']['names']
@@ -0,0 +1,95 @@
+import xml.dom.minidom
+import xml.etree.ElementTree as ElementTree
+
+import numpy as np
+import pytest
+
+import marinegpxgrapher as mgg
+from conftest import samplerace, sampleshort, squaretrack, writegpx
+
+
+"""
+    What the old minidom reader got out of a file, the points and the track name
+"""
+def domparse(path):
+    root = xml.dom.minidom.parse(path)
+    points = root.getElementsByTagName("trkpt")
+    trk = root.getElementsByTagName("trk")
+
+    return {'lat':[float(point.getAttribute("lat")) for point in points], 'lon':[float(point.getAttribute("lon")) for point in points],
+            'time':[point.getElementsByTagName("time")[0].firstChild.data for point in points],
+            'name':trk[0].getElementsByTagName("name")[0].firstChild.data if len(trk[0].getElementsByTagName("name")) == 1 else None}
+
+
+@pytest.mark.parametrize('path', [samplerace, sampleshort])
+def test_parse_matches_minidom(path):
+    data = {}
+    points = mgg.parsegpx(path, data, initsize=16)
+    dom = domparse(path)
+
+    assert points['count'] == len(dom['lat'])
+    assert points['lat'].tolist() == dom['lat']
+    assert points['lon'].tolist() == dom['lon']
+    assert points['time'] == dom['time']
+    assert data['name'] == dom['name']
+
+
+def test_file_fed_in_pieces_parses_the_same():
+    data = {'name':None}
+    whole = mgg.parsegpx(sampleshort, {})
+
+    state = mgg.newgpxstate(4)
+    parser = ElementTree.XMLPullParser(events=("start", "end"))
+    with open(sampleshort, 'rb') as f:
+        for block in iter(lambda: f.read(7), b''):
+            parser.feed(block)
+            mgg.gpxevents(parser.read_events(), state, data)
+    parser.close()
+    mgg.gpxevents(parser.read_events(), state, data)
+
+    assert state['count'] == whole['count']
+    np.testing.assert_array_equal(state['lat'][:state['count']], whole['lat'])
+    assert state['time'] == whole['time']
+
+
+def test_metadata_is_only_trusted_when_there_is_one_block(tmp_path):
+    lat, lon, times = squaretrack(npts=10)
+    path = writegpx(tmp_path / "meta.gpx", lat, lon, times)
+    text = open(path).read()
+    metadata = '<metadata><time>2018-07-28T22:00:00Z</time><bounds minlat="30" minlon="-91" maxlat="31" maxlon="-90"/></metadata>'
+
+    with open(path, 'w') as f:
+        f.write(text.replace("<trk>", metadata + "<trk>"))
+    data = {}
+    assert mgg.parsegpx(path, data)['hasmetadata']
+    assert (data['time'], data['minlat'], data['maxlon']) == ("2018-07-28T22:00:00Z", 30., -90.)
+
+    with open(path, 'w') as f:
+        f.write(text.replace("<trk>", metadata + metadata + "<trk>"))
+    data = {}
+    assert not mgg.parsegpx(path, data)['hasmetadata']
+    assert 'time' not in data and 'minlat' not in data
+
+
+def test_name_comes_from_the_first_track_and_namespaces_dont_matter(tmp_path):
+    path = tmp_path / "plain.gpx"
+    path.write_text('<gpx><trk><name>First</name><trkseg><trkpt lat="30.1" lon="-90.1"><time>2018-07-28T22:00:00Z</time></trkpt></trkseg></trk>'
+                    '<trk><name>Second</name><trkseg><trkpt lat="30.2" lon="-90.2"><time>2018-07-28T22:00:02Z</time></trkpt></trkseg></trk></gpx>')
+    data = {}
+    points = mgg.parsegpx(str(path), data)
+
+    assert data['name'] == "First"
+    assert points['lat'].tolist() == [30.1, 30.2]
+    assert points['segcount'] == 2
+
+
+def test_bad_files(tmp_path):
+    broken = tmp_path / "broken.gpx"
+    broken.write_text("<gpx><trk><trkseg><trkpt")
+    empty = tmp_path / "empty.gpx"
+    empty.write_text("<gpx><trk><trkseg></trkseg></trk></gpx>")
+
+    for path, code in ((broken, 2), (empty, 100), (tmp_path / "missing.gpx", 5)):
+        with pytest.raises(mgg.TrackError) as e:
+            mgg.loaddata(str(path))
+        assert e.value.code == code
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+import marinegpxgrapher as mgg
+import marinegpxpolar
+from conftest import samplerace, sampleshort
+
+
+def test_aggregate_matches_a_loop_over_the_points():
+    data = mgg.loaddata(sampleshort)
+    polar, points = marinegpxpolar.polaraggregate(data)
+    params = marinegpxpolar.polarparams()
+
+    count = np.zeros((params['sectors'], 24), dtype=np.int64)
+    total = np.zeros((params['sectors'], 24))
+    peak = np.zeros((params['sectors'], 24))
+    for speed, heading, time, lon in zip(data['data']['speed'], data['data']['angle'], data['data']['time'], data['data']['lon']):
+        if not np.isfinite(speed) or speed < params['minspeed']:
+            continue
+        sector = min(int(heading / (360. / params['sectors'])), params['sectors'] - 1)
+        hour = int(((data['starttime'] + time) / 3600. + lon / 15.) % 24.)
+        count[sector, hour] += 1
+        total[sector, hour] += speed
+        peak[sector, hour] = max(peak[sector, hour], speed)
+
+    assert points == count.sum() == polar['hist'].sum()
+    np.testing.assert_array_equal(polar['count'], count)
+    np.testing.assert_allclose(polar['total'], total)
+    np.testing.assert_allclose(polar['peak'], peak)
+
+
+def test_percentile_is_within_a_bin_of_the_points(options):
+    options['polarspeedstep'] = 0.1
+    data = mgg.loaddata(samplerace)
+    polar = marinegpxpolar.polaraggregate(data)[0]
+    p90 = marinegpxpolar.polarpercentile(polar, marinegpxpolar.polarparams(), 0.9)
+
+    speed = data['data']['speed']
+    keep = np.isfinite(speed) & (speed >= options['polarminspeed'])
+    sector = np.minimum((data['data']['angle'][keep] / 10.).astype(int), 35)
+    for idx in range(36):
+        inside = speed[keep][sector == idx]
+        if inside.shape[0] >= options['polarminpoints']:
+            lower = np.quantile(inside, 0.9, method='lower')
+            higher = np.quantile(inside, 0.9, method='higher')
+            assert lower - 0.1 <= p90[idx] <= higher + 0.1
+        else:
+            assert np.isnan(p90[idx])
+
+
+def test_store_round_trip_and_skips_races_it_has(tmp_path, options):
+    options['polarstore'] = str(tmp_path / "season.npz")
+    store = marinegpxpolar.loadpolarstore(options['polarstore'])
+    assert marinegpxpolar.addpolarraces(store, [samplerace, sampleshort]) == 2
+    marinegpxpolar.savepolarstore(store)
+
+    again = marinegpxpolar.loadpolarstore(options['polarstore'])
+    assert again['races'] == store['races']
+    for key in marinegpxpolar.polararrays:
+        np.testing.assert_array_equal(again['polar'][key], store['polar'][key])
+
+    assert marinegpxpolar.addpolarraces(again, [sampleshort]) == 0
+
+
+def test_lost_store_is_rebuilt_from_the_race_polars(tmp_path, options, monkeypatch):
+    options['polarstore'] = str(tmp_path / "season.npz")
+    store = marinegpxpolar.loadpolarstore(options['polarstore'])
+    marinegpxpolar.addpolarraces(store, [sampleshort])
+
+    monkeypatch.setattr(marinegpxpolar, 'polarrace', lambda path, workerconfig: pytest.fail("race was loaded again"))
+    rebuilt = marinegpxpolar.loadpolarstore(options['polarstore'])
+    assert marinegpxpolar.addpolarraces(rebuilt, [sampleshort]) == 1
+    np.testing.assert_array_equal(rebuilt['polar']['hist'], store['polar']['hist'])
+
+
+def test_store_with_other_settings_is_refused(tmp_path, options):
+    options['polarstore'] = str(tmp_path / "season.npz")
+    store = marinegpxpolar.loadpolarstore(options['polarstore'])
+    marinegpxpolar.addpolarraces(store, [sampleshort])
+    marinegpxpolar.savepolarstore(store)
+
+    options['polarsectors'] = 24
+    with pytest.raises(mgg.TrackError) as e:
+        marinegpxpolar.loadpolarstore(options['polarstore'])
+    assert e.value.code == 14
+
+
+def test_race_that_wont_load_is_dropped(tmp_path, options):
+    options['polarstore'] = str(tmp_path / "season.npz")
+    broken = tmp_path / "broken.gpx"
+    broken.write_text("<gpx><trk><trkseg><trkpt")
+
+    store = marinegpxpolar.loadpolarstore(options['polarstore'])
+    assert marinegpxpolar.addpolarraces(store, [str(broken)]) == 0
+    assert store['races'] == {}
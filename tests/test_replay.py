@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+import marinegpxgrapher as mgg
+import marinegpxreplay
+from conftest import squaretrack, writegpx
+
+
+@pytest.fixture
+def square(tmp_path, options):
+    lat, lon, times = squaretrack()
+    options.update(figsize=(3, 3), replayfps=25, replayspeed=30., replaytrail=60.)
+    mgg.loadpyplot('Agg')
+    return mgg.loaddata(writegpx(tmp_path / "square.gpx", lat, lon, times))
+
+
+def test_frames_match_a_loop_over_the_points(square, options):
+    frames = marinegpxreplay.replayframes(square)
+    time = square['data']['time']
+    step = options['replayspeed'] / options['replayfps']
+
+    assert frames['count'] == int(time[-1] // step) + 1
+    for k in range(0, frames['count'], 37):
+        inside = [idx for idx in range(time.shape[0]) if frames['time'][k] - options['replaytrail'] <= time[idx] <= frames['time'][k]]
+        assert (frames['lo'][k], frames['hi'][k]) == (inside[0], inside[-1] + 1)
+        assert frames['x'][k] == pytest.approx(np.interp(k * step, time, square['data']['lonnm']))
+
+
+def test_blitted_frame_is_the_same_as_drawing_it_fresh(square):
+    state = marinegpxreplay.makereplay(square)
+    for k in range(0, 300, 50):
+        marinegpxreplay.replaydraw(state, k)
+    blitted = marinegpxreplay.replaydraw(state, 300).copy()
+
+    fresh = marinegpxreplay.makereplay(square)
+    np.testing.assert_array_equal(marinegpxreplay.replaydraw(fresh, 300), blitted)
+
+
+def test_gif_from_several_workers_has_every_frame(square, options, tmp_path):
+    from PIL import Image
+
+    options['workers'] = 2
+    count = marinegpxreplay.replayframes(square)['count']
+    assert count >= 500
+
+    filename = marinegpxreplay.exportreplay(square, str(tmp_path / "replay.gif"))
+
+    with Image.open(filename) as image:
+        assert image.n_frames == count
+
+
+def test_replay_formats(square, options, tmp_path, monkeypatch):
+    import matplotlib
+
+    with pytest.raises(mgg.TrackError) as e:
+        marinegpxreplay.exportreplay(square, str(tmp_path / "replay.avi"))
+    assert e.value.code == 15
+
+    monkeypatch.setitem(matplotlib.rcParams, 'animation.ffmpeg_path', str(tmp_path / "no-ffmpeg-here"))
+    with pytest.raises(mgg.TrackError) as e:
+        marinegpxreplay.exportreplay(square, str(tmp_path / "replay.mp4"))
+    assert e.value.code == 15
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+import marinegpxgrapher as mgg
+
+
+def bruteewma(values, alpha):
+    out = np.empty(values.shape[0])
+    out[0] = values[0]
+    for i in range(1, values.shape[0]):
+        if np.isfinite(values[i]):
+            out[i] = out[i - 1] + alpha[i - 1] * (values[i] - out[i - 1])
+        else:
+            out[i] = out[i - 1]
+    return out
+
+
+@pytest.fixture
+def speeds():
+    return np.random.default_rng(3).uniform(0., 9., 5000)
+
+
+def test_points_mean_matches_brute_force(speeds):
+    out = mgg.rollwindow_points(speeds, 20)
+    expected = [np.mean(speeds[i - 20:i]) for i in range(20, speeds.shape[0])]
+    np.testing.assert_allclose(out[20:], expected, rtol=1e-10)
+    assert np.allclose(out[:20], np.mean(speeds[:19]))
+
+
+def test_seconds_mean_matches_brute_force(speeds):
+    times = np.cumsum(np.random.default_rng(4).integers(1, 5, speeds.shape[0])).astype(float)
+    out = mgg.rollwindow_seconds(speeds, times, 30.)
+    expected = [np.mean(speeds[(times > times[i] - 30.) & (times <= times[i])]) for i in range(speeds.shape[0])]
+    np.testing.assert_allclose(out, expected, rtol=1e-10)
+
+
+def test_median_matches_brute_force(speeds):
+    out = mgg.rollwindow_points(speeds, 15, "median")
+    expected = [np.median(speeds[i - 15:i]) for i in range(15, speeds.shape[0])]
+    np.testing.assert_allclose(out[15:], expected)
+
+
+def test_mean_inf_only_spoils_its_own_windows(speeds):
+    speeds[100] = np.inf
+    out = mgg.rollwindow_points(speeds, 20)
+    assert np.isinf(out[101:121]).all()
+    assert np.isfinite(out[121:]).all()
+    np.testing.assert_allclose(out[121:], [np.mean(speeds[i - 20:i]) for i in range(121, speeds.shape[0])], rtol=1e-10)
+
+
+def test_ewma_matches_brute_force(speeds):
+    alpha = np.random.default_rng(5).uniform(0.01, 0.9, speeds.shape[0] - 1)
+    np.testing.assert_allclose(mgg.ewma(speeds, alpha), bruteewma(speeds, alpha), rtol=1e-9)
+
+
+def test_ewma_holds_over_inf_and_nan(speeds):
+    speeds[[100, 2000]] = np.inf
+    speeds[3000] = np.nan
+    alpha = np.full(speeds.shape[0] - 1, 2. / 21.)
+    out = mgg.ewma(speeds, alpha)
+
+    assert np.isfinite(out).all()
+    np.testing.assert_allclose(out, bruteewma(speeds, alpha), rtol=1e-9)
+    assert out[100] == out[99]
+
+
+def test_ewma_starts_at_first_finite_value():
+    out = mgg.ewma(np.array([np.inf, np.nan, 2., 4.]), np.full(3, 0.5))
+    assert np.isinf(out[:2]).all()
+    np.testing.assert_allclose(out[2:], [2., 3.])
+
+
+def test_ewma_carries_on_from_start():
+    values = np.random.default_rng(6).uniform(0., 9., 300)
+    alpha = np.full(299, 0.1)
+    whole = mgg.ewma(values, alpha)
+    np.testing.assert_allclose(mgg.ewma(values[150:], alpha[150:], start=whole[150]), whole[150:], rtol=1e-9)
+
+
+def test_ewma_speedavg_survives_duplicate_time_stamp(options):
+    data = {'data':{'time':np.array([0., 1., 1., 2., 3.]), 'speed':np.array([4., 5., np.inf, 6., 7.])}}
+    mgg.calcspeed_rollavg(data, 3, "ewma")
+    assert np.isfinite(data['data']['speedavg']).all()
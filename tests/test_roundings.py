@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+import marinegpxgrapher as mgg
+from conftest import squaretrack, writegpx, writemarks
+
+
+"""
+    Every (point, mark) pair within radius the slow way, sorted so it can be compared with nearmarks()
+"""
+def bruteforce(latnm, lonnm, marklatnm, marklonnm, radius):
+    dist = np.hypot(latnm[:, None] - marklatnm[None, :], lonnm[:, None] - marklonnm[None, :])
+    ptidx, markidx = np.nonzero(dist <= radius)
+    return ptidx, markidx, dist[ptidx, markidx]
+
+
+def sortpairs(ptidx, markidx, dist):
+    order = np.lexsort((markidx, ptidx))
+    return ptidx[order], markidx[order], dist[order]
+
+
+@pytest.mark.parametrize('radius', [0.05, 0.1, 0.5])
+def test_nearmarks_finds_the_same_pairs_as_checking_them_all(radius):
+    rng = np.random.default_rng(14)
+    #either side of zero so the negative cells get tried too
+    latnm, lonnm = rng.uniform(-3., 3., (2, 5000))
+    marklatnm, marklonnm = rng.uniform(-3., 3., (2, 300))
+    #some marks sitting right on the cell edges
+    marklatnm[:20] = np.round(marklatnm[:20] / radius) * radius
+    marklonnm[20:40] = np.round(marklonnm[20:40] / radius) * radius
+
+    grid = mgg.markgrid(marklatnm, marklonnm, radius)
+    found = sortpairs(*mgg.nearmarks(grid, latnm, lonnm, radius))
+    expected = sortpairs(*bruteforce(latnm, lonnm, marklatnm, marklonnm, radius))
+
+    assert found[0].shape[0] > 0
+    for got, want in zip(found, expected):
+        np.testing.assert_array_equal(got, want)
+
+
+def test_nearmarks_with_nothing_near():
+    grid = mgg.markgrid(np.array([50.]), np.array([50.]), 0.1)
+    ptidx, markidx, dist = mgg.nearmarks(grid, np.zeros(10), np.zeros(10), 0.1)
+
+    assert ptidx.shape == markidx.shape == dist.shape == (0,)
+
+
+"""
+    The square track with marks from marks, as (name, point index, dlat, dlon) offsets from a track point
+"""
+def squarewithmarks(tmp_path, options, marks):
+    lat, lon, times = squaretrack()
+    path = writegpx(tmp_path / "square.gpx", lat, lon, times)
+    options['markfiles'] = [writemarks(tmp_path / "marks.gpx", [(name, lat[idx] + dlat, lon[idx] + dlon) for name, idx, dlat, dlon in marks])]
+    options['usecache'] = False
+    return mgg.loaddata(path)
+
+
+def test_corners_are_rounded_and_legs_are_passed(tmp_path, options):
+    #square goes north, east, south then west so every corner is a right turn
+    #the start mark gets passed again as the square closes
+    data = squarewithmarks(tmp_path, options, [("Corner", 199, -0.0003, -0.0003), ("Leg", 50, 0., 0.0005), ("Start", 0, 0., 0.0002)])
+    roundings = data['roundings']
+
+    assert roundings['names'] == ["Start", "Leg", "Corner", "Start"]
+    assert list(roundings['rounded']) == [False, False, True, False]
+    assert roundings['turn'][2] == pytest.approx(90., abs=10.)
+    assert abs(roundings['turn'][1]) < 10.
+    #nothing to turn from at the ends of the track
+    assert roundings['turn'][0] == 0. and roundings['turn'][3] == 0.
+
+    assert roundings['index'][1] == 50
+    np.testing.assert_array_equal(roundings['time'], data['data']['time'][roundings['index']])
+    assert np.all(roundings['distance'] <= mgg.config['markradius'])
+
+
+def test_roundings_match_checking_every_point(tmp_path, options):
+    data = squarewithmarks(tmp_path, options, [("Corner", 99, 0.0002, 0.0002), ("Leg", 150, 0.0004, 0.), ("Other", 300, 0., -0.0004)])
+    waypoints = data['waypoints']
+    radius = mgg.config['markradius']
+
+    ptidx, markidx, dist = bruteforce(np.asarray(data['data']['latnm']), np.asarray(data['data']['lonnm']), waypoints['latnm'], waypoints['lonnm'], radius)
+    #closest point to each mark, the track only passes each of them once
+    expected = sorted((ptidx[markidx == mark][np.argmin(dist[markidx == mark])], waypoints['names'][mark]) for mark in np.unique(markidx))
+
+    assert list(zip(data['roundings']['index'], data['roundings']['names'])) == expected
+
+
+def test_roundings_dont_depend_on_the_chunk_size(tmp_path, options):
+    data = squarewithmarks(tmp_path, options, [("Corner", 199, -0.0003, -0.0003), ("Leg", 250, 0., 0.0005)])
+    whole = data['roundings']
+
+    for chunksize in (1, 7, 100, 199):
+        mgg.markroundings(data, mgg.config['markradius'], chunksize=chunksize)
+        assert data['roundings']['names'] == whole['names']
+        for key in ('index', 'time', 'distance', 'turn', 'rounded'):
+            np.testing.assert_array_equal(data['roundings'][key], whole[key])
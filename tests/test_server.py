@@ -0,0 +1,126 @@
+import contextvars
+import http.server
+import json
+import shutil
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+import marinegpxgrapher as mgg
+import marinegpxserver
+from conftest import sampleshort
+
+
+def test_lru_drops_the_least_recently_used():
+    lru = marinegpxserver.newlru(3)
+    marinegpxserver.lruput(lru, 'a', 1)
+    marinegpxserver.lruput(lru, 'b', 2)
+    marinegpxserver.lruput(lru, 'c', 3)
+    assert marinegpxserver.lruget(lru, 'a') == 1
+
+    marinegpxserver.lruput(lru, 'd', 4)
+    assert marinegpxserver.lruget(lru, 'b') == None
+    assert [marinegpxserver.lruget(lru, key) for key in 'acd'] == [1, 3, 4]
+    assert (lru['hits'], lru['misses']) == (4, 1)
+
+
+def test_lru_sizes():
+    lru = marinegpxserver.newlru(10)
+    marinegpxserver.lruput(lru, 'a', "aaaa", 4)
+    marinegpxserver.lruput(lru, 'b', "bbbbbb", 6)
+    marinegpxserver.lruput(lru, 'c', "c" * 11, 11)
+    assert marinegpxserver.lruget(lru, 'c') == None
+    assert lru['size'] == 10
+
+    marinegpxserver.lruput(lru, 'a', "aaaaa", 5)
+    assert marinegpxserver.lruget(lru, 'b') == None
+    assert lru['size'] == 5
+
+
+"""
+    Run the server on a free port in a thread, yields the base url and stops it afterwards
+"""
+@pytest.fixture
+def server(tmp_path, options, monkeypatch):
+    shutil.copy(sampleshort, str(tmp_path / "race.gpx"))
+    options.update(servehost="127.0.0.1", serveport=0, workers=1)
+
+    started = []
+    class RecordingServer(http.server.ThreadingHTTPServer):
+        def serve_forever(self, *args, **kwargs):
+            started.append(self)
+            return super().serve_forever(*args, **kwargs)
+
+    monkeypatch.setattr(http.server, 'ThreadingHTTPServer', RecordingServer)
+
+    #the thread gets the test's options through a copy of its context
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(marinegpxserver.runserve, [str(tmp_path)]))
+    thread.start()
+    try:
+        for tries in range(500):
+            if started:
+                break
+            thread.join(0.01)
+        assert started, "server didn't start"
+
+        yield "http://127.0.0.1:%d" % started[0].server_address[1]
+
+    finally:
+        if started:
+            started[0].shutdown()
+        thread.join(30)
+
+
+def get(url):
+    try:
+        with urllib.request.urlopen(url, timeout=60) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+
+def test_index_and_view(server):
+    status, headers, body = get(server + "/")
+    assert status == 200
+    assert b'href="/view/race"' in body
+
+    status, headers, body = get(server + "/view/race?from=10")
+    assert status == 200
+    assert b'src="/graph/race/speed.png?from=10"' in body
+
+
+def test_graph_is_rendered_once_then_cached(server):
+    status, headers, body = get(server + "/graph/race/speed.png?rollavg_points=5")
+    assert status == 200
+    assert headers['X-Cache'] == "miss"
+    assert body.startswith(b"\x89PNG")
+
+    status, headers, again = get(server + "/graph/race/speed.png?rollavg_points=5")
+    assert headers['X-Cache'] == "hit"
+    assert again == body
+
+    status, headers, svg = get(server + "/graph/race/hist.svg")
+    assert status == 200
+    assert b"<svg" in svg
+
+
+def test_stats_match_the_library(server):
+    status, headers, body = get(server + "/stats/race?from=10&to=40")
+    stats = json.loads(body.decode('utf-8'))
+    track = mgg.Track.load(sampleshort).slice(600., 2400.)
+
+    assert status == 200
+    assert stats['distance'] == pytest.approx(track.stats()['distance'])
+    assert stats['name'] == track.name
+
+
+def test_bad_requests(server):
+    assert get(server + "/graph/nosuchtrack/speed.png")[0] == 404
+    assert get(server + "/graph/race/wind.png")[0] == 404
+    assert get(server + "/graph/race/speed.png?colour=red")[0] == 400
+    assert get(server + "/graph/race/speed.png?speedcmap=notacolormap")[0] == 400
+    assert get(server + "/graph/race/speed.png?rollavg_points=many")[0] == 400
+    assert get(server + "/stats/race?from=1000&to=1001")[0] == 400
+    assert get(server + "/nothing/here")[0] == 404
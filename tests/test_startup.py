@@ -0,0 +1,60 @@
+import json
+import os
+import subprocess
+import sys
+
+import marinegpxgrapher as mgg
+from conftest import repodir, sampleshort
+
+
+"""
+    Run python code in a fresh interpreter next to the program, returns what it printed
+"""
+def fresh(code, tmp_path):
+    env = dict(os.environ, XDG_CACHE_HOME=str(tmp_path / "xdg"))
+    return subprocess.check_output([sys.executable, "-c", code], cwd=repodir, env=env).decode().split()
+
+
+def test_import_and_stats_leave_matplotlib_alone(tmp_path):
+    printed = fresh("import sys, marinegpxgrapher as mgg\n"
+                    "print('matplotlib' in sys.modules)\n"
+                    "status = mgg.main(['-f', %r, '--stats-only'])\n"
+                    "print('matplotlib' in sys.modules, status)\n" % sampleshort, tmp_path)
+
+    assert printed[0] == "False"
+    assert printed[-2:] == ["False", "0"]
+
+
+def test_colormap_list_only_imports_matplotlib_once(tmp_path):
+    code = ("import sys, marinegpxgrapher as mgg\n"
+            "status = mgg.main(['-sc'])\n"
+            "print('matplotlib' in sys.modules, status)\n")
+
+    assert fresh(code, tmp_path)[-2:] == ["True", "0"]
+    #the second time the names come out of the cache
+    assert fresh(code, tmp_path)[-2:] == ["False", "0"]
+
+
+def test_colormap_names_are_cached_per_matplotlib(options, monkeypatch):
+    import matplotlib
+
+    monkeypatch.setattr(mgg, 'colormapcache', None)
+    names = mgg.colormapnames()
+    assert "viridis" in names and "gist_ncar" in names
+    assert names == sorted(matplotlib.colormaps)
+
+    filename = os.path.join(options['cachedir'], "colormaps-%s.json" % mgg.matplotlibstamp())
+    with open(filename) as f:
+        assert json.load(f) == names
+
+    #a different install has a different stamp, so a stale list is never read
+    with open(filename, 'w') as f:
+        json.dump(["stale"], f)
+    monkeypatch.setattr(mgg, 'colormapcache', None)
+    monkeypatch.setattr(mgg, 'matplotlibstamp', lambda: "another-install")
+    assert mgg.colormapnames() == names
+
+
+def test_bad_colormap_is_error_10(options, capsys):
+    assert mgg.main(["-f", sampleshort, "-cs", "not_a_colormap", "--cache-dir", options["cachedir"]]) == 10
+    assert "Bad colormap" in capsys.readouterr().out
@@ -0,0 +1,56 @@
+import calendar
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import marinegpxgrapher as mgg
+from conftest import squaretrack, writegpx
+
+
+stamps = ["2018-07-29T03:36:41Z", "2018-07-29T03:36:41.5Z", "2018-07-29T03:36:41.125+02:00", "2018-07-29T03:36:41-0530",
+          "2018-07-29T03:36:41.000001-03:00", "2016-02-29T23:59:59+00:00", "2018-12-31T23:30:00-01:00"]
+
+
+"""
+    What strptime makes of a stamp, in the formats checkdtformat tries
+"""
+def slowdecode(stamp):
+    for fstr in ("%Y-%m-%dT%H:%M:%S.%f%z", "%Y-%m-%dT%H:%M:%S.%fZ", "%Y-%m-%dT%H:%M:%S%z", "%Y-%m-%dT%H:%M:%SZ"):
+        try:
+            moment = datetime.strptime(stamp, fstr)
+        except ValueError:
+            continue
+        return calendar.timegm(moment.utctimetuple()), moment.microsecond / 1e6
+
+
+def test_decodetimes_matches_strptime():
+    secs, frac = mgg.decodetimes(stamps)
+
+    for idx, stamp in enumerate(stamps):
+        assert (secs[idx], frac[idx]) == pytest.approx(slowdecode(stamp), abs=1e-9), stamp
+
+
+def test_decodetimes_offset_without_minutes():
+    secs, frac = mgg.decodetimes(["2018-07-29T03:36:41+02", "2018-07-29T03:36:41.25-03", "2018-07-29T03:36:41+02:00"])
+    base = calendar.timegm((2018, 7, 29, 3, 36, 41))
+
+    assert list(secs) == [base - 7200, base + 10800, base - 7200]
+    assert list(frac) == [0., 0.25, 0.]
+
+
+def test_convdatetime_keeps_fractions_far_from_the_epoch():
+    start, times = mgg.convdatetime(["2018-07-29T03:36:41.125Z", "2018-07-29T03:36:42.250Z", "2018-07-29T04:36:41.000001Z"])
+
+    assert start == calendar.timegm((2018, 7, 29, 3, 36, 41)) + 0.125
+    np.testing.assert_allclose(times, [0., 1.125, 3599.875001], atol=1e-9)
+
+
+def test_point_without_time_is_left_out(tmp_path):
+    lat, lon, times = squaretrack(npts=40)
+    times[10] = None
+    data = mgg.loaddata(writegpx(tmp_path / "notime.gpx", lat, lon, times))
+
+    assert data['ptcount'] == 39
+    np.testing.assert_allclose(data['data']['lat'], np.delete(lat, 10))
+    np.testing.assert_allclose(data['data']['time'], np.delete(np.arange(40) * 2., 10))
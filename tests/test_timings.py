@@ -0,0 +1,58 @@
+import json
+import pstats
+import tracemalloc
+
+import marinegpxgrapher as mgg
+from conftest import sampleshort
+
+
+def test_stages_nest_and_record_points(options):
+    options['timings'] = True
+    del mgg.stagetimings[:]
+
+    with mgg.stage("outer", 10):
+        with mgg.stage("inner") as record:
+            record['points'] = 5
+
+    assert [(record['stage'], record['depth'], record['points']) for record in mgg.stagetimings] == [("outer", 0, 10), ("inner", 1, 5)]
+    assert mgg.stagetimings[0]['ms'] >= mgg.stagetimings[1]['ms'] >= 0.
+    del mgg.stagetimings[:]
+
+
+def test_nothing_is_recorded_without_timings(options):
+    del mgg.stagetimings[:]
+    mgg.loaddata(sampleshort)
+    assert mgg.stagetimings == []
+
+
+def test_timings_json_has_the_load_stages(tmp_path):
+    out = tmp_path / "timings.json"
+    status = mgg.main(["-f", sampleshort, "--stats-only", "--timings-json", str(out), "--cache-dir", str(tmp_path / "cache")])
+
+    with open(str(out)) as f:
+        records = json.load(f)
+    stages = [record['stage'] for record in records]
+
+    assert status == 0
+    assert stages.count("parsegpx") == 1 and "convdatetime" in stages and "calcspeed_rollavg" in stages
+    assert all(record['peakmb'] != None for record in records)
+    assert not tracemalloc.is_tracing()
+
+
+def test_runs_only_report_their_own_stages(tmp_path):
+    out = tmp_path / "timings.json"
+    for run in range(2):
+        mgg.main(["-f", sampleshort, "--stats-only", "--timings-json", str(out), "--cache-dir", str(tmp_path / "cache")])
+
+    with open(str(out)) as f:
+        stages = [record['stage'] for record in json.load(f)]
+
+    assert stages.count("cacheload") == 1
+
+
+def test_profile_is_written(tmp_path):
+    out = tmp_path / "run.prof"
+    assert mgg.main(["-f", sampleshort, "--stats-only", "--profile", str(out), "--cache-dir", str(tmp_path / "cache")]) == 0
+
+    stats = pstats.Stats(str(out))
+    assert any(function[2] == "loaddata" for function in stats.stats)
@@ -0,0 +1,81 @@
+import threading
+
+import numpy as np
+import pytest
+
+import marinegpxgrapher as mgg
+from conftest import samplerace, sampleshort
+
+
+def test_load_matches_loaddata(options):
+    track = mgg.Track.load(sampleshort)
+    data = mgg.loaddata(sampleshort)
+
+    assert len(track) == data['ptcount']
+    for name in mgg.derivedchannels:
+        np.testing.assert_array_equal(track.channel(name), data['data'][name])
+
+
+def test_tracks_keep_their_own_options():
+    short = mgg.Track.load(sampleshort, rollavg_points=5)
+    long = mgg.Track.load(sampleshort, rollavg_points=50)
+
+    assert not np.array_equal(short.speedavg, long.speedavg)
+    np.testing.assert_array_equal(short.speed, long.speed)
+    assert mgg.config['rollavg_points'] == mgg.defaultconfig['rollavg_points']
+
+
+def test_options_are_right_per_thread():
+    seen = {}
+
+    def work(points):
+        with mgg.Options(rollavg_points=points):
+            seen[points] = mgg.config['rollavg_points']
+
+    threads = [threading.Thread(target=work, args=(points,)) for points in (3, 7, 11)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert seen == {3:3, 7:7, 11:11}
+
+
+def test_unknown_options_are_refused():
+    with pytest.raises(TypeError):
+        mgg.Options(rollavgpoints=3)
+
+
+def test_nothing_printed(capsys):
+    track = mgg.Track.load(samplerace, markfiles=None)
+    track.derive()
+    track.stats()
+    assert capsys.readouterr().out == ""
+
+
+def test_missing_file_raises_trackerror(tmp_path):
+    with pytest.raises(mgg.TrackError) as error:
+        mgg.Track.load(str(tmp_path / "missing.gpx"))
+    assert error.value.code == 5
+
+
+def test_slice_is_the_time_range():
+    track = mgg.Track.load(sampleshort)
+    part = track.slice(600., 1200.)
+
+    assert part.time[0] >= 600. and part.time[-1] <= 1200.
+    np.testing.assert_array_equal(part.speed, track.speed[np.flatnonzero((track.time >= 600.) & (track.time <= 1200.))])
+
+
+def test_main_returns_exit_codes(capsys, tmp_path):
+    cache = ["--cache-dir", str(tmp_path)]
+    assert mgg.main(["-h"]) == 0
+    assert mgg.main(["--not-an-option"]) == 2
+    assert mgg.main(["-f", sampleshort, "-cs", "not-a-colormap"] + cache) == 10
+    assert mgg.main(["-f", "missing.gpx", "--stats-only"] + cache) == 5
+
+
+def test_main_leaves_the_defaults_alone(capsys, tmp_path):
+    assert mgg.main(["-f", sampleshort, "--stats-only", "-ra", "7", "--cache-dir", str(tmp_path)]) == 0
+    assert mgg.config['rollavg_points'] == mgg.defaultconfig['rollavg_points']
+    assert "Points:" in capsys.readouterr().out